@@ -1,4 +1,16 @@
+import atexit
+import os
+
 from flask import Flask
+from flask.helpers import get_debug_flag
+
+from .database import close_all_connections, init_app as init_database_app, init_database
+from .json_provider import init_app as init_json_provider
+
+
+def _is_reloader_parent():
+    # `flask run --debug` bật reloader: process cha chỉ theo dõi file, process con (WERKZEUG_RUN_MAIN) mới phục vụ
+    return get_debug_flag() and os.environ.get("WERKZEUG_RUN_MAIN") != "true"
 
 
 def create_app():
@@ -9,6 +21,12 @@ def create_app():
     
     # Thiết lập một secret key cho ứng dụng
     app.config['SECRET_KEY'] = 'your_super_secret_key_for_flask_app'
+
+    # Kết nối SQLite lấy từ pool, gắn theo vòng đời request
+    init_database_app(app)
+
+    # JSON provider nhanh (orjson / msgspec nếu có, không thì json chuẩn)
+    init_json_provider(app)
     
     # Đăng ký các routes từ file routes.py
     with app.app_context():
@@ -23,5 +41,15 @@ def create_app():
         app.register_blueprint(mxh_api.mxh_api_bp)
         app.register_blueprint(settings_routes.settings_bp)
         app.register_blueprint(image_routes.image_bp)
+
+    # Khởi tạo database rồi chạy nhắc hẹn notes ở thread nền ngay khi khởi động,
+    # không đợi request đầu tiên tới /notes
+    if not _is_reloader_parent():
+        init_database()
+        notes_routes.reminders.ensure_started()
+        # atexit chạy ngược thứ tự đăng ký: dừng nhắc hẹn (có thể đang ghi qua writer) trước,
+        # rồi writer chạy nốt các job đã nhận và đóng kết nối trong pool
+        atexit.register(close_all_connections)
+        atexit.register(notes_routes.reminders.stop)
     
     return app
@@ -1,31 +1,1214 @@
+import hashlib
+import json
 import os
+import queue
 import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+from concurrent.futures import TimeoutError as FutureTimeout
 from datetime import datetime
 
+import click
+from flask import g, has_app_context
+from flask.cli import AppGroup
+
+from app.html_text import HTML_TEXT_VERSION, html_to_text, text_preview
+from app.mxh_queries import check_list_query_plans, table_columns
+
 APP_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
 DATA_DIR = os.path.join(APP_ROOT, "data")
 DATABASE_PATH = os.path.join(DATA_DIR, "Data.db")
 
-def get_db_connection():
+# --- CONNECTION POOL ---
+# Số kết nối rảnh tối đa được giữ lại cho mỗi loại (ghi / chỉ đọc)
+POOL_MAX_IDLE = 8
+
+# Các PRAGMA áp dụng MỘT LẦN khi tạo kết nối mới trong pool
+CONNECTION_PRAGMAS = (
+    "PRAGMA foreign_keys = ON",  # Bắt buộc để ON DELETE CASCADE hoạt động
+    "PRAGMA synchronous = NORMAL",  # An toàn với WAL, giảm fsync mỗi commit
+    "PRAGMA cache_size = -16000",  # ~16MB page cache cho mỗi kết nối
+    "PRAGMA mmap_size = 268435456",  # 256MB memory-mapped I/O
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA busy_timeout = 5000",  # Chờ tối đa 5s khi có writer khác giữ lock
+)
+
+
+class PooledConnection(sqlite3.Connection):
+    """
+    Kết nối SQLite có thể trả về pool thay vì đóng hẳn.
+    Code cũ vẫn gọi conn.close() như bình thường:
+    - Kết nối gắn với request: chỉ rollback phần chưa commit, trả về pool khi request kết thúc.
+    - Kết nối ngoài request: trả ngay về pool.
+    """
+
+    _pool = None
+    _request_bound = False
+
+    def close(self):
+        if self._request_bound:
+            # Giữ nguyên ngữ nghĩa cũ: close() bỏ đi các thay đổi chưa commit
+            if self.in_transaction:
+                self.rollback()
+            return
+        if self._pool is not None:
+            self._pool.release(self)
+        else:
+            super().close()
+
+
+class ConnectionPool:
+    """Pool LIFO các kết nối đã cấu hình sẵn PRAGMA cho một file database."""
+
+    def __init__(self, path, readonly=False, max_idle=POOL_MAX_IDLE):
+        self.path = path
+        self.readonly = readonly
+        self._idle = queue.LifoQueue(maxsize=max_idle)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False, factory=PooledConnection)
+        conn.row_factory = sqlite3.Row
+        if not self.readonly:
+            # WAL: reader không bị chặn khi writer đang giữ lock
+            conn.execute("PRAGMA journal_mode = WAL")
+        for pragma in CONNECTION_PRAGMAS:
+            conn.execute(pragma)
+        if self.readonly:
+            conn.execute("PRAGMA query_only = ON")
+        conn._pool = self
+        return conn
+
+    def acquire(self):
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            conn = self._connect()
+        conn._request_bound = False
+        return conn
+
+    def release(self, conn):
+        conn._request_bound = False
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+            self._idle.put_nowait(conn)
+        except (queue.Full, sqlite3.Error):
+            sqlite3.Connection.close(conn)
+
+    def close_all(self):
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            sqlite3.Connection.close(conn)
+
+
+_POOLS = {}
+
+
+def _get_pool(readonly=False):
+    key = (DATABASE_PATH, readonly)
+    pool = _POOLS.get(key)
+    if pool is None:
+        pool = _POOLS.setdefault(key, ConnectionPool(DATABASE_PATH, readonly=readonly))
+    return pool
+
+
+def get_db_connection(readonly=False):
     """
-    Thiết lập kết nối đến cơ sở dữ liệu SQLite.
-    Bật hỗ trợ khóa ngoại (foreign key).
+    Lấy kết nối SQLite từ pool.
+    Trong request Flask, mỗi request dùng lại đúng một kết nối (theo loại ghi / chỉ đọc)
+    và kết nối được trả về pool khi request kết thúc (xem close_request_connections).
+    readonly=True trả về kết nối `query_only` dành cho các handler GET.
     """
-    conn = sqlite3.connect(DATABASE_PATH, check_same_thread=False)
-    conn.row_factory = sqlite3.Row
-    conn.execute("PRAGMA foreign_keys = ON")  # Bắt buộc để ON DELETE CASCADE hoạt động
+    pool = _get_pool(readonly)
+    if not has_app_context():
+        return pool.acquire()
+
+    conns = g.setdefault("_db_connections", {})
+    conn = conns.get(readonly)
+    if conn is None:
+        conn = pool.acquire()
+        conn._request_bound = True
+        conns[readonly] = conn
     return conn
 
-def init_database():
+
+def close_request_connections(exc=None):
+    """Trả các kết nối của request hiện tại về pool."""
+    conns = g.pop("_db_connections", None) or {}
+    for conn in conns.values():
+        conn._pool.release(conn)
+
+
+# --- SINGLE WRITER + GROUP COMMIT ---
+# Sau job đầu tiên, writer chờ thêm tối đa bấy nhiêu giây để gom job vào cùng transaction
+WRITE_BATCH_WINDOW = 0.003
+# Số job tối đa trong một transaction
+WRITE_BATCH_MAX = 64
+# Thời gian caller chờ kết quả tối đa (giây)
+WRITE_TIMEOUT = 10.0
+
+
+class WriteTimeout(Exception):
+    """Writer không xử lý xong job trong thời gian cho phép."""
+
+
+class WriteQueue:
+    """
+    Một thread writer duy nhất giữ kết nối ghi; các request gửi job (hàm nhận conn) vào hàng đợi.
+    Job tới trong WRITE_BATCH_WINDOW sau job đầu được chạy chung một transaction
+    (BEGIN IMMEDIATE ... COMMIT) -> một lần commit/fsync cho cả nhóm, không tranh lock giữa request.
+    Mỗi job chạy trong SAVEPOINT riêng: job lỗi chỉ rollback phần của nó.
+    Kết quả / exception trả về qua Future sau khi COMMIT xong. Job không được tự commit.
+
+    Mọi ghi của request (MXH, Notes) và ReminderScheduler đều đi qua đây. Các chỗ còn ghi
+    trực tiếp trên kết nối riêng (tranh lock bằng busy_timeout như trước):
+    - MXHImporter (POST /mxh/api/import): ghi theo chunk, mỗi chunk một BEGIN IMMEDIATE
+      và tự chạy lại từng dòng khi chunk lỗi; một lần import giữ writer quá lâu nếu đi qua hàng đợi.
+    - init_database() lúc khởi động và lệnh CLI `flask mxh-stats rebuild` (chạy khi chưa có request).
+    """
+
+    def __init__(self, pool, batch_window=WRITE_BATCH_WINDOW, batch_max=WRITE_BATCH_MAX):
+        self._pool = pool
+        self.batch_window = batch_window
+        self.batch_max = batch_max
+        self._jobs = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="sqlite-writer", daemon=True)
+                self._thread.start()
+
+    def submit(self, fn, *args):
+        """Đưa job fn(conn, *args) vào hàng đợi, trả về Future."""
+        future = Future()
+        self._ensure_started()
+        self._jobs.put((fn, args, future))
+        return future
+
+    def run(self, fn, *args, timeout=WRITE_TIMEOUT):
+        """
+        Chạy fn(conn, *args) trên writer và chờ kết quả đã commit.
+        `timeout` chỉ tính thời gian job nằm trong hàng đợi: hết hạn mà job chưa chạy thì job
+        bị hủy (writer bỏ qua) và raise WriteTimeout -> chắc chắn chưa ghi gì, client gửi lại được.
+        Job đã vào transaction thì chờ tới khi COMMIT / lỗi xong, để không báo lỗi cho một ghi đã thành công.
+        """
+        future = self.submit(fn, *args)
+        try:
+            return future.result(timeout)
+        except FutureTimeout:
+            if future.cancel():
+                raise WriteTimeout(f"Write was not started within {timeout}s")
+            return future.result()
+
+    def stop(self, timeout=None):
+        """Chạy nốt các job đã nhận rồi dừng thread writer."""
+        with self._lock:
+            thread = self._thread
+            self._thread = None
+        if thread is not None and thread.is_alive():
+            self._jobs.put(None)
+            thread.join(timeout)
+
+    def _next_batch(self):
+        job = self._jobs.get()
+        if job is None:
+            return None
+        batch = [job]
+        deadline = time.monotonic() + self.batch_window
+        while len(batch) < self.batch_max:
+            remaining = deadline - time.monotonic()
+            try:
+                job = self._jobs.get(timeout=remaining) if remaining > 0 else self._jobs.get_nowait()
+            except queue.Empty:
+                break
+            if job is None:
+                # Dừng sau khi xong nhóm hiện tại
+                self._jobs.put(None)
+                break
+            batch.append(job)
+        return batch
+
+    def _run(self):
+        conn = self._pool.acquire()
+        try:
+            while True:
+                batch = self._next_batch()
+                if batch is None:
+                    return
+                self._run_batch(conn, batch)
+        finally:
+            self._pool.release(conn)
+
+    def _run_batch(self, conn, batch):
+        jobs = [job for job in batch if job[2].set_running_or_notify_cancel()]
+        if not jobs:
+            return
+        outcomes = []
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            for fn, args, future in jobs:
+                conn.execute("SAVEPOINT write_job")
+                try:
+                    result = fn(conn, *args)
+                except Exception as e:
+                    conn.execute("ROLLBACK TO write_job")
+                    conn.execute("RELEASE write_job")
+                    outcomes.append((future, None, e))
+                else:
+                    conn.execute("RELEASE write_job")
+                    outcomes.append((future, result, None))
+            conn.commit()
+        except Exception as e:
+            # BEGIN / COMMIT lỗi (vd. database bị khóa quá busy_timeout): cả nhóm thất bại
+            if conn.in_transaction:
+                conn.rollback()
+            for _, _, future in jobs:
+                future.set_exception(e)
+            return
+        for future, result, error in outcomes:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+
+_WRITERS = {}
+
+
+def get_write_queue():
+    """WriteQueue của file database hiện tại (thread writer khởi động ở job đầu tiên)."""
+    writer = _WRITERS.get(DATABASE_PATH)
+    if writer is None:
+        writer = _WRITERS.setdefault(DATABASE_PATH, WriteQueue(_get_pool(readonly=False)))
+    return writer
+
+
+def run_write(fn, *args, timeout=WRITE_TIMEOUT):
+    """
+    Chạy fn(conn, *args) trên thread writer (gom chung transaction với các ghi đồng thời).
+    Trả về kết quả của fn sau khi đã commit; raise exception của fn hoặc WriteTimeout
+    (WriteTimeout = job không được chạy, không có gì được ghi).
+    Không gọi khi đang giữ transaction ghi trên kết nối khác (writer sẽ phải chờ lock).
+    """
+    return get_write_queue().run(fn, *args, timeout=timeout)
+
+
+def _execute_job(conn, sql, params):
+    cursor = conn.execute(sql, params)
+    return cursor.lastrowid, cursor.rowcount
+
+
+def run_write_sql(sql, params=(), timeout=WRITE_TIMEOUT):
+    """Một câu INSERT / UPDATE / DELETE qua writer; trả về (lastrowid, rowcount) sau khi đã commit."""
+    return run_write(_execute_job, sql, params, timeout=timeout)
+
+
+def close_all_connections():
+    """Dừng writer và đóng toàn bộ kết nối đang rảnh trong các pool (dùng khi tắt ứng dụng)."""
+    for writer in list(_WRITERS.values()):
+        writer.stop()
+    for pool in list(_POOLS.values()):
+        pool.close_all()
+
+
+def init_app(app):
+    """Gắn vòng đời kết nối database vào vòng đời request của Flask."""
+    app.teardown_appcontext(close_request_connections)
+    # mxh_selfcheck import app.database -> import muộn để tránh import vòng
+    from app.mxh_selfcheck import mxh_selfcheck_command
+    mxh_stats_cli.add_command(mxh_selfcheck_command)
+    app.cli.add_command(mxh_stats_cli)
+
+
+# Mỗi entity MXH -> (bảng, câu SELECT id các account bị ảnh hưởng khi entity đổi)
+MXH_CHANGE_ENTITIES = {
+    "group": ("mxh_groups", "SELECT a.id FROM mxh_accounts a JOIN mxh_cards c ON a.card_id = c.id WHERE c.group_id = NEW.id"),
+    "card": ("mxh_cards", "SELECT id FROM mxh_accounts WHERE card_id = NEW.id"),
+    "account": ("mxh_accounts", None),
+}
+
+
+def _create_mxh_change_log(cursor):
+    """
+    Bảng mxh_changes giữ revision MỚI NHẤT của từng entity (group/card/account).
+    - rev tăng đơn điệu (AUTOINCREMENT), INSERT OR REPLACE đẩy entity lên rev mới.
+    - op = 'delete' là tombstone để client biết cần xóa.
+    - Được duy trì hoàn toàn bằng trigger nên mọi đường ghi (kể cả CASCADE) đều được ghi nhận.
+    """
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS mxh_changes (
+            rev INTEGER PRIMARY KEY AUTOINCREMENT,
+            entity TEXT NOT NULL,
+            entity_id INTEGER NOT NULL,
+            op TEXT NOT NULL,
+            changed_at TEXT NOT NULL DEFAULT (strftime('%Y-%m-%dT%H:%M:%fZ', 'now')),
+            UNIQUE(entity, entity_id)
+        )
+    """)
+
+    for entity, (table, affected_accounts_sql) in MXH_CHANGE_ENTITIES.items():
+        cursor.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_{table}_changes_ins AFTER INSERT ON {table}
+            BEGIN
+                INSERT OR REPLACE INTO mxh_changes (entity, entity_id, op) VALUES ('{entity}', NEW.id, 'upsert');
+            END
+        """)
+        # Group/card đổi tên, màu... thì các account hiển thị thông tin đó cũng coi như thay đổi
+        cascade_sql = ""
+        if affected_accounts_sql:
+            cascade_sql = (
+                "INSERT OR REPLACE INTO mxh_changes (entity, entity_id, op) "
+                f"SELECT 'account', id, 'upsert' FROM ({affected_accounts_sql});"
+            )
+        cursor.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_{table}_changes_upd AFTER UPDATE ON {table}
+            BEGIN
+                INSERT OR REPLACE INTO mxh_changes (entity, entity_id, op) VALUES ('{entity}', NEW.id, 'upsert');
+                {cascade_sql}
+            END
+        """)
+        cursor.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_{table}_changes_del AFTER DELETE ON {table}
+            BEGIN
+                INSERT OR REPLACE INTO mxh_changes (entity, entity_id, op) VALUES ('{entity}', OLD.id, 'delete');
+            END
+        """)
+
+
+def get_mxh_revision(conn):
+    """Revision hiện tại của dữ liệu MXH (0 nếu chưa có thay đổi nào)."""
+    return conn.execute("SELECT COALESCE(MAX(rev), 0) FROM mxh_changes").fetchone()[0]
+
+
+def verify_mxh_changes(conn):
+    """
+    Số entity lệch với mxh_changes (0 = khớp): entity còn tồn tại phải có dòng 'upsert',
+    entity đã xóa (nếu có dòng) phải là tombstone 'delete'.
+    """
+    mismatched = 0
+    for entity, (table, _) in MXH_CHANGE_ENTITIES.items():
+        mismatched += conn.execute(f"""
+            SELECT
+                (SELECT COUNT(*) FROM {table} t
+                 WHERE NOT EXISTS (SELECT 1 FROM mxh_changes ch
+                                   WHERE ch.entity = '{entity}' AND ch.entity_id = t.id AND ch.op = 'upsert'))
+              + (SELECT COUNT(*) FROM mxh_changes ch
+                 WHERE ch.entity = '{entity}'
+                   AND (ch.op = 'upsert') != EXISTS (SELECT 1 FROM {table} t WHERE t.id = ch.entity_id))
+        """).fetchone()[0]
+    return mismatched
+
+
+# --- TÌM KIẾM TOÀN VĂN (FTS5) ---
+# Cột của mxh_accounts_fts, rowid = mxh_accounts.id
+MXH_SEARCH_COLUMNS = (
+    "username", "phone", "phone_digits", "account_name", "login_username", "card_name", "notice_text",
+)
+
+
+def _mxh_search_values(row):
+    """Biểu thức SQL cho từng cột FTS của một account (`row` = NEW / OLD / alias bảng)."""
+    digits = f"COALESCE({row}.phone, '')"
+    for ch in (" ", "+", "-", "(", ")", "."):
+        digits = f"replace({digits}, '{ch}', '')"
+    # Notice lỗi JSON thì bỏ qua, không được làm hỏng câu UPDATE gốc
+    notice_text = (
+        f"CASE WHEN json_valid({row}.notice) THEN trim("
+        f"COALESCE(json_extract({row}.notice, '$.title'), '') || ' ' || "
+        f"COALESCE(json_extract({row}.notice, '$.note'), '')) END"
+    )
+    return ", ".join([
+        f"{row}.id",
+        f"{row}.username",
+        f"{row}.phone",
+        digits,
+        f"{row}.account_name",
+        f"{row}.login_username",
+        f"(SELECT card_name FROM mxh_cards WHERE id = {row}.card_id)",
+        notice_text,
+    ])
+
+
+def _create_mxh_search_index(cursor):
+    """
+    Bảng FTS5 mxh_accounts_fts (username, phone, card_name, tiêu đề/ghi chú notice...).
+    Đồng bộ bằng trigger; lần đầu tạo thì nạp lại toàn bộ account.
+    Trả về False nếu SQLite không có FTS5 (khi đó /mxh/api/search dùng LIKE).
+    """
+    exists = cursor.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'mxh_accounts_fts'"
+    ).fetchone()
+    columns = ", ".join(MXH_SEARCH_COLUMNS)
+    try:
+        cursor.execute(f"""
+            CREATE VIRTUAL TABLE IF NOT EXISTS mxh_accounts_fts USING fts5(
+                {columns},
+                tokenize = 'unicode61 remove_diacritics 2',
+                prefix = '2 3'
+            )
+        """)
+    except sqlite3.OperationalError as e:
+        print(f"WARNING: FTS5 not available ({e}), MXH search will fall back to LIKE.")
+        return False
+
+    insert_sql = f"INSERT INTO mxh_accounts_fts (rowid, {columns})"
+    cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_mxh_accounts_fts_ins AFTER INSERT ON mxh_accounts
+        BEGIN
+            {insert_sql} VALUES ({_mxh_search_values('NEW')});
+        END
+    """)
+    # Chỉ các cột được index; scan/rescue... không đụng tới FTS
+    cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_mxh_accounts_fts_upd
+        AFTER UPDATE OF username, phone, account_name, login_username, card_id, notice ON mxh_accounts
+        BEGIN
+            DELETE FROM mxh_accounts_fts WHERE rowid = OLD.id;
+            {insert_sql} VALUES ({_mxh_search_values('NEW')});
+        END
+    """)
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_mxh_accounts_fts_del AFTER DELETE ON mxh_accounts
+        BEGIN
+            DELETE FROM mxh_accounts_fts WHERE rowid = OLD.id;
+        END
+    """)
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_mxh_cards_fts_upd AFTER UPDATE OF card_name ON mxh_cards
+        BEGIN
+            UPDATE mxh_accounts_fts SET card_name = NEW.card_name
+            WHERE rowid IN (SELECT id FROM mxh_accounts WHERE card_id = NEW.id);
+        END
+    """)
+
+    if not exists:
+        cursor.execute(f"{insert_sql} SELECT {_mxh_search_values('a')} FROM mxh_accounts a")
+    return True
+
+
+def verify_mxh_search_index(conn):
+    """Số dòng lệch giữa mxh_accounts_fts và giá trị tính lại từ mxh_accounts (0 = khớp / không có FTS5)."""
+    if not conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'mxh_accounts_fts'"
+    ).fetchone():
+        return 0
+    stored = f"SELECT rowid, {', '.join(MXH_SEARCH_COLUMNS)} FROM mxh_accounts_fts"
+    expected = f"SELECT {_mxh_search_values('a')} FROM mxh_accounts a"
+    return conn.execute(f"""
+        SELECT COUNT(*) FROM (
+            SELECT * FROM ({stored} EXCEPT {expected})
+            UNION ALL
+            SELECT * FROM ({expected} EXCEPT {stored})
+        )
+    """).fetchone()[0]
+
+
+# --- NOTICE CHUẨN HÓA ---
+# Thời điểm đến hạn (UTC, ISO 8601 "Z") của notice JSON: due_date hoặc start_at + days.
+# Cùng định dạng với strftime(NOTICE_TIME_FORMAT, ...) để so sánh chuỗi = so sánh thời gian.
+NOTICE_TIME_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+
+
+def _notice_values(row):
+    """Biểu thức SQL (account_id, enabled, title, note, start_at, due_at) từ cột notice."""
+    notice = f"{row}.notice"
+    due = (
+        f"COALESCE(json_extract({notice}, '$.due_date'), "
+        f"datetime(json_extract({notice}, '$.start_at'), '+' || json_extract({notice}, '$.days') || ' days'))"
+    )
+    return ", ".join([
+        f"{row}.id",
+        f"CASE WHEN json_extract({notice}, '$.enabled') THEN 1 ELSE 0 END",
+        f"json_extract({notice}, '$.title')",
+        f"json_extract({notice}, '$.note')",
+        f"json_extract({notice}, '$.start_at')",
+        f"strftime('{NOTICE_TIME_FORMAT}', {due})",
+    ])
+
+
+def _create_mxh_notices(cursor):
+    """
+    Bảng mxh_notices: bản chuẩn hóa của mxh_accounts.notice (JSON), một dòng mỗi account có notice.
+    Cột notice vẫn là nguồn ghi (API giữ nguyên định dạng), trigger đồng bộ sang bảng này
+    để truy vấn đến hạn chỉ cần quét khoảng trên index (enabled, due_at).
+    """
+    exists = cursor.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'mxh_notices'"
+    ).fetchone()
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS mxh_notices (
+            account_id INTEGER PRIMARY KEY,
+            enabled INTEGER NOT NULL DEFAULT 0,
+            title TEXT,
+            note TEXT,
+            start_at TEXT,
+            due_at TEXT
+        )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_notices_due ON mxh_notices(enabled, due_at)")
+
+    columns = "account_id, enabled, title, note, start_at, due_at"
+    cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_mxh_notices_ins AFTER INSERT ON mxh_accounts
+        WHEN NEW.notice IS NOT NULL AND json_valid(NEW.notice)
+        BEGIN
+            INSERT OR REPLACE INTO mxh_notices ({columns}) VALUES ({_notice_values('NEW')});
+        END
+    """)
+    cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_mxh_notices_upd AFTER UPDATE OF notice ON mxh_accounts
+        BEGIN
+            DELETE FROM mxh_notices WHERE account_id = OLD.id;
+            INSERT INTO mxh_notices ({columns})
+            SELECT {_notice_values('NEW')} WHERE NEW.notice IS NOT NULL AND json_valid(NEW.notice);
+        END
+    """)
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_mxh_notices_del AFTER DELETE ON mxh_accounts
+        BEGIN
+            DELETE FROM mxh_notices WHERE account_id = OLD.id;
+        END
+    """)
+
+    if not exists:
+        cursor.execute(f"""
+            INSERT INTO mxh_notices ({columns})
+            SELECT {_notice_values('a')} FROM mxh_accounts a
+            WHERE a.notice IS NOT NULL AND json_valid(a.notice)
+        """)
+
+
+def verify_mxh_notices(conn):
+    """Số dòng lệch giữa mxh_notices và cột notice (JSON) của mxh_accounts (0 = khớp)."""
+    stored = "SELECT account_id, enabled, title, note, start_at, due_at FROM mxh_notices"
+    expected = (
+        f"SELECT {_notice_values('a')} FROM mxh_accounts a "
+        "WHERE a.notice IS NOT NULL AND json_valid(a.notice)"
+    )
+    return conn.execute(f"""
+        SELECT COUNT(*) FROM (
+            SELECT * FROM ({stored} EXCEPT {expected})
+            UNION ALL
+            SELECT * FROM ({expected} EXCEPT {stored})
+        )
+    """).fetchone()[0]
+
+
+# --- THỐNG KÊ MXH (bảng tổng hợp do trigger duy trì) ---
+# Cột đếm theo từng account -> biểu thức SQL ({r} = NEW / OLD / alias bảng)
+MXH_STATS_ACCOUNT_COLUMNS = {
+    "accounts": "1",
+    "primary_accounts": "CASE WHEN {r}.is_primary THEN 1 ELSE 0 END",
+    "active_accounts": "CASE WHEN {r}.status = 'active' THEN 1 ELSE 0 END",
+    "die_accounts": "CASE WHEN {r}.status = 'die' THEN 1 ELSE 0 END",
+    "scan_total": "COALESCE({r}.wechat_scan_count, 0)",
+    "rescue_total": "COALESCE({r}.rescue_count, 0)",
+    "rescue_success_total": "COALESCE({r}.rescue_success_count, 0)",
+}
+MXH_STATS_COLUMNS = ("cards",) + tuple(MXH_STATS_ACCOUNT_COLUMNS)
+
+
+def _mxh_stats_upsert(select_sql):
+    """INSERT ... ON CONFLICT cộng dồn các cột đếm (select_sql trả về group_key, platform, các cột)."""
+    columns = ", ".join(MXH_STATS_COLUMNS)
+    updates = ", ".join(f"{col} = {col} + excluded.{col}" for col in MXH_STATS_COLUMNS)
+    return (
+        f"INSERT INTO mxh_stats (group_key, platform, {columns}) {select_sql} "
+        f"ON CONFLICT(group_key, platform) DO UPDATE SET {updates};"
+    )
+
+
+def _account_stats_delta(row, sign):
+    """Cộng (+1) / trừ (-1) một account vào nhóm (group, platform) của card chứa nó."""
+    values = ", ".join(f"{sign} * ({expr.format(r=row)})" for expr in MXH_STATS_ACCOUNT_COLUMNS.values())
+    # Card không còn (đang bị xóa) -> không có dòng nào, card đã tự trừ phần của mình
+    return _mxh_stats_upsert(
+        f"SELECT COALESCE(c.group_id, 0), c.platform, 0, {values} "
+        f"FROM mxh_cards c WHERE c.id = {row}.card_id"
+    )
+
+
+def _card_stats_delta(row, sign):
+    """Cộng / trừ một card cùng toàn bộ account của nó."""
+    values = ", ".join(
+        f"{sign} * COALESCE(SUM({expr.format(r='a')}), 0)" for expr in MXH_STATS_ACCOUNT_COLUMNS.values()
+    )
+    return _mxh_stats_upsert(
+        f"SELECT COALESCE({row}.group_id, 0), {row}.platform, {sign}, {values} "
+        f"FROM mxh_accounts a WHERE a.card_id = {row}.id"
+    )
+
+
+def _create_mxh_stats(cursor):
+    """
+    Bảng mxh_stats: số card / account / trạng thái / tổng lượt quét, cứu theo (group, platform).
+    group_key = group_id (0 nếu card không thuộc nhóm). Tương đương mxh_accounts JOIN mxh_cards
+    GROUP BY group, platform; đọc thống kê chỉ tốn O(số nhóm). Kiểm tra: verify_mxh_stats().
+    """
+    exists = cursor.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'mxh_stats'"
+    ).fetchone()
+    counters = ",\n".join(f"            {col} INTEGER NOT NULL DEFAULT 0" for col in MXH_STATS_COLUMNS)
+    cursor.execute(f"""
+        CREATE TABLE IF NOT EXISTS mxh_stats (
+            group_key INTEGER NOT NULL,
+            platform TEXT NOT NULL,
+{counters},
+            PRIMARY KEY (group_key, platform)
+        ) WITHOUT ROWID
+    """)
+
+    account_columns = "status, card_id, is_primary, wechat_scan_count, rescue_count, rescue_success_count"
+    triggers = {
+        "trg_mxh_stats_acc_ins": ("AFTER INSERT ON mxh_accounts", _account_stats_delta("NEW", 1)),
+        "trg_mxh_stats_acc_upd": (
+            f"AFTER UPDATE OF {account_columns} ON mxh_accounts",
+            _account_stats_delta("OLD", -1) + _account_stats_delta("NEW", 1),
+        ),
+        "trg_mxh_stats_acc_del": ("AFTER DELETE ON mxh_accounts", _account_stats_delta("OLD", -1)),
+        "trg_mxh_stats_card_ins": (
+            "AFTER INSERT ON mxh_cards",
+            _mxh_stats_upsert(
+                "SELECT COALESCE(NEW.group_id, 0), NEW.platform, 1"
+                + ", 0" * len(MXH_STATS_ACCOUNT_COLUMNS) + " WHERE 1"
+            ),
+        ),
+        "trg_mxh_stats_card_upd": (
+            "AFTER UPDATE OF group_id, platform ON mxh_cards "
+            "WHEN OLD.group_id IS NOT NEW.group_id OR OLD.platform IS NOT NEW.platform",
+            _card_stats_delta("OLD", -1) + _card_stats_delta("NEW", 1),
+        ),
+        # BEFORE: lúc này account (CASCADE) vẫn còn để trừ
+        "trg_mxh_stats_card_del": ("BEFORE DELETE ON mxh_cards", _card_stats_delta("OLD", -1)),
+    }
+    for name, (event, body) in triggers.items():
+        cursor.execute(f"CREATE TRIGGER IF NOT EXISTS {name} {event} BEGIN {body} END")
+
+    if not exists:
+        rebuild_mxh_stats(cursor)
+
+
+# Tính lại thống kê trực tiếp từ bảng gốc
+_MXH_STATS_FROM_BASE_SQL = f"""
+    SELECT COALESCE(c.group_id, 0) AS group_key, c.platform,
+           COUNT(DISTINCT c.id) AS cards,
+           {", ".join(
+               f"COALESCE(SUM(CASE WHEN a.id IS NULL THEN 0 ELSE {expr.format(r='a')} END), 0) AS {col}"
+               for col, expr in MXH_STATS_ACCOUNT_COLUMNS.items()
+           )}
+    FROM mxh_cards c
+    LEFT JOIN mxh_accounts a ON a.card_id = c.id
+    GROUP BY COALESCE(c.group_id, 0), c.platform
+"""
+
+
+def rebuild_mxh_stats(conn):
+    """Dựng lại mxh_stats từ bảng gốc (caller tự commit)."""
+    conn.execute("DELETE FROM mxh_stats")
+    conn.execute(
+        f"INSERT INTO mxh_stats (group_key, platform, {', '.join(MXH_STATS_COLUMNS)}) "
+        f"SELECT group_key, platform, {', '.join(MXH_STATS_COLUMNS)} FROM ({_MXH_STATS_FROM_BASE_SQL})"
+    )
+
+
+def verify_mxh_stats(conn):
+    """So mxh_stats với số liệu tính từ bảng gốc. Trả về danh sách các dòng lệch (rỗng = khớp)."""
+    columns = ", ".join(MXH_STATS_COLUMNS)
+    non_zero = " OR ".join(f"{col} != 0" for col in MXH_STATS_COLUMNS)
+    stored = f"SELECT group_key, platform, {columns} FROM mxh_stats WHERE {non_zero}"
+    expected = f"SELECT group_key, platform, {columns} FROM ({_MXH_STATS_FROM_BASE_SQL})"
+    rows = conn.execute(f"""
+        SELECT 'stored' AS source, * FROM ({stored} EXCEPT {expected})
+        UNION ALL
+        SELECT 'expected' AS source, * FROM ({expected} EXCEPT {stored})
+        ORDER BY group_key, platform, source
+    """).fetchall()
+    return [dict(row) for row in rows]
+
+
+# --- NHẬT KÝ SỰ KIỆN ACCOUNT (append-only) + ROLLUP THEO NGÀY / TUẦN ---
+# Mốc thời gian của bucket theo giờ máy chủ; tuần bắt đầu từ thứ Hai
+MXH_EVENT_PERIODS = {
+    "day": "date({ts}, 'localtime')",
+    "week": "date({ts}, 'localtime', 'weekday 0', '-6 days')",
+}
+
+
+def _create_mxh_account_events(cursor):
+    """
+    mxh_account_events: mỗi thao tác (scan, rescue, mark-die, reset...) là một dòng, không sửa / xóa.
+    group_id / platform chụp lại tại thời điểm thao tác để lịch sử không đổi khi card bị chuyển.
+    mxh_event_rollups: số sự kiện theo (period, bucket, event, group, platform), trigger cộng dồn.
+    """
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS mxh_account_events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            account_id INTEGER NOT NULL,
+            event TEXT NOT NULL,
+            group_id INTEGER,
+            platform TEXT,
+            created_at TEXT NOT NULL DEFAULT (strftime('%Y-%m-%dT%H:%M:%fZ', 'now'))
+        )
+    """)
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_acc_events_account ON mxh_account_events(account_id, created_at)"
+    )
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS mxh_event_rollups (
+            period TEXT NOT NULL,
+            bucket TEXT NOT NULL,
+            event TEXT NOT NULL,
+            group_key INTEGER NOT NULL,
+            platform TEXT NOT NULL,
+            count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (period, bucket, event, group_key, platform)
+        ) WITHOUT ROWID
+    """)
+    upserts = "".join(
+        f"""
+            INSERT INTO mxh_event_rollups (period, bucket, event, group_key, platform, count)
+            VALUES ('{period}', {bucket.format(ts='NEW.created_at')}, NEW.event,
+                    COALESCE(NEW.group_id, 0), COALESCE(NEW.platform, ''), 1)
+            ON CONFLICT(period, bucket, event, group_key, platform) DO UPDATE SET count = count + 1;"""
+        for period, bucket in MXH_EVENT_PERIODS.items()
+    )
+    cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_mxh_account_events_rollup AFTER INSERT ON mxh_account_events
+        BEGIN{upserts}
+        END
+    """)
+
+
+def record_account_events(conn, event, account_ids):
+    """
+    Ghi sự kiện `event` cho các account (trong transaction hiện tại của caller,
+    cùng lúc với câu UPDATE của thao tác). Id lặp lại = nhiều sự kiện.
+    """
+    conn.execute("""
+        INSERT INTO mxh_account_events (account_id, event, group_id, platform)
+        SELECT a.id, ?, c.group_id, c.platform
+        FROM json_each(?) ids
+        JOIN mxh_accounts a ON a.id = ids.value
+        JOIN mxh_cards c ON c.id = a.card_id
+        ORDER BY ids.key
+    """, (event, json.dumps(list(account_ids))))
+
+
+# --- READ MODEL: mxh_account_view ---
+# Cột join sẵn vào mỗi account (tên cột -> biểu thức trên c = mxh_cards, g = mxh_groups)
+MXH_ACCOUNT_VIEW_EXTRA = {
+    "card_name": "c.card_name",
+    "platform": "c.platform",
+    "group_id": "c.group_id",
+    "group_name": "g.name",
+    "group_color": "g.color",
+    "group_icon": "g.icon",
+}
+MXH_ACCOUNT_VIEW_INDEXES = {
+    # Cùng thứ tự với FLAT_ACCOUNTS_ORDER / RECENT_ACCOUNTS_ORDER trong mxh_queries
+    "idx_acc_view_list_order": "is_primary DESC, card_group_id, card_sort_key",
+    "idx_acc_view_updated": "updated_at",
+    "idx_acc_view_card": "card_id, is_primary DESC",
+    "idx_acc_view_group": "group_id",
+}
+_MXH_ACCOUNT_VIEW_TRIGGERS = (
+    "trg_mxh_account_view_ins", "trg_mxh_account_view_upd", "trg_mxh_account_view_del",
+    "trg_mxh_account_view_card_upd", "trg_mxh_account_view_card_del",
+    "trg_mxh_account_view_group_upd", "trg_mxh_account_view_group_del",
+)
+
+
+def _account_view_select(account_columns, where):
+    columns = [f"a.{col}" for col in account_columns] + list(MXH_ACCOUNT_VIEW_EXTRA.values())
+    return (
+        f"SELECT {', '.join(columns)} FROM mxh_accounts a "
+        "JOIN mxh_cards c ON c.id = a.card_id "
+        f"LEFT JOIN mxh_groups g ON g.id = c.group_id WHERE {where}"
+    )
+
+
+def _create_mxh_account_view(cursor):
+    """
+    mxh_account_view: mỗi account một dòng, đã join sẵn card (tên, platform, group) và group
+    (tên, màu, icon). Các API danh sách đọc một bảng duy nhất theo index, không join lúc đọc.
+    Trigger trên mxh_accounts / mxh_cards / mxh_groups giữ bảng luôn khớp với phép join gốc.
+    Khi mxh_accounts có thêm cột (migration), bảng được dựng lại từ đầu.
+    """
+    account_columns = [row[1] for row in cursor.execute("PRAGMA table_info(mxh_accounts)")]
+    view_columns = account_columns + list(MXH_ACCOUNT_VIEW_EXTRA)
+    existing = [row[1] for row in cursor.execute("PRAGMA table_info(mxh_account_view)")]
+
+    rebuild = existing != view_columns
+    if rebuild:
+        cursor.execute("DROP TABLE IF EXISTS mxh_account_view")
+        definitions = ["id INTEGER PRIMARY KEY"] + [col for col in view_columns if col != "id"]
+        cursor.execute(f"CREATE TABLE mxh_account_view ({', '.join(definitions)})")
+    for name, columns in MXH_ACCOUNT_VIEW_INDEXES.items():
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS {name} ON mxh_account_view({columns})")
+
+    # Trigger chứa danh sách cột nên luôn tạo lại cho khớp schema hiện tại
+    for name in _MXH_ACCOUNT_VIEW_TRIGGERS:
+        cursor.execute(f"DROP TRIGGER IF EXISTS {name}")
+
+    insert_sql = f"INSERT INTO mxh_account_view ({', '.join(view_columns)})"
+    refresh_account = (
+        "DELETE FROM mxh_account_view WHERE id = NEW.id; "
+        f"{insert_sql} {_account_view_select(account_columns, 'a.id = NEW.id')};"
+    )
+    card_columns = ", ".join(
+        f"{col} = {expr.replace('c.', 'NEW.')}"
+        for col, expr in MXH_ACCOUNT_VIEW_EXTRA.items() if expr.startswith("c.")
+    )
+    group_lookup = "(SELECT {col} FROM mxh_groups WHERE id = NEW.group_id)"
+    group_columns = ", ".join(
+        f"{col} = {group_lookup.format(col=expr[2:])}"
+        for col, expr in MXH_ACCOUNT_VIEW_EXTRA.items() if expr.startswith("g.")
+    )
+    triggers = {
+        "trg_mxh_account_view_ins": ("AFTER INSERT ON mxh_accounts", refresh_account),
+        "trg_mxh_account_view_upd": ("AFTER UPDATE ON mxh_accounts", refresh_account),
+        "trg_mxh_account_view_del": (
+            "AFTER DELETE ON mxh_accounts",
+            "DELETE FROM mxh_account_view WHERE id = OLD.id;",
+        ),
+        "trg_mxh_account_view_card_upd": (
+            "AFTER UPDATE OF card_name, platform, group_id ON mxh_cards",
+            f"UPDATE mxh_account_view SET {card_columns}, {group_columns} WHERE card_id = NEW.id;",
+        ),
+        "trg_mxh_account_view_card_del": (
+            "AFTER DELETE ON mxh_cards",
+            "DELETE FROM mxh_account_view WHERE card_id = OLD.id;",
+        ),
+        "trg_mxh_account_view_group_upd": (
+            "AFTER UPDATE OF name, color, icon ON mxh_groups",
+            "UPDATE mxh_account_view SET group_name = NEW.name, group_color = NEW.color, "
+            "group_icon = NEW.icon WHERE group_id = NEW.id;",
+        ),
+        "trg_mxh_account_view_group_del": (
+            "AFTER DELETE ON mxh_groups",
+            "UPDATE mxh_account_view SET group_name = NULL, group_color = NULL, group_icon = NULL "
+            "WHERE group_id = OLD.id;",
+        ),
+    }
+    for name, (event, body) in triggers.items():
+        cursor.execute(f"CREATE TRIGGER {name} {event} BEGIN {body} END")
+
+    if rebuild:
+        cursor.execute(f"{insert_sql} {_account_view_select(account_columns, '1')}")
+
+
+def verify_mxh_account_view(conn):
+    """Số dòng lệch giữa mxh_account_view và phép join gốc (0 = khớp)."""
+    account_columns = [row[1] for row in conn.execute("PRAGMA table_info(mxh_accounts)")]
+    columns = ", ".join(account_columns + list(MXH_ACCOUNT_VIEW_EXTRA))
+    base = _account_view_select(account_columns, "1")
+    return conn.execute(f"""
+        SELECT COUNT(*) FROM (
+            SELECT * FROM (SELECT {columns} FROM mxh_account_view EXCEPT {base})
+            UNION ALL
+            SELECT * FROM ({base} EXCEPT SELECT {columns} FROM mxh_account_view)
+        )
+    """).fetchone()[0]
+
+
+# --- MUTATION + RETURNING ---
+# INSERT/UPDATE ... RETURNING có từ SQLite 3.35; bản cũ hơn đọc lại dòng bằng SELECT thứ hai
+SQLITE_HAS_RETURNING = sqlite3.sqlite_version_info >= (3, 35, 0)
+
+# Cột join thêm (RETURNING không thấy) -> tính lại bằng subquery.
+# Kết quả trả về cùng shape với bảng đọc lại ở nhánh fallback.
+_CARD_JOIN_SUBQUERY = (
+    "(SELECT {expr} FROM mxh_cards c LEFT JOIN mxh_groups g ON g.id = c.group_id "
+    "WHERE c.id = mxh_accounts.card_id)"
+)
+RETURNING_SHAPES = {
+    "mxh_accounts": {
+        "read_table": "mxh_account_view",
+        "computed": MXH_ACCOUNT_VIEW_EXTRA,
+        "subquery": _CARD_JOIN_SUBQUERY,
+    },
+    "mxh_cards": {
+        "read_table": "mxh_cards",
+        "computed": {},
+        "subquery": "{expr}",
+    },
+}
+_returning_sql = {}
+
+
+def _returning_clause(conn, table):
+    """
+    Danh sách biểu thức RETURNING theo đúng thứ tự cột public của bảng đọc (cache theo bảng).
+    Cột nội bộ (mxh_queries.INTERNAL_COLUMNS) không nằm trong kết quả trả về.
+    """
+    if table not in _returning_sql:
+        shape = RETURNING_SHAPES[table]
+        read_columns = table_columns(conn, shape["read_table"])
+        parts = []
+        for col in read_columns:
+            expr = shape["computed"].get(col)
+            parts.append(f"{shape['subquery'].format(expr=expr)} AS {col}" if expr else col)
+        _returning_sql[table] = ", ".join(parts)
+    return _returning_sql[table]
+
+
+def execute_returning(conn, table, sql, params, row_id=None):
+    """
+    Chạy một INSERT / UPDATE một dòng trên `table` (mxh_accounts hoặc mxh_cards) và trả về
+    dòng sau khi ghi (dict), hoặc None nếu không có dòng nào bị ảnh hưởng.
+    Account trả về cùng shape với mxh_account_view (kèm card_name, platform, group_*).
+    row_id: id dòng cho nhánh fallback của UPDATE (INSERT dùng lastrowid).
+    """
+    if SQLITE_HAS_RETURNING:
+        rows = conn.execute(f"{sql} RETURNING {_returning_clause(conn, table)}", params).fetchall()
+        return dict(rows[0]) if rows else None
+
+    cursor = conn.execute(sql, params)
+    if cursor.rowcount == 0:
+        return None
+    read_table = RETURNING_SHAPES[table]["read_table"]
+    row = conn.execute(
+        f"SELECT {', '.join(table_columns(conn, read_table))} FROM {read_table} WHERE id = ?",
+        (row_id if row_id is not None else cursor.lastrowid,),
+    ).fetchone()
+    return dict(row) if row else None
+
+
+# Bảng -> tên revision trong data_revisions (MXH dùng mxh_changes)
+DATA_REVISION_TABLES = {
+    "notes": "notes",
+}
+
+
+def _create_data_revisions(cursor):
+    """Bộ đếm revision cho từng nhóm dữ liệu, tăng bằng trigger mỗi lần ghi."""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS data_revisions (
+            name TEXT PRIMARY KEY,
+            rev INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+    for table, name in DATA_REVISION_TABLES.items():
+        for event in ("INSERT", "UPDATE", "DELETE"):
+            cursor.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS trg_{table}_rev_{event.lower()} AFTER {event} ON {table}
+                BEGIN
+                    INSERT INTO data_revisions (name, rev) VALUES ('{name}', 1)
+                    ON CONFLICT(name) DO UPDATE SET rev = rev + 1;
+                END
+            """)
+
+
+def get_data_revision(conn, scope):
+    """Token phiên bản dữ liệu rẻ (một lần đọc index) cho scope 'mxh' hoặc 'notes'."""
+    if scope == "mxh":
+        return get_mxh_revision(conn)
+    row = conn.execute("SELECT rev FROM data_revisions WHERE name = ?", (scope,)).fetchone()
+    return row[0] if row else 0
+
+
+def _add_column_if_missing(cursor, table, column, definition):
+    """Migration nhẹ: thêm cột nếu DB cũ chưa có. Trả về True nếu vừa thêm."""
+    columns = {row[1] for row in cursor.execute(f"PRAGMA table_info({table})")}
+    if column in columns:
+        return False
+    cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+    return True
+
+
+def _create_mxh_sort_keys(cursor):
+    """
+    Khóa sắp xếp số được duy trì bằng trigger, để các danh sách MXH đi theo thứ tự index
+    thay vì CAST(card_name AS INTEGER) + sắp xếp tạm (TEMP B-TREE):
+    - mxh_cards.sort_key = CAST(card_name AS INTEGER)
+    - mxh_accounts.card_group_id / card_sort_key = group_id / sort_key của card chứa account
+      (thứ tự danh sách phẳng trộn cột của cả hai bảng nên phải chép sang account).
+    """
+    added = [
+        _add_column_if_missing(cursor, "mxh_cards", "sort_key", "INTEGER"),
+        _add_column_if_missing(cursor, "mxh_accounts", "card_group_id", "INTEGER"),
+        _add_column_if_missing(cursor, "mxh_accounts", "card_sort_key", "INTEGER"),
+    ]
+
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_mxh_cards_sort_key_ins AFTER INSERT ON mxh_cards
+        BEGIN
+            UPDATE mxh_cards SET sort_key = CAST(NEW.card_name AS INTEGER) WHERE id = NEW.id;
+        END
+    """)
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_mxh_cards_sort_key_upd AFTER UPDATE OF card_name, group_id ON mxh_cards
+        BEGIN
+            UPDATE mxh_cards SET sort_key = CAST(NEW.card_name AS INTEGER)
+            WHERE id = NEW.id AND sort_key IS NOT CAST(NEW.card_name AS INTEGER);
+            UPDATE mxh_accounts
+            SET card_group_id = NEW.group_id, card_sort_key = CAST(NEW.card_name AS INTEGER)
+            WHERE card_id = NEW.id;
+        END
+    """)
+    for event in ("INSERT", "UPDATE OF card_id"):
+        name = "ins" if event == "INSERT" else "upd"
+        cursor.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_mxh_accounts_sort_key_{name} AFTER {event} ON mxh_accounts
+            BEGIN
+                UPDATE mxh_accounts
+                SET card_group_id = (SELECT group_id FROM mxh_cards WHERE id = NEW.card_id),
+                    card_sort_key = (SELECT sort_key FROM mxh_cards WHERE id = NEW.card_id)
+                WHERE id = NEW.id;
+            END
+        """)
+
+    if any(added):
+        cursor.execute("UPDATE mxh_cards SET sort_key = CAST(card_name AS INTEGER)")
+        cursor.execute("""
+            UPDATE mxh_accounts
+            SET card_group_id = (SELECT group_id FROM mxh_cards WHERE id = mxh_accounts.card_id),
+                card_sort_key = (SELECT sort_key FROM mxh_cards WHERE id = mxh_accounts.card_id)
+        """)
+
+
+def verify_mxh_sort_keys(conn):
+    """Số card / account có khóa sắp xếp lệch với card_name / group_id của card (0 = khớp)."""
+    return conn.execute("""
+        SELECT
+            (SELECT COUNT(*) FROM mxh_cards WHERE sort_key IS NOT CAST(card_name AS INTEGER))
+          + (SELECT COUNT(*) FROM mxh_accounts a LEFT JOIN mxh_cards c ON c.id = a.card_id
+             WHERE a.card_group_id IS NOT c.group_id OR a.card_sort_key IS NOT c.sort_key)
+    """).fetchone()[0]
+
+
+# --- NOTES: cột dẫn xuất từ HTML ---
+# Tính một lần lúc ghi note; danh sách, nhắc hẹn và tìm kiếm đọc thẳng các cột này.
+# text_version = HTML_TEXT_VERSION lúc tính: đổi cách trích text thì init_database tính lại các dòng cũ
+NOTES_DERIVED_COLUMNS = (
+    "title_text", "content_text", "preview", "content_length", "content_hash", "text_version",
+)
+
+
+def notes_derived_fields(title_html, content_html):
+    """Giá trị các cột NOTES_DERIVED_COLUMNS (cùng thứ tự) cho một note."""
+    content = content_html or ""
+    content_text = html_to_text(content)
+    return (
+        html_to_text(title_html),
+        content_text,
+        text_preview(content_text),
+        len(content),
+        hashlib.sha1(content.encode("utf-8")).hexdigest(),
+        HTML_TEXT_VERSION,
+    )
+
+
+def _create_notes_derived_columns(cursor):
+    """
+    Cột plain text / preview / độ dài / hash của note + backfill các dòng còn thiếu
+    hoặc được tính bằng phiên bản html_to_text cũ (text_version khác HTML_TEXT_VERSION).
+    """
+    _add_column_if_missing(cursor, "notes", "title_text", "TEXT")
+    _add_column_if_missing(cursor, "notes", "content_text", "TEXT")
+    _add_column_if_missing(cursor, "notes", "preview", "TEXT")
+    _add_column_if_missing(cursor, "notes", "content_length", "INTEGER")
+    _add_column_if_missing(cursor, "notes", "content_hash", "TEXT")
+    _add_column_if_missing(cursor, "notes", "text_version", "INTEGER")
+    rows = cursor.execute(
+        "SELECT id, title_html, content_html FROM notes "
+        "WHERE preview IS NULL OR content_hash IS NULL OR text_version IS NOT ?",
+        (HTML_TEXT_VERSION,),
+    ).fetchall()
+    if not rows:
+        return
+    assignments = ", ".join(f"{col} = ?" for col in NOTES_DERIVED_COLUMNS)
+    cursor.executemany(
+        f"UPDATE notes SET {assignments} WHERE id = ?",
+        [notes_derived_fields(title_html, content_html) + (note_id,) for note_id, title_html, content_html in rows],
+    )
+    print(f"INFO: Backfilled plain text for {len(rows)} notes.")
+
+
+# --- NOTES: TÌM KIẾM TOÀN VĂN (FTS5) ---
+# rowid của notes_fts = rowid của notes; note_id (không index) để trả kết quả không cần join
+# và để phát hiện rowid bị đánh lại (VACUUM) lúc khởi động
+NOTES_SEARCH_COLUMNS = ("note_id", "title_text", "content_text")
+
+
+def _notes_search_index_in_sync(cursor):
+    return cursor.execute("""
+        SELECT (SELECT COUNT(*) FROM notes) = (SELECT COUNT(*) FROM notes_fts)
+           AND NOT EXISTS (
+               SELECT 1 FROM notes n LEFT JOIN notes_fts f ON f.rowid = n.rowid
+               WHERE f.note_id IS NOT n.id
+           )
+    """).fetchone()[0]
+
+
+def _create_notes_search_index(cursor):
+    """
+    Bảng FTS5 notes_fts trên title_text / content_text (plain text lưu sẵn, xem notes_derived_fields).
+    Đồng bộ bằng trigger khi thêm / sửa / xóa note; lệch với bảng notes thì nạp lại toàn bộ.
+    Trả về False nếu SQLite không có FTS5 (khi đó tìm kiếm note dùng LIKE).
+    """
+    columns = ", ".join(NOTES_SEARCH_COLUMNS)
+    try:
+        cursor.execute("""
+            CREATE VIRTUAL TABLE IF NOT EXISTS notes_fts USING fts5(
+                note_id UNINDEXED, title_text, content_text,
+                tokenize = 'unicode61 remove_diacritics 2',
+                prefix = '2 3'
+            )
+        """)
+    except sqlite3.OperationalError as e:
+        print(f"WARNING: FTS5 not available ({e}), notes search will fall back to LIKE.")
+        return False
+
+    insert_sql = f"INSERT INTO notes_fts (rowid, {columns})"
+    cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_notes_fts_ins AFTER INSERT ON notes
+        BEGIN
+            {insert_sql} VALUES (NEW.rowid, NEW.id, NEW.title_text, NEW.content_text);
+        END
+    """)
+    # Đổi trạng thái / đánh dấu / nhắc hẹn không đụng tới FTS
+    cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_notes_fts_upd AFTER UPDATE OF id, title_text, content_text ON notes
+        BEGIN
+            DELETE FROM notes_fts WHERE rowid = OLD.rowid;
+            {insert_sql} VALUES (NEW.rowid, NEW.id, NEW.title_text, NEW.content_text);
+        END
+    """)
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_notes_fts_del AFTER DELETE ON notes
+        BEGIN
+            DELETE FROM notes_fts WHERE rowid = OLD.rowid;
+        END
+    """)
+
+    if not _notes_search_index_in_sync(cursor):
+        cursor.execute("DELETE FROM notes_fts")
+        cursor.execute(f"{insert_sql} SELECT rowid, id, title_text, content_text FROM notes")
+        print("INFO: Rebuilt notes search index.")
+    return True
+
+
+def init_database(pool=None):
     """
     Khởi tạo tất cả các bảng trong cơ sở dữ liệu nếu chúng chưa tồn tại.
     Hàm này đảm bảo cấu trúc schema luôn đúng theo thiết kế 1-N mới.
+    `pool`: ConnectionPool của một file database khác DATABASE_PATH (vd. database tạm của selfcheck).
     """
-    if not os.path.exists(DATA_DIR):
-        os.makedirs(DATA_DIR)
-        print(f"INFO: Created data directory at: {DATA_DIR}")
-
-    conn = get_db_connection()
+    if pool is not None:
+        conn = pool.acquire()
+    else:
+        if not os.path.exists(DATA_DIR):
+            os.makedirs(DATA_DIR)
+            print(f"INFO: Created data directory at: {DATA_DIR}")
+        conn = get_db_connection()
     cursor = conn.cursor()
     print("INFO: Starting database initialization...")
 
@@ -41,6 +1224,10 @@ def init_database():
             is_marked INTEGER DEFAULT 0
         )
     """)
+    # Bộ lập lịch nhắc hẹn nạp note active theo (status, due_time)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_notes_status_due ON notes(status, due_time)")
+    # Danh sách note phân trang theo modified_at (keyset modified_at, id)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_notes_modified ON notes(modified_at, id)")
 
     # Bảng nhóm MXH
     cursor.execute("""
@@ -97,13 +1284,96 @@ def init_database():
         )
     """)
 
+    # --- MIGRATION: các cột thêm sau khi bảng đã có dữ liệu ---
+    _add_column_if_missing(cursor, "mxh_accounts", "muted_until", "TEXT")
+    _create_mxh_sort_keys(cursor)
+    _create_notes_derived_columns(cursor)
+    _create_notes_search_index(cursor)
+
     # --- TẠO INDEX ĐỂ TĂNG TỐC ĐỘ TRUY VẤN ---
     # Exact index names as requested
     cursor.execute("CREATE INDEX IF NOT EXISTS idx_acc_card ON mxh_accounts(card_id)")
     cursor.execute("CREATE INDEX IF NOT EXISTS idx_cards_group ON mxh_cards(group_id)")
     cursor.execute("CREATE INDEX IF NOT EXISTS idx_cards_platform ON mxh_cards(platform)")
     cursor.execute("CREATE INDEX IF NOT EXISTS idx_acc_status ON mxh_accounts(wechat_status, status)")
+    # idx_acc_has_notice (partial index "notice IS NOT NULL") phục vụ attention-summary khi còn phải
+    # quét JSON notice trên mxh_accounts. attention-summary nay đọc mxh_notices(enabled, due_at)
+    # (_create_mxh_notices), không truy vấn nào lọc mxh_accounts theo notice nữa -> bỏ để khỏi
+    # tốn chi phí ghi mỗi lần đổi notice
+    cursor.execute("DROP INDEX IF EXISTS idx_acc_has_notice")
+    # Tra card theo (group, card_name): kiểm tra trùng tên và import hàng loạt
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_cards_group_name ON mxh_cards(group_id, card_name)")
+    # Các lát lọc hay dùng của /mxh/api/accounts/query (status + die_date, số lần quét)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_acc_status_die ON mxh_accounts(status, die_date)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_acc_scan_count ON mxh_accounts(wechat_scan_count)")
+    # Index theo đúng ORDER BY của từng danh sách (xem mxh_queries.check_list_query_plans).
+    # Danh sách account đọc từ mxh_account_view (MXH_ACCOUNT_VIEW_INDEXES) nên các index danh sách
+    # cũ trên mxh_accounts chỉ còn tốn chi phí ghi -> bỏ; sub_accounts_column chỉ cần idx_acc_card
+    for index_name in ("idx_acc_list_order", "idx_acc_card_primary", "idx_acc_updated"):
+        cursor.execute(f"DROP INDEX IF EXISTS {index_name}")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_cards_sort ON mxh_cards(sort_key)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_cards_group_sort ON mxh_cards(group_id, sort_key)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_cards_name ON mxh_cards(card_name)")
+
+    # --- NHẬT KÝ THAY ĐỔI (delta sync theo revision) ---
+    _create_mxh_change_log(cursor)
+    _create_data_revisions(cursor)
+    _create_mxh_search_index(cursor)
+    _create_mxh_notices(cursor)
+    _create_mxh_stats(cursor)
+    _create_mxh_account_events(cursor)
+    _create_mxh_account_view(cursor)
     
     conn.commit()
+    check_list_query_plans(conn)
     conn.close()
-    print("SUCCESS: Database initialization complete. Ready for 1-N model.")
\ No newline at end of file
+    print("SUCCESS: Database initialization complete. Ready for 1-N model.")
+
+
+# --- LỆNH BẢO TRÌ: flask mxh-stats verify | verify-view | rebuild | selfcheck (app/mxh_selfcheck.py) ---
+mxh_stats_cli = AppGroup("mxh-stats", help="Kiểm tra / dựng lại bảng thống kê mxh_stats và mxh_account_view.")
+
+
+@mxh_stats_cli.command("verify")
+def mxh_stats_verify_command():
+    """So mxh_stats với bảng gốc, thoát mã 1 nếu lệch."""
+    conn = get_db_connection(readonly=True)
+    try:
+        mismatches = verify_mxh_stats(conn)
+    finally:
+        conn.close()
+    if not mismatches:
+        click.echo("mxh_stats OK")
+        return
+    for row in mismatches:
+        click.echo(f"MISMATCH {row}")
+    raise SystemExit(1)
+
+
+@mxh_stats_cli.command("verify-view")
+def mxh_account_view_verify_command():
+    """So mxh_account_view với phép join mxh_accounts + mxh_cards + mxh_groups, thoát mã 1 nếu lệch."""
+    conn = get_db_connection(readonly=True)
+    try:
+        mismatched = verify_mxh_account_view(conn)
+    finally:
+        conn.close()
+    if not mismatched:
+        click.echo("mxh_account_view OK")
+        return
+    click.echo(f"MISMATCH {mismatched} rows")
+    raise SystemExit(1)
+
+
+@mxh_stats_cli.command("rebuild")
+def mxh_stats_rebuild_command():
+    """Dựng lại mxh_stats từ mxh_accounts + mxh_cards."""
+    conn = get_db_connection()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        rebuild_mxh_stats(conn)
+        conn.commit()
+        count = conn.execute("SELECT COUNT(*) FROM mxh_stats").fetchone()[0]
+    finally:
+        conn.close()
+    click.echo(f"mxh_stats rebuilt ({count} rows)")
@@ -0,0 +1,55 @@
+"""
+Phần dùng chung cho tìm kiếm toàn văn (FTS5) của MXH (mxh_search) và Notes (notes_search):
+tách từ khóa, dựng prefix query, đánh dấu highlight, kiểm tra bảng FTS và fallback LIKE.
+"""
+import html
+import re
+
+DEFAULT_SEARCH_LIMIT = 50
+MAX_SEARCH_LIMIT = 200
+
+# Ký tự đánh dấu tạm (không xuất hiện trong dữ liệu), đổi thành <mark> sau khi escape HTML
+MARK_OPEN = "\x02"
+MARK_CLOSE = "\x03"
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+# Tên bảng FTS -> có tồn tại không (không đổi trong lúc chạy nên chỉ hỏi sqlite_master một lần)
+_fts_tables = {}
+
+
+def fts_available(conn, table):
+    if table not in _fts_tables:
+        _fts_tables[table] = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)
+        ).fetchone() is not None
+    return _fts_tables[table]
+
+
+def search_tokens(q):
+    return _TOKEN_RE.findall(q or "")
+
+
+def build_match_query(tokens):
+    """Mỗi từ khóa thành một prefix query ("abc"*), các từ nối bằng AND."""
+    return " ".join(f'"{token}"*' for token in tokens)
+
+
+def clamp_limit(limit):
+    return max(1, min(int(limit), MAX_SEARCH_LIMIT))
+
+
+def like_pattern(text):
+    """Chuỗi -> pattern LIKE "chứa chuỗi" (dùng với ESCAPE '\\')."""
+    return "%" + text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+
+
+def marked_html(text):
+    """Kết quả highlight()/snippet() -> HTML đã escape, phần khớp bọc <mark>."""
+    if text is None:
+        return None
+    return (
+        html.escape(text)
+        .replace(MARK_OPEN, "<mark>")
+        .replace(MARK_CLOSE, "</mark>")
+    )
@@ -0,0 +1,72 @@
+"""
+Trích plain text từ HTML của note (title_html / content_html).
+Dùng html.parser.HTMLParser của thư viện chuẩn, chỉ gom text theo luồng (không dựng cây như BeautifulSoup);
+kết quả được tính một lần lúc ghi note và lưu vào các cột title_text / content_text / preview.
+
+Kết quả KHÔNG giống hệt BeautifulSoup.get_text() mà code cũ dùng:
+- mọi khoảng trắng liên tiếp (kể cả xuống dòng) gộp thành một dấu cách, bỏ ở hai đầu;
+- chèn khoảng trắng ở thẻ khối / xuống dòng (BREAK_TAGS) -> "<p>a</p><p>b</p>" thành "a b" thay vì "ab";
+- thẻ inline không chèn gì -> "a<b>b</b>" thành "ab" (get_text(" ") cho "a b");
+- bỏ nội dung <script> / <style> / <template>.
+"""
+from html.parser import HTMLParser
+
+PREVIEW_LENGTH = 200
+# Tăng khi đổi cách trích text: init_database tính lại title_text / content_text / preview của note cũ
+HTML_TEXT_VERSION = 1
+
+# Thẻ tách dòng / khối: chèn khoảng trắng để chữ hai bên không dính vào nhau
+BREAK_TAGS = frozenset({
+    "br", "p", "div", "li", "ul", "ol", "tr", "td", "th", "table",
+    "h1", "h2", "h3", "h4", "h5", "h6", "blockquote", "pre", "hr", "img",
+})
+# Nội dung của các thẻ này không phải text hiển thị
+SKIP_TAGS = frozenset({"script", "style", "template"})
+
+
+class _TextExtractor(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts = []
+        self._skip = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in SKIP_TAGS:
+            self._skip += 1
+        elif tag in BREAK_TAGS:
+            self.parts.append(" ")
+
+    def handle_startendtag(self, tag, attrs):
+        if tag in BREAK_TAGS:
+            self.parts.append(" ")
+
+    def handle_endtag(self, tag):
+        if tag in SKIP_TAGS:
+            self._skip = max(0, self._skip - 1)
+        elif tag in BREAK_TAGS:
+            self.parts.append(" ")
+
+    def handle_data(self, data):
+        if not self._skip:
+            self.parts.append(data)
+
+
+def html_to_text(html):
+    """HTML -> plain text, gộp mọi khoảng trắng liên tiếp thành một dấu cách."""
+    if not html:
+        return ""
+    if "<" not in html and "&" not in html:
+        return " ".join(html.split())
+    parser = _TextExtractor()
+    parser.feed(html)
+    parser.close()
+    return " ".join("".join(parser.parts).split())
+
+
+def text_preview(text, length=PREVIEW_LENGTH):
+    """Đoạn đầu của text, cắt ở ranh giới từ nếu được."""
+    if len(text) <= length:
+        return text
+    cut = text[:length]
+    space = cut.rfind(" ")
+    return (cut[:space] if space > length // 2 else cut).rstrip() + "…"
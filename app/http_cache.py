@@ -0,0 +1,53 @@
+"""
+HTTP conditional GET cho các API danh sách.
+ETag được suy ra từ revision dữ liệu nên có thể trả 304 trước khi chạy bất kỳ truy vấn nào.
+"""
+import functools
+import hashlib
+from datetime import datetime
+
+from flask import make_response, request
+
+from app.database import get_data_revision, get_db_connection
+
+
+def make_etag(scope, revision, bucket=""):
+    """ETag mạnh: phụ thuộc revision, mốc thời gian (nếu có) và toàn bộ URL (query string ảnh hưởng nội dung)."""
+    raw = f"{scope}:{revision}:{bucket}:{request.full_path}"
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+def today_bucket():
+    """Mốc thời gian theo ngày (giờ máy chủ) cho view có khoảng mặc định tính từ hôm nay."""
+    return datetime.now().date().isoformat()
+
+
+def conditional_get(scope, time_bucket=None):
+    """
+    Decorator cho view GET: trả 304 nếu If-None-Match khớp revision hiện tại.
+    Các method khác (POST/PUT/...) đi thẳng vào view.
+    time_bucket: hàm trả về mốc thời gian mà kết quả phụ thuộc (vd. today_bucket) -> ETag đổi
+    khi sang mốc mới dù dữ liệu không đổi. View so với thời điểm hiện tại một cách liên tục
+    thì không nên dùng decorator này.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            if request.method != "GET":
+                return view(*args, **kwargs)
+
+            conn = get_db_connection(readonly=True)
+            bucket = time_bucket() if time_bucket else ""
+            etag = make_etag(scope, get_data_revision(conn, scope), bucket)
+            if request.if_none_match.contains(etag):
+                response = make_response("", 304)
+            else:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            response.set_etag(etag)
+            # Trình duyệt luôn hỏi lại server (kèm If-None-Match) trước khi dùng cache
+            response.headers["Cache-Control"] = "no-cache"
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,127 @@
+"""
+JSON provider nhanh cho Flask.
+Dùng orjson nếu đã cài (msgspec nếu chọn JSON_BACKEND=msgspec), nếu không thì quay về json chuẩn
+với đúng cấu hình DefaultJSONProvider của Flask (ensure_ascii, datetime/date -> http_date).
+Backend nhanh cho ra cùng dữ liệu JSON, key sắp xếp, chỉ khác là ghi thẳng UTF-8 thay vì escape "\\u...".
+sqlite3.Row -> dict ở mọi backend.
+(Ngoại lệ đã biết: msgspec ghi datetime/date theo ISO 8601 nên không được tự chọn.)
+
+Bật JSON_VERIFY=1 (env) hoặc app.config["JSON_VERIFY"] = True để so sánh từng lần
+serialize với json chuẩn; khác nhau sẽ được log và trả về kết quả của json chuẩn.
+"""
+import os
+import sqlite3
+
+from flask.json.provider import DefaultJSONProvider, _default as _flask_default
+
+try:
+    import orjson
+except ImportError:  # optional dependency
+    orjson = None
+
+try:
+    import msgspec
+except ImportError:  # optional dependency
+    msgspec = None
+
+COMPACT_SEPARATORS = (",", ":")
+
+
+def _default(o):
+    """Các kiểu không phải JSON gốc (dùng chung cho mọi backend)."""
+    if isinstance(o, sqlite3.Row):
+        return dict(o)
+    # datetime/date, Decimal, UUID, dataclass... giữ nguyên cách Flask xử lý
+    return _flask_default(o)
+
+
+def _make_orjson_backend():
+    # datetime/date đi qua _default (http_date như Flask) thay vì ISO 8601 của orjson
+    base = orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+
+    def encode(obj, indent):
+        option = base | (orjson.OPT_INDENT_2 if indent else 0)
+        return orjson.dumps(obj, default=_default, option=option).decode("utf-8")
+
+    return "orjson", encode, orjson.loads, orjson.JSONDecodeError
+
+
+def _make_msgspec_backend():
+    encoder = msgspec.json.Encoder(enc_hook=_default, order="sorted")
+
+    def encode(obj, indent):
+        if indent:
+            raise TypeError("msgspec backend only emits compact JSON")
+        return encoder.encode(obj).decode("utf-8")
+
+    return "msgspec", encode, msgspec.json.decode, msgspec.DecodeError
+
+
+def _select_backend():
+    preferred = os.environ.get("JSON_BACKEND", "").lower()
+    if preferred in ("", "orjson") and orjson is not None:
+        return _make_orjson_backend()
+    if preferred == "msgspec" and msgspec is not None:
+        try:
+            return _make_msgspec_backend()
+        except TypeError:  # msgspec quá cũ, chưa hỗ trợ order="sorted"
+            pass
+    return "json", None, None, None
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """DefaultJSONProvider dùng orjson/msgspec cho các lần dump compact hoặc indent=2."""
+
+    # json chuẩn giữ ensure_ascii / sort_keys mặc định của Flask; chỉ thêm sqlite3.Row -> dict
+    default = staticmethod(_default)
+
+    def __init__(self, app):
+        super().__init__(app)
+        self.backend, self._encode, self._decode, self._decode_error = _select_backend()
+
+    def _dumps_stdlib(self, obj, **kwargs):
+        return super().dumps(obj, **kwargs)
+
+    def dumps(self, obj, **kwargs):
+        indent = kwargs.get("indent")
+        separators = kwargs.get("separators")
+        fast_ok = (
+            self._encode is not None
+            and set(kwargs) <= {"indent", "separators"}
+            and indent in (None, 2)
+            and (indent is not None or separators == COMPACT_SEPARATORS)
+        )
+        if not fast_ok:
+            return self._dumps_stdlib(obj, **kwargs)
+
+        try:
+            result = self._encode(obj, indent)
+        except (TypeError, ValueError, OverflowError):
+            # Số nguyên > 64 bit, kiểu lạ... -> để json chuẩn xử lý
+            return self._dumps_stdlib(obj, **kwargs)
+
+        if self._app.config.get("JSON_VERIFY"):
+            # Backend nhanh luôn xuất UTF-8 -> so với json chuẩn không escape ASCII
+            if result != self._dumps_stdlib(obj, ensure_ascii=False, **kwargs):
+                expected = self._dumps_stdlib(obj, **kwargs)
+                self._app.logger.warning(
+                    "JSON backend %s output differs from stdlib json (%d vs %d bytes)",
+                    self.backend, len(result), len(expected),
+                )
+                return expected
+        return result
+
+    def loads(self, s, **kwargs):
+        if self._decode is None or kwargs:
+            return super().loads(s, **kwargs)
+        try:
+            return self._decode(s)
+        except self._decode_error as e:
+            # Thống nhất kiểu lỗi với json chuẩn (ValueError)
+            raise ValueError(str(e)) from e
+
+
+def init_app(app):
+    """Đăng ký FastJSONProvider cho app."""
+    app.config.setdefault("JSON_VERIFY", os.environ.get("JSON_VERIFY") == "1")
+    app.json = FastJSONProvider(app)
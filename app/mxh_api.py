@@ -1,58 +1,139 @@
 import sqlite3
 import json
+import threading
+import time
 from datetime import datetime, timezone
-from flask import Blueprint, request, jsonify
-from app.database import get_db_connection
+from flask import Blueprint, Response, current_app, request, jsonify, stream_with_context
+from app.database import (
+    MXH_EVENT_PERIODS,
+    MXH_STATS_COLUMNS,
+    NOTICE_TIME_FORMAT,
+    WriteTimeout,
+    get_db_connection,
+    get_mxh_revision,
+    run_write,
+    run_write_sql,
+)
+from app.fts import DEFAULT_SEARCH_LIMIT
+from app.http_cache import conditional_get, today_bucket
+from app.mxh_events import BrokerFull, broker, on_change, publish_after_mutation, stream_events
+from app.mxh_filters import filter_fields, parse_filter, parse_sort
+from app.mxh_io import (
+    EXPORT_FORMATS,
+    MXHImporter,
+    detect_format,
+    export_rows,
+    iter_csv_rows,
+    iter_jsonl_rows,
+    stream_csv,
+    stream_jsonl,
+)
+from app.mxh_search import search_accounts
+from app.mxh_writes import DuplicateCardName, create_account_job, create_card_job, update_account_job
+from app.mxh_queries import (
+    ACCOUNTS_FROM,
+    CARDS_NAME_ORDER,
+    RECENT_ACCOUNTS_ORDER,
+    QueryError,
+    build_select,
+    hydrate_cards,
+    json_array_response,
+    parse_field_names,
+    parse_fields,
+    parse_page,
+    public_columns,
+    select_rows,
+    set_next_cursor,
+    sub_accounts_column,
+)
 
 mxh_api_bp = Blueprint("mxh_api", __name__, url_prefix="/mxh/api")
+mxh_api_bp.after_request(publish_after_mutation)
+
+
+def _account_to_dict(account):
+    """Chuyển row account sang dict, parse notice JSON nếu có."""
+    account_dict = dict(account)
+    if account_dict.get('notice'):
+        try:
+            account_dict['notice'] = current_app.json.loads(account_dict['notice'])
+        except (ValueError, TypeError):
+            account_dict['notice'] = None
+    return account_dict
 
 
 @mxh_api_bp.route("/accounts", methods=["GET"])
+@conditional_get("mxh")
 def get_accounts():
     """
     GET /mxh/api/accounts
     Get all accounts with optional last_updated_at filter for incremental updates.
+    Optional: ?fields=a,b,c (projection), ?limit=&after=<cursor> (keyset pagination).
     """
-    conn = get_db_connection()
+    conn = get_db_connection(readonly=True)
     try:
         last_updated_at = request.args.get('last_updated_at')
+        columns = parse_fields(conn, table="mxh_account_view") or public_columns(conn, "mxh_account_view", "a")
+        page = parse_page(RECENT_ACCOUNTS_ORDER)
+        revision = get_mxh_revision(conn)
         
+        # Chỉ account có card thuộc group (giống JOIN mxh_groups trước đây)
+        where, params = ["a.group_name IS NOT NULL"], []
         if last_updated_at:
             # Get accounts updated after the specified timestamp
-            query = """
-                SELECT a.*, c.card_name, c.platform, c.group_id, g.name as group_name, g.color as group_color, g.icon as group_icon
-                FROM mxh_accounts a
-                JOIN mxh_cards c ON a.card_id = c.id
-                JOIN mxh_groups g ON c.group_id = g.id
-                WHERE a.updated_at > ?
-                ORDER BY a.updated_at DESC
-            """
-            accounts = conn.execute(query, (last_updated_at,)).fetchall()
-        else:
-            # Get all accounts
-            query = """
-                SELECT a.*, c.card_name, c.platform, c.group_id, g.name as group_name, g.color as group_color, g.icon as group_icon
-                FROM mxh_accounts a
-                JOIN mxh_cards c ON a.card_id = c.id
-                JOIN mxh_groups g ON c.group_id = g.id
-                ORDER BY a.updated_at DESC
-            """
-            accounts = conn.execute(query).fetchall()
-        
-        # Convert to list of dictionaries
-        accounts_list = []
-        for account in accounts:
-            account_dict = dict(account)
-            # Parse notice JSON if it exists
-            if account_dict.get('notice'):
-                try:
-                    account_dict['notice'] = json.loads(account_dict['notice'])
-                except (json.JSONDecodeError, TypeError):
-                    account_dict['notice'] = None
-            accounts_list.append(account_dict)
-        
-        return jsonify(accounts_list)
+            where.append("a.updated_at > ?")
+            params.append(last_updated_at)
         
+        accounts, next_cursor = select_rows(
+            conn, columns, ACCOUNTS_FROM,
+            where, params, RECENT_ACCOUNTS_ORDER, page,
+        )
+        
+        # Stream từng account (parse notice ngay khi render)
+        response = json_array_response(_account_to_dict(account) for account in accounts)
+        # Client dùng revision này cho /mxh/api/changes?since=
+        response.headers["X-MXH-Revision"] = str(revision)
+        return set_next_cursor(response, next_cursor)
+        
+    except QueryError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+    finally:
+        conn.close()
+
+
+@mxh_api_bp.route("/accounts/query", methods=["GET"])
+def query_accounts():
+    """
+    GET /mxh/api/accounts/query?filter=<JSON>&sort=-die_date,id
+    Lọc / sắp xếp account phía server (cú pháp: xem app/mxh_filters.py).
+    Hỗ trợ ?fields=, ?limit=&after=<cursor>; ?explain=1 trả về SQL + EXPLAIN QUERY PLAN.
+    Không có ETag (conditional_get): within_days / older_than_days so với thời điểm hiện tại.
+    """
+    conn = get_db_connection(readonly=True)
+    try:
+        fields = filter_fields(conn)
+        where, params = parse_filter(request.args.get("filter"), fields)
+        order_by = parse_sort(request.args.get("sort"), fields)
+        columns = parse_fields(conn, {
+            "card_name": "c.card_name",
+            "group_id": "c.group_id",
+            "platform": "c.platform",
+        }) or public_columns(conn, "mxh_accounts", "a") + ["c.card_name", "c.group_id", "c.platform"]
+        page = parse_page(order_by)
+        from_sql = "FROM mxh_accounts a JOIN mxh_cards c ON a.card_id = c.id"
+
+        if request.args.get("explain") in ("1", "true"):
+            sql, sql_params = build_select(columns, from_sql, where, params, order_by, page)
+            plan = [row["detail"] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", sql_params)]
+            return jsonify({"sql": sql, "params": sql_params, "plan": plan})
+
+        rows, next_cursor = select_rows(conn, columns, from_sql, where, params, order_by, page)
+        response = json_array_response(rows)
+        return set_next_cursor(response, next_cursor)
+    except QueryError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         return jsonify({"error": str(e)}), 500
     finally:
@@ -65,7 +146,6 @@ def create_card():
     POST /mxh/api/cards
     Create a new card with validation for unique card_name within group_id.
     """
-    conn = get_db_connection()
     try:
         data = request.get_json()
         if not data:
@@ -83,111 +163,74 @@ def create_card():
         if not platform:
             return jsonify({"error": "platform is required", "field": "platform"}), 400
         
-        # Check if card_name is unique within the same group_id
-        existing_card = conn.execute(
-            "SELECT id FROM mxh_cards WHERE card_name = ? AND group_id = ?",
-            (card_name, group_id)
-        ).fetchone()
-        
-        if existing_card:
-            return jsonify({
-                "error": f"Card name '{card_name}' already exists in group {group_id}",
-                "field": "card_name"
-            }), 400
-        
-        # Start transaction
-        conn.execute("BEGIN")
-        
-        # Create the card
         now = datetime.now(timezone.utc).astimezone().isoformat()
-        cursor = conn.execute(
-            "INSERT INTO mxh_cards (card_name, group_id, platform, created_at, updated_at) VALUES (?, ?, ?, ?, ?)",
-            (card_name, group_id, platform, now, now)
-        )
-        card_id = cursor.lastrowid
-        
-        # Create the primary account
-        conn.execute(
-            """INSERT INTO mxh_accounts (
-                card_id, is_primary, account_name, username, phone, url, 
-                login_username, login_password, wechat_created_day, wechat_created_month, 
-                wechat_created_year, wechat_status, status, created_at, updated_at
-            ) VALUES (?, 1, 'Primary Account', ?, ?, ?, ?, ?, ?, ?, ?, ?, 'active', ?, ?)""",
-            (
-                card_id,
-                data.get("username", ""),
-                data.get("phone", ""),
-                data.get("url", ""),
-                data.get("login_username", data.get("username", "")),  # Fallback login username
-                data.get("login_password", ""),
-                data.get("wechat_created_day"),
-                data.get("wechat_created_month"),
-                data.get("wechat_created_year"),
-                "available",  # Default wechat_status
-                now,  # created_at
-                now   # updated_at
-            )
+        new_card, _ = run_write(
+            create_card_job, card_name, group_id, platform, now,
+            {
+                "account_name": "Primary Account",
+                "username": data.get("username", ""),
+                "phone": data.get("phone", ""),
+                "url": data.get("url", ""),
+                "login_username": data.get("login_username", data.get("username", "")),  # Fallback login username
+                "login_password": data.get("login_password", ""),
+                "wechat_created_day": data.get("wechat_created_day"),
+                "wechat_created_month": data.get("wechat_created_month"),
+                "wechat_created_year": data.get("wechat_created_year"),
+                "wechat_status": "available",  # Default wechat_status
+                "status": "active",
+            },
         )
         
-        conn.commit()
-        
         # Return success message
-        return jsonify({"message": "Card and primary account created successfully", "card_id": card_id}), 201
+        return jsonify({"message": "Card and primary account created successfully", "card_id": new_card["id"]}), 201
         
+    except DuplicateCardName as e:
+        return jsonify({"error": str(e), "field": "card_name"}), 400
     except sqlite3.IntegrityError as e:
-        conn.rollback()
         return jsonify({"error": f"Database constraint violation: {str(e)}"}), 400
+    except WriteTimeout as e:
+        return jsonify({"error": str(e)}), 503
     except Exception as e:
-        conn.rollback()
         return jsonify({"error": str(e)}), 500
-    finally:
-        conn.close()
 
 
 @mxh_api_bp.route("/cards", methods=["GET"])
+@conditional_get("mxh")
 def get_cards():
     """
     GET /mxh/api/cards?group_id=&platform=
     Return a list of cards with accounts_summary.
+    Optional: ?fields= (sub_accounts projection), ?limit=&after=<cursor>.
     """
-    conn = get_db_connection()
+    conn = get_db_connection(readonly=True)
     try:
         group_id = request.args.get("group_id")
         platform = request.args.get("platform")
+        sub_fields = parse_field_names(conn)
+        page = parse_page(CARDS_NAME_ORDER)
         
         # Build query with optional filters
-        query = "SELECT * FROM mxh_cards WHERE 1=1"
-        params = []
+        where, params = [], []
         
         if group_id:
-            query += " AND group_id = ?"
+            where.append("c.group_id = ?")
             params.append(group_id)
         
         if platform:
-            query += " AND platform = ?"
+            where.append("c.platform = ?")
             params.append(platform)
         
-        query += " ORDER BY card_name"
-        
-        cards = conn.execute(query, params).fetchall()
-        
-        # Convert to list of dictionaries with nested sub_accounts
-        result = [dict(card) for card in cards]
-        card_ids = [c["id"] for c in result]
-
-        if card_ids:
-            placeholders = ",".join("?" for _ in card_ids)
-            sub_accounts = conn.execute(
-                f"SELECT * FROM mxh_accounts WHERE card_id IN ({placeholders}) ORDER BY is_primary DESC, id ASC",
-                card_ids,
-            ).fetchall()
-            for card in result:
-                card["sub_accounts"] = [
-                    dict(sa) for sa in sub_accounts if sa["card_id"] == card["id"]
-                ]
+        cards, next_cursor = select_rows(
+            conn, public_columns(conn, "mxh_cards", "c") + [sub_accounts_column(conn, sub_fields)],
+            "FROM mxh_cards c", where, params, CARDS_NAME_ORDER, page,
+        )
         
-        return jsonify(result)
+        # Stream danh sách card kèm sub_accounts lồng bên trong
+        response = json_array_response(hydrate_cards(cards))
+        return set_next_cursor(response, next_cursor)
         
+    except QueryError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         return jsonify({"error": str(e)}), 500
     finally:
@@ -200,17 +243,11 @@ def create_account(card_id):
     POST /mxh/api/cards/<card_id>/accounts
     Create a new account under the specified card.
     """
-    conn = get_db_connection()
     try:
         data = request.get_json()
         if not data:
             return jsonify({"error": "Request body is required"}), 400
         
-        # Check if card exists and get card info
-        card = conn.execute("SELECT * FROM mxh_cards WHERE id = ?", (card_id,)).fetchone()
-        if not card:
-            return jsonify({"error": "Card not found"}), 404
-        
         # Get or set default values
         account_name = data.get("account_name", "Sub Account")
         username = data.get("username", "...")
@@ -218,60 +255,43 @@ def create_account(card_id):
         
         # Create the account
         now = datetime.now(timezone.utc).astimezone().isoformat()
-        cursor = conn.execute(
-            """INSERT INTO mxh_accounts (
-                card_id, is_primary, account_name, username, phone, url, 
-                login_username, login_password, wechat_created_day, wechat_created_month, 
-                wechat_created_year, wechat_status, status, die_date, wechat_scan_count, 
-                wechat_last_scan_date, rescue_count, rescue_success_count, email_reset_date, 
-                notice, created_at, updated_at
-            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
-            (
-                card_id,
-                data.get("is_primary", 0),
-                account_name,
-                username,
-                phone,
-                data.get("url", ""),
-                data.get("login_username", ""),
-                data.get("login_password", ""),
-                data.get("wechat_created_day"),
-                data.get("wechat_created_month"),
-                data.get("wechat_created_year"),
-                data.get("wechat_status", "available"),
-                data.get("status", "active"),
-                data.get("die_date"),
-                0,  # wechat_scan_count
-                data.get("wechat_last_scan_date"),
-                0,  # rescue_count
-                0,  # rescue_success_count
-                data.get("email_reset_date"),
-                data.get("notice"),
-                now,
-                now
-            )
+        new_account = run_write(
+            create_account_job, card_id,
+            {
+                "is_primary": data.get("is_primary", 0),
+                "account_name": account_name,
+                "username": username,
+                "phone": phone,
+                "url": data.get("url", ""),
+                "login_username": data.get("login_username", ""),
+                "login_password": data.get("login_password", ""),
+                "wechat_created_day": data.get("wechat_created_day"),
+                "wechat_created_month": data.get("wechat_created_month"),
+                "wechat_created_year": data.get("wechat_created_year"),
+                "wechat_status": data.get("wechat_status", "available"),
+                "status": data.get("status", "active"),
+                "die_date": data.get("die_date"),
+                "wechat_scan_count": 0,
+                "wechat_last_scan_date": data.get("wechat_last_scan_date"),
+                "rescue_count": 0,
+                "rescue_success_count": 0,
+                "email_reset_date": data.get("email_reset_date"),
+                "notice": data.get("notice"),
+            },
+            now,
         )
-        account_id = cursor.lastrowid
-        
-        conn.commit()
+        if new_account is None:
+            return jsonify({"error": "Card not found"}), 404
         
         # Return the created account with card info
-        new_account = conn.execute("""
-            SELECT a.*, c.card_name, c.platform, c.group_id
-            FROM mxh_accounts a
-            JOIN mxh_cards c ON a.card_id = c.id
-            WHERE a.id = ?
-        """, (account_id,)).fetchone()
-        return jsonify(dict(new_account)), 201
+        return jsonify(new_account), 201
         
     except sqlite3.IntegrityError as e:
-        conn.rollback()
         return jsonify({"error": f"Database constraint violation: {str(e)}"}), 400
+    except WriteTimeout as e:
+        return jsonify({"error": str(e)}), 503
     except Exception as e:
-        conn.rollback()
         return jsonify({"error": str(e)}), 500
-    finally:
-        conn.close()
 
 
 @mxh_api_bp.route("/accounts/<int:account_id>/quick-update", methods=["POST"])
@@ -280,7 +300,6 @@ def quick_update_account(account_id):
     POST /mxh/api/accounts/<id>/quick-update
     Quick update for inline editing of account fields.
     """
-    conn = get_db_connection()
     try:
         data = request.get_json()
         if not data:
@@ -304,27 +323,26 @@ def quick_update_account(account_id):
         
         # Update the field
         now = datetime.now(timezone.utc).astimezone().isoformat()
-        conn.execute(
+        _, updated = run_write_sql(
             f"UPDATE mxh_accounts SET {field} = ?, updated_at = ? WHERE id = ?",
             (value, now, account_id)
         )
         
-        if conn.total_changes == 0:
+        if updated == 0:
             return jsonify({"error": "Account not found"}), 404
         
-        conn.commit()
         return jsonify({"message": "Account updated successfully"}), 200
         
+    except WriteTimeout as e:
+        return jsonify({"error": str(e)}), 503
     except Exception as e:
-        conn.rollback()
         return jsonify({"error": str(e)}), 500
-    finally:
-        conn.close()
 
 
 @mxh_api_bp.route("/groups", methods=["GET", "POST"])
+@conditional_get("mxh")
 def mxh_groups():
-    conn = get_db_connection()
+    conn = get_db_connection(readonly=True)
     try:
         if request.method == "GET":
             groups = conn.execute(
@@ -350,15 +368,14 @@ def mxh_groups():
             }
             icon = platform_icons.get(name.lower(), "bi-share-fill")
             try:
-                cursor = conn.execute(
+                group_id, _ = run_write_sql(
                     "INSERT INTO mxh_groups (name, color, icon, created_at) VALUES (?, ?, ?, ?)",
                     (name, color, icon, datetime.now().isoformat()),
                 )
-                conn.commit()
                 return (
                     jsonify(
                         {
-                            "id": cursor.lastrowid,
+                            "id": group_id,
                             "name": name,
                             "color": color,
                             "icon": icon,
@@ -369,6 +386,8 @@ def mxh_groups():
                 )
             except sqlite3.IntegrityError:
                 return jsonify({"error": f'Group "{name}" already exists.'}), 400
+    except WriteTimeout as e:
+        return jsonify({"error": str(e)}), 503
     except Exception as e:
         return jsonify({"error": str(e)}), 500
     finally:
@@ -381,54 +400,24 @@ def update_account(account_id):
     PUT /mxh/api/accounts/<account_id>
     Cập nhật toàn diện thông tin cho một account.
     """
-    conn = get_db_connection()
     try:
         data = request.get_json()
         if not data:
             return jsonify({"error": "Request body is required"}), 400
 
-        account = conn.execute("SELECT card_id FROM mxh_accounts WHERE id = ?", (account_id,)).fetchone()
-        if not account:
-            return jsonify({"error": "Account not found"}), 404
-
         now = datetime.now(timezone.utc).astimezone().isoformat()
-        
-        conn.execute("BEGIN")
 
-        # --- Update mxh_accounts table ---
-        account_fields = {}
-        allowed_account_fields = [
-            "username", "phone", "wechat_created_day", "wechat_created_month",
-            "wechat_created_year", "status", "muted_until", "wechat_status", "die_date"
-        ]
-        
-        for field in allowed_account_fields:
-            if field in data:
-                account_fields[field] = data[field]
-        
-        if account_fields:
-            account_fields["updated_at"] = now
-            set_clause = ", ".join([f"{key} = ?" for key in account_fields.keys()])
-            params = list(account_fields.values()) + [account_id]
-            conn.execute(f"UPDATE mxh_accounts SET {set_clause} WHERE id = ?", params)
-
-        # --- Update mxh_cards table (for card_name) ---
-        if "card_name" in data:
-            conn.execute(
-                "UPDATE mxh_cards SET card_name = ?, updated_at = ? WHERE id = ?",
-                (data["card_name"], now, account['card_id'])
-            )
+        # Cùng job / allow-list (ACCOUNT_UPDATE_FIELDS) với PUT /mxh/api/accounts/<id> của mxh_routes
+        updated_account = run_write(update_account_job, account_id, data, now, data.get("card_name"))
+        if updated_account is None:
+            return jsonify({"error": "Account not found"}), 404
 
-        conn.commit()
-        
-        updated_account = conn.execute("SELECT a.*, c.card_name, c.platform, c.group_id FROM mxh_accounts a JOIN mxh_cards c ON a.card_id = c.id WHERE a.id = ?", (account_id,)).fetchone()
-        return jsonify(dict(updated_account))
+        return jsonify(updated_account)
 
+    except WriteTimeout as e:
+        return jsonify({"error": str(e)}), 503
     except Exception as e:
-        conn.rollback()
         return jsonify({"error": str(e)}), 500
-    finally:
-        conn.close()
 
 
 @mxh_api_bp.route("/notice", methods=["GET"])
@@ -437,36 +426,36 @@ def get_notice():
     GET /mxh/api/notice?account_id=...
     Get notice data for a specific account.
     """
-    conn = get_db_connection()
+    conn = get_db_connection(readonly=True)
     try:
         account_id = request.args.get('account_id')
         if not account_id:
             return jsonify({"error": "account_id is required"}), 400
         
         # Get account with notice data
-        account = conn.execute(
-            "SELECT * FROM mxh_accounts WHERE id = ?", 
-            (account_id,)
-        ).fetchone()
+        account = conn.execute("""
+            SELECT a.id, n.enabled, n.title, n.note,
+                   COALESCE(
+                       CASE WHEN json_valid(a.notice) THEN json_extract(a.notice, '$.due_date') END,
+                       n.due_at
+                   ) AS due_date
+            FROM mxh_accounts a
+            LEFT JOIN mxh_notices n ON n.account_id = a.id
+            WHERE a.id = ?
+        """, (account_id,)).fetchone()
         
         if not account:
             return jsonify({"error": "Account not found"}), 404
         
-        # Parse notice JSON
         notice_data = {}
-        if account['notice']:
-            try:
-                notice_obj = json.loads(account['notice'])
-                if notice_obj and notice_obj.get('enabled'):
-                    notice_data = {
-                        "title": notice_obj.get('title', 'Thông báo đến hạn'),
-                        "message": notice_obj.get('note', 'Không có nội dung'),
-                        "due_human": notice_obj.get('due_date', ''),
-                        "due_at": notice_obj.get('due_date'),
-                        "notice_id": account_id
-                    }
-            except json.JSONDecodeError:
-                pass
+        if account['enabled']:
+            notice_data = {
+                "title": account['title'] or 'Thông báo đến hạn',
+                "message": account['note'] or 'Không có nội dung',
+                "due_human": account['due_date'] or '',
+                "due_at": account['due_date'],
+                "notice_id": account_id
+            }
         
         return jsonify(notice_data)
         
@@ -483,7 +472,6 @@ def disable_notice():
     Disable notice for an account.
     Body: {"account_id": "..."} or {"notice_id": "..."}
     """
-    conn = get_db_connection()
     try:
         data = request.get_json()
         if not data:
@@ -502,17 +490,497 @@ def disable_notice():
             "start_at": None
         })
         
-        conn.execute(
+        run_write_sql(
             "UPDATE mxh_accounts SET notice = ?, updated_at = ? WHERE id = ?",
             (disabled_notice, datetime.now().isoformat(), account_id)
         )
         
-        conn.commit()
-        
         return jsonify({"ok": True, "message": "Notice disabled successfully"})
         
+    except WriteTimeout as e:
+        return jsonify({"error": str(e)}), 503
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+# --- THỐNG KÊ ---
+STATS_BREAKDOWNS = {
+    "group": ("s.group_key",),
+    "platform": ("s.platform",),
+    "group_platform": ("s.group_key", "s.platform"),
+}
+
+
+def _stats_row(row):
+    """Dòng mxh_stats (đã cộng) -> dict, thêm các chỉ số suy ra."""
+    item = dict(row)
+    if "group_key" in item:
+        item["group_id"] = item.pop("group_key") or None
+    attempts = item["rescue_total"] + item["rescue_success_total"]
+    item["other_accounts"] = item["accounts"] - item["active_accounts"] - item["die_accounts"]
+    item["rescue_success_rate"] = round(item["rescue_success_total"] / attempts, 4) if attempts else None
+    return item
+
+
+@mxh_api_bp.route("/stats", methods=["GET"])
+@conditional_get("mxh")
+def get_stats():
+    """
+    GET /mxh/api/stats?by=group|platform|group_platform&group_id=&platform=
+    Số card / account (active, die), tổng lượt quét, tỷ lệ cứu thành công.
+    Đọc từ bảng tổng hợp mxh_stats (trigger duy trì) nên không quét mxh_accounts.
+    """
+    conn = get_db_connection(readonly=True)
+    try:
+        by = request.args.get("by")
+        if by and by not in STATS_BREAKDOWNS:
+            return jsonify({"error": f"by must be one of: {', '.join(STATS_BREAKDOWNS)}"}), 400
+
+        where, params = [], []
+        if request.args.get("group_id"):
+            where.append("s.group_key = ?")
+            params.append(request.args.get("group_id"))
+        if request.args.get("platform"):
+            where.append("s.platform = ?")
+            params.append(request.args.get("platform"))
+        where_sql = (" WHERE " + " AND ".join(where)) if where else ""
+        sums = ", ".join(f"COALESCE(SUM(s.{col}), 0) AS {col}" for col in MXH_STATS_COLUMNS)
+
+        totals = conn.execute(f"SELECT {sums} FROM mxh_stats s{where_sql}", params).fetchone()
+        result = {"totals": _stats_row(totals)}
+
+        if by:
+            keys = STATS_BREAKDOWNS[by]
+            having = " OR ".join(f"SUM(s.{col}) != 0" for col in MXH_STATS_COLUMNS)
+            group_cols = ", ".join(f"{key} AS {key.split('.')[1]}" for key in keys)
+            group_info = ", g.name AS group_name, g.color AS group_color" if "s.group_key" in keys else ""
+            join = " LEFT JOIN mxh_groups g ON g.id = s.group_key" if group_info else ""
+            rows = conn.execute(f"""
+                SELECT {group_cols}{group_info}, {sums}
+                FROM mxh_stats s{join}{where_sql}
+                GROUP BY {", ".join(keys)}
+                HAVING {having}
+                ORDER BY {", ".join(keys)}
+            """, params).fetchall()
+            result[by] = [_stats_row(row) for row in rows]
+
+        return jsonify(result)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+    finally:
+        conn.close()
+
+
+# --- ANALYTICS (từ mxh_event_rollups) ---
+# Khoảng mặc định khi không truyền ?from=
+ANALYTICS_DEFAULT_RANGE = {"day": "-30 days", "week": "-84 days"}
+# Ngày (YYYY-MM-DD, giờ máy chủ) -> ngày đầu kỳ, khớp với bucket trong MXH_EVENT_PERIODS
+ANALYTICS_PERIOD_START = {
+    "day": "date({d})",
+    "week": "date({d}, 'weekday 0', '-6 days')",
+}
+
+
+@mxh_api_bp.route("/analytics", methods=["GET"])
+# Khoảng mặc định tính từ hôm nay -> ETag đổi theo ngày
+@conditional_get("mxh", time_bucket=today_bucket)
+def get_analytics():
+    """
+    GET /mxh/api/analytics?period=day|week&from=YYYY-MM-DD&to=YYYY-MM-DD&events=scan,rescue-success
+                          &group_id=&platform=
+    Số thao tác theo ngày / tuần (bucket = ngày đầu kỳ, giờ máy chủ) kèm tỷ lệ cứu thành công.
+    Chỉ đọc bảng rollup, không quét nhật ký sự kiện gốc.
+    """
+    conn = get_db_connection(readonly=True)
+    try:
+        period = request.args.get("period", "day")
+        if period not in MXH_EVENT_PERIODS:
+            return jsonify({"error": f"period must be one of: {', '.join(MXH_EVENT_PERIODS)}"}), 400
+
+        # from/to là ngày theo giờ máy chủ, chuẩn hóa về đầu kỳ để so sánh trực tiếp với bucket
+        period_start = ANALYTICS_PERIOD_START[period]
+        start, end = conn.execute(
+            f"SELECT {period_start.format(d='COALESCE(:from, date(:today, :range))')}, "
+            f"{period_start.format(d='COALESCE(:to, :today)')}",
+            {
+                "from": request.args.get("from"),
+                "to": request.args.get("to"),
+                "today": datetime.now().date().isoformat(),
+                "range": ANALYTICS_DEFAULT_RANGE[period],
+            },
+        ).fetchone()
+        if start is None or end is None:
+            return jsonify({"error": "from/to must be dates (YYYY-MM-DD)"}), 400
+
+        where = ["r.period = ?", "r.bucket BETWEEN ? AND ?"]
+        params = [period, start, end]
+        events = [e.strip() for e in request.args.get("events", "").split(",") if e.strip()]
+        if events:
+            where.append(f"r.event IN ({', '.join('?' * len(events))})")
+            params.extend(events)
+        if request.args.get("group_id"):
+            where.append("r.group_key = ?")
+            params.append(request.args.get("group_id"))
+        if request.args.get("platform"):
+            where.append("r.platform = ?")
+            params.append(request.args.get("platform"))
+
+        rows = conn.execute(f"""
+            SELECT r.bucket, r.event, SUM(r.count) AS count
+            FROM mxh_event_rollups r
+            WHERE {" AND ".join(where)}
+            GROUP BY r.bucket, r.event
+            ORDER BY r.bucket
+        """, params).fetchall()
+
+        buckets = {}
+        totals = {}
+        for row in rows:
+            counts = buckets.setdefault(row["bucket"], {})
+            counts[row["event"]] = row["count"]
+            totals[row["event"]] = totals.get(row["event"], 0) + row["count"]
+
+        def success_rate(counts):
+            attempts = counts.get("rescue-success", 0) + counts.get("rescue-fail", 0)
+            return round(counts.get("rescue-success", 0) / attempts, 4) if attempts else None
+
+        return jsonify({
+            "period": period,
+            "from": start,
+            "to": end,
+            "totals": dict(totals, rescue_success_rate=success_rate(totals)),
+            "buckets": [
+                {"bucket": bucket, "counts": counts, "rescue_success_rate": success_rate(counts)}
+                for bucket, counts in buckets.items()
+            ],
+        })
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+    finally:
+        conn.close()
+
+
+# Số notice tối đa trả về mỗi lần
+MAX_DUE_NOTICES = 1000
+
+
+@mxh_api_bp.route("/notices/due", methods=["GET"])
+def get_due_notices():
+    """
+    GET /mxh/api/notices/due?before=<ISO 8601>&limit=
+    Các notice đang bật, đến hạn trước `before` (mặc định: bây giờ), sớm nhất trước.
+    Ví dụ "sắp đến hạn trong 24h": before = now + 24h. `overdue` = đã quá hạn tại thời điểm gọi.
+    """
+    conn = get_db_connection(readonly=True)
+    try:
+        before = request.args.get("before")
+        try:
+            limit = max(1, min(int(request.args.get("limit", MAX_DUE_NOTICES)), MAX_DUE_NOTICES))
+        except ValueError:
+            return jsonify({"error": "limit must be an integer"}), 400
+        # Chuẩn hóa về UTC cùng định dạng với mxh_notices.due_at (chấp nhận mọi offset)
+        before_iso, now_iso = conn.execute(
+            "SELECT strftime(:fmt, COALESCE(:before, 'now')), strftime(:fmt, 'now')",
+            {"fmt": NOTICE_TIME_FORMAT, "before": before},
+        ).fetchone()
+        if before_iso is None:
+            return jsonify({"error": "before must be an ISO 8601 datetime"}), 400
+
+        rows = conn.execute("""
+            SELECT n.account_id, n.title, n.note, n.start_at, n.due_at,
+                   n.due_at <= :now AS overdue,
+                   a.username, a.phone, c.card_name, c.group_id, c.platform
+            FROM mxh_notices n
+            JOIN mxh_accounts a ON a.id = n.account_id
+            JOIN mxh_cards c ON c.id = a.card_id
+            WHERE n.enabled = 1 AND n.due_at <= :before
+            ORDER BY n.due_at
+            LIMIT :limit
+        """, {"now": now_iso, "before": before_iso, "limit": limit}).fetchall()
+
+        notices = []
+        for row in rows:
+            item = dict(row)
+            item["overdue"] = bool(item["overdue"])
+            notices.append(item)
+        return jsonify({"before": before_iso, "now": now_iso, "notices": notices})
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+    finally:
+        conn.close()
+
+
+@mxh_api_bp.route("/changes", methods=["GET"])
+@conditional_get("mxh")
+def get_changes():
+    """
+    GET /mxh/api/changes?since=<rev>
+    Delta sync theo revision của bảng mxh_changes.
+    Trả về group/card/account thay đổi sau `since` và id các bản ghi đã bị xóa.
+    Client lưu lại `revision` để dùng cho lần gọi kế tiếp.
+    """
+    conn = get_db_connection(readonly=True)
+    try:
+        since = request.args.get("since", default=0, type=int)
+
+        # Đọc revision TRƯỚC khi đọc dữ liệu: thay đổi chen vào giữa sẽ được trả lại ở lần sau
+        revision = get_mxh_revision(conn)
+
+        accounts = conn.execute(f"""
+            SELECT {", ".join(public_columns(conn, "mxh_accounts", "a"))}, c.card_name, c.platform, c.group_id, g.name as group_name, g.color as group_color, g.icon as group_icon
+            FROM mxh_changes ch
+            JOIN mxh_accounts a ON a.id = ch.entity_id
+            JOIN mxh_cards c ON a.card_id = c.id
+            LEFT JOIN mxh_groups g ON c.group_id = g.id
+            WHERE ch.rev > ? AND ch.entity = 'account' AND ch.op = 'upsert'
+            ORDER BY ch.rev
+        """, (since,)).fetchall()
+        cards = conn.execute(f"""
+            SELECT {", ".join(public_columns(conn, "mxh_cards", "c"))}
+            FROM mxh_changes ch
+            JOIN mxh_cards c ON c.id = ch.entity_id
+            WHERE ch.rev > ? AND ch.entity = 'card' AND ch.op = 'upsert'
+            ORDER BY ch.rev
+        """, (since,)).fetchall()
+        groups = conn.execute("""
+            SELECT g.*
+            FROM mxh_changes ch
+            JOIN mxh_groups g ON g.id = ch.entity_id
+            WHERE ch.rev > ? AND ch.entity = 'group' AND ch.op = 'upsert'
+            ORDER BY ch.rev
+        """, (since,)).fetchall()
+
+        deleted = {"accounts": [], "cards": [], "groups": []}
+        for row in conn.execute(
+            "SELECT entity, entity_id FROM mxh_changes WHERE rev > ? AND op = 'delete' ORDER BY rev",
+            (since,),
+        ):
+            deleted[row["entity"] + "s"].append(row["entity_id"])
+
+        return jsonify({
+            "since": since,
+            "revision": revision,
+            "accounts": [_account_to_dict(a) for a in accounts],
+            "cards": [dict(c) for c in cards],
+            "groups": [dict(g) for g in groups],
+            "deleted": deleted,
+        })
+
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+    finally:
+        conn.close()
+
+
+@mxh_api_bp.route("/stream", methods=["GET"])
+def stream_changes():
+    """
+    GET /mxh/api/stream
+    Server-Sent Events: đẩy sự kiện `change` mỗi khi dữ liệu MXH thay đổi.
+    Sự kiện đầu tiên `hello` chứa revision hiện tại để client đồng bộ qua /changes.
+    """
+    try:
+        subscription = broker.subscribe()
+    except BrokerFull:
+        response = jsonify({"error": "Too many stream clients"})
+        response.status_code = 503
+        response.headers["Retry-After"] = "30"
+        return response
+
+    try:
+        conn = get_db_connection(readonly=True)
+        hello = {"revision": get_mxh_revision(conn)}
+        conn.close()
+    except Exception as e:
+        broker.unsubscribe(subscription)
+        return jsonify({"error": str(e)}), 500
+
+    return Response(
+        stream_events(subscription, hello=hello),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+# --- ATTENTION SUMMARY (badge MXH trên navbar) ---
+# Cache kết quả tối đa ATTENTION_CACHE_SECONDS, bị xóa khi có ghi MXH
+# hoặc hết hạn sớm hơn khi có notice / mốc 1 năm sắp tới.
+ATTENTION_CACHE_SECONDS = 300
+_attention_cache = {"generation": 0, "summary": None, "expires_at": 0.0}
+_attention_lock = threading.Lock()
+
+
+@on_change
+def _invalidate_attention_summary():
+    with _attention_lock:
+        _attention_cache["generation"] += 1
+        _attention_cache["summary"] = None
+
+
+# WeChat đủ 1 năm tính từ ngày tạo tài khoản WeChat
+_WECHAT_ANNIVERSARY_SQL = """
+    julianday(printf('%04d-%02d-%02d', a.wechat_created_year,
+                     COALESCE(a.wechat_created_month, 1), COALESCE(a.wechat_created_day, 1)), '+365 days')
+"""
+
+
+# Account hiển thị mặc định trên mặt card (mxh.html: accounts.find(is_primary) || accounts[0]);
+# badge từng card và badge tổng chỉ xét account này, không xét mọi account phụ của card
+_CARD_FACE_ACCOUNT_SQL = """a.id = (
+    SELECT f.id FROM mxh_accounts f WHERE f.card_id = a.card_id ORDER BY f.is_primary DESC, f.id LIMIT 1
+)"""
+
+
+def _compute_attention_summary(conn):
+    now_jd, now_iso = conn.execute(
+        "SELECT julianday('now'), strftime(?, 'now')", (NOTICE_TIME_FORMAT,)
+    ).fetchone()
+    # Notice hết hạn (giống getCardBadge trên FE): quét khoảng trên idx_notices_due,
+    # chỉ tính account đại diện của card (_CARD_FACE_ACCOUNT_SQL) như badge từng card
+    notices = conn.execute(f"""
+        SELECT
+            (SELECT COUNT(*) FROM mxh_notices n JOIN mxh_accounts a ON a.id = n.account_id
+             WHERE n.enabled = 1 AND n.due_at <= :now AND {_CARD_FACE_ACCOUNT_SQL}) AS expired,
+            (SELECT julianday(MIN(n.due_at)) FROM mxh_notices n JOIN mxh_accounts a ON a.id = n.account_id
+             WHERE n.enabled = 1 AND n.due_at > :now AND {_CARD_FACE_ACCOUNT_SQL}) AS next_due
+    """, {"now": now_iso}).fetchone()
+    wechat = conn.execute(f"""
+        SELECT
+            SUM(CASE WHEN anniversary <= :now THEN 1 ELSE 0 END) AS need_hk,
+            MIN(CASE WHEN anniversary > :now THEN anniversary END) AS next_anniversary
+        FROM (
+            SELECT {_WECHAT_ANNIVERSARY_SQL} AS anniversary
+            FROM mxh_cards c
+            JOIN mxh_accounts a ON a.card_id = c.id
+            WHERE c.platform = 'wechat' AND a.wechat_created_year IS NOT NULL
+              AND {_CARD_FACE_ACCOUNT_SQL}
+              AND replace(replace(COALESCE(a.phone, ''), ' ', ''), '+', '') NOT LIKE '852%'
+        )
+    """, {"now": now_jd}).fetchone()
+
+    expired = notices["expired"] or 0
+    need_hk = wechat["need_hk"] or 0
+    summary = {
+        "expiredNoticeCount": expired,
+        "oneYearNoHKChangeCount": need_hk,
+        "totalAttention": expired + need_hk,
+    }
+
+    # Kết quả thay đổi theo thời gian: hết hạn cache ở mốc kế tiếp
+    ttl = ATTENTION_CACHE_SECONDS
+    for next_jd in (notices["next_due"], wechat["next_anniversary"]):
+        if next_jd is not None:
+            ttl = min(ttl, max(1.0, (next_jd - now_jd) * 86400))
+    return summary, ttl
+
+
+@mxh_api_bp.route("/attention-summary", methods=["GET"])
+def get_attention_summary():
+    """
+    GET /mxh/api/attention-summary
+    Số notice đã hết hạn + số account WeChat >= 1 năm chưa đổi số HK (cho badge navbar).
+    """
+    now = time.monotonic()
+    with _attention_lock:
+        if _attention_cache["summary"] is not None and _attention_cache["expires_at"] > now:
+            return jsonify(_attention_cache["summary"])
+        generation = _attention_cache["generation"]
+
+    conn = get_db_connection(readonly=True)
+    try:
+        summary, ttl = _compute_attention_summary(conn)
+        with _attention_lock:
+            # Bỏ qua nếu đã có ghi mới trong lúc đang tính
+            if _attention_cache["generation"] == generation:
+                _attention_cache["summary"] = summary
+                _attention_cache["expires_at"] = now + ttl
+        return jsonify(summary)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+    finally:
+        conn.close()
+
+
+# --- TÌM KIẾM ---
+@mxh_api_bp.route("/search", methods=["GET"])
+@conditional_get("mxh")
+def search():
+    """
+    GET /mxh/api/search?q=&limit=&group_id=&platform=
+    Tìm account theo username, số điện thoại, tên card, tiêu đề/ghi chú notice (khớp tiền tố).
+    Kết quả xếp theo độ liên quan, kèm đoạn highlight trong `match`.
+    """
+    conn = get_db_connection(readonly=True)
+    try:
+        try:
+            limit = int(request.args.get("limit", DEFAULT_SEARCH_LIMIT))
+        except ValueError:
+            return jsonify({"error": "limit must be an integer"}), 400
+        engine, results = search_accounts(
+            conn,
+            request.args.get("q", ""),
+            limit=limit,
+            group_id=request.args.get("group_id"),
+            platform=request.args.get("platform"),
+        )
+        return jsonify({"engine": engine, "results": results})
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+    finally:
+        conn.close()
+
+
+# --- IMPORT / EXPORT HÀNG LOẠT ---
+@mxh_api_bp.route("/import", methods=["POST"])
+def import_accounts():
+    """
+    POST /mxh/api/import?format=csv|jsonl
+    Body: file upload (field `file`) hoặc nội dung CSV/JSONL thô.
+    Upsert group/card/account theo chunk, trả về thống kê + lỗi từng dòng.
+    """
+    upload = request.files.get("file")
+    try:
+        fmt = detect_format(
+            request.args.get("format"),
+            upload.filename if upload else None,
+            request.content_type,
+        )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    stream = upload.stream if upload else request.stream
+    rows = iter_jsonl_rows(stream) if fmt == "jsonl" else iter_csv_rows(stream)
+
+    conn = get_db_connection()
+    try:
+        report = MXHImporter(conn).run(rows)
+        return jsonify(report)
+    except UnicodeDecodeError as e:
+        conn.rollback()
+        return jsonify({"error": f"File must be UTF-8 encoded: {e}"}), 400
     except Exception as e:
         conn.rollback()
         return jsonify({"error": str(e)}), 500
     finally:
-        conn.close()
\ No newline at end of file
+        conn.close()
+
+
+@mxh_api_bp.route("/export", methods=["GET"])
+def export_accounts():
+    """
+    GET /mxh/api/export?format=csv|jsonl&group_id=&platform=
+    Stream toàn bộ account kèm card/group (định dạng import được lại).
+    """
+    try:
+        fmt = detect_format(request.args.get("format") or "csv")
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    conn = get_db_connection(readonly=True)
+    cursor = export_rows(conn, request.args.get("group_id"), request.args.get("platform"))
+    body = stream_jsonl(cursor) if fmt == "jsonl" else stream_csv(cursor)
+    filename = f"mxh_export_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{fmt}"
+    return Response(
+        stream_with_context(body),
+        mimetype=EXPORT_FORMATS[fmt],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
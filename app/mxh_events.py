@@ -0,0 +1,132 @@
+"""
+MXH Change Broker
+Đẩy sự kiện thay đổi dữ liệu MXH tới các tab đang mở qua Server-Sent Events.
+"""
+import json
+import queue
+import threading
+import time
+
+from flask import request
+
+from app.database import get_db_connection, get_mxh_revision
+
+# Số client SSE tối đa được giữ kết nối cùng lúc (mỗi client chiếm 1 worker thread)
+MAX_SUBSCRIBERS = 20
+# Số sự kiện tồn tối đa cho mỗi client; client không đọc kịp sẽ bị ngắt
+SUBSCRIBER_QUEUE_SIZE = 100
+# Gửi heartbeat định kỳ để phát hiện tab đã đóng
+HEARTBEAT_SECONDS = 15
+
+
+class BrokerFull(Exception):
+    """Đã đạt số client SSE tối đa."""
+
+
+class ChangeBroker:
+    """Pub/sub trong tiến trình: mỗi subscriber là một queue có giới hạn."""
+
+    def __init__(self, max_subscribers=MAX_SUBSCRIBERS, queue_size=SUBSCRIBER_QUEUE_SIZE):
+        self.max_subscribers = max_subscribers
+        self.queue_size = queue_size
+        self._lock = threading.Lock()
+        self._subscribers = set()
+
+    def subscribe(self):
+        with self._lock:
+            if len(self._subscribers) >= self.max_subscribers:
+                raise BrokerFull()
+            subscription = queue.Queue(maxsize=self.queue_size)
+            self._subscribers.add(subscription)
+            return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    def is_subscribed(self, subscription):
+        with self._lock:
+            return subscription in self._subscribers
+
+    def subscriber_count(self):
+        with self._lock:
+            return len(self._subscribers)
+
+    def publish(self, event):
+        with self._lock:
+            for subscription in list(self._subscribers):
+                try:
+                    subscription.put_nowait(event)
+                except queue.Full:
+                    # Client treo / không đọc nữa -> bỏ, generator của nó sẽ tự thoát
+                    self._subscribers.discard(subscription)
+
+
+broker = ChangeBroker()
+
+# Các hàm xóa cache trong tiến trình, được gọi mỗi khi dữ liệu MXH thay đổi
+_change_callbacks = []
+
+
+def on_change(callback):
+    """Đăng ký callback (không tham số) chạy sau mỗi lần ghi MXH thành công."""
+    _change_callbacks.append(callback)
+    return callback
+
+
+def publish_change(action, ids=None, revision=None):
+    """Xóa các cache phụ thuộc và phát sự kiện thay đổi MXH cho mọi client đang lắng nghe."""
+    for callback in _change_callbacks:
+        callback()
+    broker.publish({
+        "action": action,
+        "ids": ids or {},
+        "revision": revision,
+        "ts": time.time(),
+    })
+
+
+MUTATION_METHODS = {"POST", "PUT", "PATCH", "DELETE"}
+
+
+def publish_after_mutation(response):
+    """
+    Hook after_request cho các blueprint MXH: mọi route ghi thành công
+    (scan, rescue, mark-die, reset, notice, quick-update, ...) đều phát sự kiện.
+    """
+    if request.method in MUTATION_METHODS and response.status_code < 400:
+        try:
+            revision = get_mxh_revision(get_db_connection(readonly=True))
+        except Exception:
+            revision = None
+        publish_change(request.endpoint, ids=request.view_args, revision=revision)
+    return response
+
+
+def format_sse(data, event=None):
+    """Đóng gói một sự kiện theo định dạng text/event-stream."""
+    message = ""
+    if event:
+        message += f"event: {event}\n"
+    message += f"data: {json.dumps(data)}\n\n"
+    return message
+
+
+def stream_events(subscription, hello=None):
+    """
+    Generator cho response SSE.
+    Luôn gỡ subscription khi client ngắt kết nối (GeneratorExit khi ghi heartbeat thất bại).
+    """
+    try:
+        yield "retry: 3000\n\n"
+        if hello is not None:
+            yield format_sse(hello, event="hello")
+        while broker.is_subscribed(subscription):
+            try:
+                event = subscription.get(timeout=HEARTBEAT_SECONDS)
+            except queue.Empty:
+                yield ": ping\n\n"
+                continue
+            yield format_sse(event, event="change")
+    finally:
+        broker.unsubscribe(subscription)
@@ -0,0 +1,172 @@
+"""
+Ngôn ngữ lọc / sắp xếp account MXH phía server.
+Biểu thức JSON được kiểm tra theo allow-list cột rồi biên dịch thành SQL có tham số.
+
+Ví dụ ?filter=
+    {"and": [
+        {"field": "platform", "op": "=", "value": "wechat"},
+        {"field": "status", "op": "=", "value": "die"},
+        {"field": "die_date", "op": "within_days", "value": 30},
+        {"or": [
+            {"field": "wechat_scan_count", "op": ">=", "value": 3},
+            {"field": "rescue_success_count", "op": "=", "value": 0}
+        ]}
+    ]}
+và ?sort=-die_date,card_name (dấu "-" là giảm dần).
+
+Toán tử: = != < <= > >= | in, not_in (list) | between ([thấp, cao]) | is_null (true/false)
+| contains, prefix (chuỗi) | within_days, older_than_days (số ngày, so với thời điểm hiện tại).
+Cột account dùng tên gốc; cột card dùng "card.<cột>" hoặc các alias card_name, platform, group_id.
+"""
+import json
+from datetime import datetime, timedelta, timezone
+
+from app.mxh_queries import QueryError, table_columns
+
+MAX_FILTER_DEPTH = 5
+MAX_FILTER_CONDITIONS = 50
+MAX_IN_VALUES = 500
+
+# Alias ngắn cho các cột card hay dùng
+CARD_ALIASES = ("card_name", "platform", "group_id")
+
+COMPARISON_OPS = {"=": "=", "!=": "!=", "<": "<", "<=": "<=", ">": ">", ">=": ">="}
+_SCALAR_TYPES = (str, int, float)
+
+
+class FilterError(QueryError):
+    """Biểu thức lọc / sắp xếp không hợp lệ (trả về 400)."""
+
+
+def filter_fields(conn):
+    """Allow-list {tên trong biểu thức: biểu thức SQL}."""
+    fields = {col: f"a.{col}" for col in table_columns(conn, "mxh_accounts")}
+    for col in table_columns(conn, "mxh_cards"):
+        fields[f"card.{col}"] = f"c.{col}"
+    for col in CARD_ALIASES:
+        fields[col] = f"c.{col}"
+    return fields
+
+
+def _scalar(value, field):
+    # bool là int trong Python -> đổi sang 0/1 như cách SQLite lưu
+    if isinstance(value, bool):
+        return int(value)
+    if not isinstance(value, _SCALAR_TYPES):
+        raise FilterError(f"Invalid value for {field}: expected string or number")
+    return value
+
+
+def _days_ago_iso(value, field):
+    """Mốc "value ngày trước" theo UTC (so với cột qua julianday(), xem _compile_condition)."""
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or value < 0:
+        raise FilterError(f"Invalid number of days for {field}")
+    return (datetime.now(timezone.utc) - timedelta(days=value)).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+
+
+def _like_pattern(value, field, prefix_only):
+    if not isinstance(value, str) or not value:
+        raise FilterError(f"Invalid text for {field}")
+    escaped = value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return (escaped if prefix_only else "%" + escaped) + "%"
+
+
+def _compile_condition(node, fields):
+    field = node.get("field")
+    op = node.get("op", "=")
+    if field not in fields:
+        raise FilterError(f"Unknown field: {field}")
+    expr = fields[field]
+    value = node.get("value")
+
+    if op in COMPARISON_OPS:
+        if value is None:
+            raise FilterError(f"Use is_null to compare {field} with null")
+        return f"{expr} {COMPARISON_OPS[op]} ?", [_scalar(value, field)]
+    if op in ("in", "not_in"):
+        if not isinstance(value, list) or not value:
+            raise FilterError(f"{op} on {field} needs a non-empty list")
+        if len(value) > MAX_IN_VALUES:
+            raise FilterError(f"Too many values for {field} (max {MAX_IN_VALUES})")
+        placeholders = ", ".join("?" * len(value))
+        keyword = "IN" if op == "in" else "NOT IN"
+        return f"{expr} {keyword} ({placeholders})", [_scalar(v, field) for v in value]
+    if op == "between":
+        if not isinstance(value, list) or len(value) != 2:
+            raise FilterError(f"between on {field} needs [low, high]")
+        return f"{expr} BETWEEN ? AND ?", [_scalar(v, field) for v in value]
+    if op == "is_null":
+        return (f"{expr} IS NULL" if value in (True, None) else f"{expr} IS NOT NULL"), []
+    if op in ("contains", "prefix"):
+        return f"{expr} LIKE ? ESCAPE '\\'", [_like_pattern(value, field, op == "prefix")]
+    # Timestamp lưu với offset khác nhau (naive, "Z", "+07:00") nên không so sánh chuỗi được;
+    # julianday() quy mọi giá trị về UTC (naive coi là UTC, chuỗi lỗi -> NULL, không khớp)
+    if op == "within_days":
+        return f"julianday({expr}) >= julianday(?)", [_days_ago_iso(value, field)]
+    if op == "older_than_days":
+        return f"julianday({expr}) < julianday(?)", [_days_ago_iso(value, field)]
+    raise FilterError(f"Unknown operator: {op}")
+
+
+def compile_filter(node, fields):
+    """Biểu thức lọc (dict) -> (SQL, params). Giới hạn độ sâu và số điều kiện."""
+    counter = [0]
+
+    def compile_node(node, depth):
+        if not isinstance(node, dict):
+            raise FilterError("Filter must be a JSON object")
+        if depth > MAX_FILTER_DEPTH:
+            raise FilterError(f"Filter is nested too deeply (max {MAX_FILTER_DEPTH})")
+        for keyword, joiner in (("and", " AND "), ("or", " OR ")):
+            if keyword in node:
+                children = node[keyword]
+                if not isinstance(children, list) or not children:
+                    raise FilterError(f"'{keyword}' needs a non-empty list")
+                parts, params = [], []
+                for child in children:
+                    sql, child_params = compile_node(child, depth + 1)
+                    parts.append(sql)
+                    params.extend(child_params)
+                return "(" + joiner.join(parts) + ")", params
+        if "not" in node:
+            sql, params = compile_node(node["not"], depth + 1)
+            return f"NOT {sql}", params
+        counter[0] += 1
+        if counter[0] > MAX_FILTER_CONDITIONS:
+            raise FilterError(f"Too many conditions (max {MAX_FILTER_CONDITIONS})")
+        sql, params = _compile_condition(node, fields)
+        return f"({sql})", params
+
+    return compile_node(node, 1)
+
+
+def parse_filter(raw, fields):
+    """Chuỗi JSON ?filter= -> (danh sách điều kiện WHERE, params)."""
+    if not raw:
+        return [], []
+    try:
+        node = json.loads(raw)
+    except ValueError:
+        raise FilterError("filter must be valid JSON")
+    sql, params = compile_filter(node, fields)
+    return [sql], params
+
+
+def parse_sort(raw, fields):
+    """?sort=-die_date,card_name -> ORDER BY (biểu thức, chiều), luôn kết thúc bằng a.id."""
+    order_by = []
+    for part in (raw or "").split(","):
+        part = part.strip()
+        if not part:
+            continue
+        direction = "DESC" if part.startswith("-") else "ASC"
+        name = part.lstrip("+-")
+        if name not in fields:
+            raise FilterError(f"Unknown sort field: {name}")
+        if any(expr == fields[name] for expr, _ in order_by):
+            continue
+        order_by.append((fields[name], direction))
+    # Khóa duy nhất cuối cùng để phân trang keyset ổn định
+    if not any(expr == "a.id" for expr, _ in order_by):
+        order_by.append(("a.id", "ASC"))
+    return tuple(order_by)
@@ -0,0 +1,389 @@
+"""
+Import / export hàng loạt card + account MXH (CSV hoặc JSONL).
+Cả hai chiều đều xử lý theo luồng: đọc/ghi từng dòng, ghi DB theo từng chunk
+executemany trong một transaction -> bộ nhớ không phụ thuộc số dòng.
+
+Mỗi dòng là một account kèm thông tin card/group của nó (đúng định dạng của export):
+    group_name, group_color, card_name, platform, id, <các cột mxh_accounts>...
+- group_name: nhóm được tạo nếu chưa có (trống -> card không thuộc nhóm nào).
+- (group, card_name): card được tạo nếu chưa có, platform được cập nhật nếu khác.
+- id: account đã tồn tại -> UPDATE các cột có trong dòng; không có / không tồn tại -> INSERT.
+Các cột khác (group_id, card_id, created_at, updated_at, khóa sắp xếp) bị bỏ qua khi import.
+"""
+import csv
+import io
+import json
+import sqlite3
+from datetime import datetime, timezone
+
+from flask import current_app
+
+from app.mxh_queries import STREAM_CHUNK_SIZE, public_columns, table_columns
+
+# Số dòng mỗi transaction khi import
+IMPORT_CHUNK_SIZE = 1000
+# Chỉ giữ tối đa chừng này lỗi chi tiết trong báo cáo (vẫn đếm đủ)
+MAX_REPORTED_ERRORS = 1000
+
+DEFAULT_GROUP_COLOR = "#6c757d"
+# Cột không cho import ghi đè (cột nội bộ do trigger duy trì đã bị table_columns loại sẵn)
+SKIPPED_ACCOUNT_COLUMNS = {"id", "card_id", "created_at", "updated_at"}
+# Giá trị mặc định khi tạo account mới (giống POST /cards/<id>/accounts)
+ACCOUNT_DEFAULTS = {
+    "is_primary": 0,
+    "account_name": "Sub Account",
+    "username": "...",
+    "phone": "...",
+    "url": "",
+    "wechat_status": "available",
+    "status": "active",
+    "wechat_scan_count": 0,
+    "rescue_count": 0,
+    "rescue_success_count": 0,
+}
+
+EXPORT_FORMATS = {
+    "csv": "text/csv",
+    "jsonl": "application/x-ndjson",
+}
+
+
+class ImportRowError(ValueError):
+    """Dòng import không hợp lệ (báo lỗi cho riêng dòng đó)."""
+
+
+def detect_format(fmt=None, filename=None, content_type=None):
+    """?format= > đuôi file > Content-Type; mặc định csv."""
+    if fmt:
+        fmt = fmt.lower()
+        if fmt in ("ndjson", "json"):
+            fmt = "jsonl"
+        if fmt not in EXPORT_FORMATS:
+            raise ValueError(f"Unsupported format: {fmt}")
+        return fmt
+    name = (filename or "").lower()
+    if name.endswith((".jsonl", ".ndjson")):
+        return "jsonl"
+    if name.endswith(".csv"):
+        return "csv"
+    if "ndjson" in (content_type or "") or "jsonl" in (content_type or ""):
+        return "jsonl"
+    return "csv"
+
+
+def _now_iso():
+    return datetime.now(timezone.utc).astimezone().isoformat()
+
+
+def _clean(value):
+    """CSV không phân biệt rỗng / NULL -> chuỗi rỗng (sau strip) coi là NULL."""
+    if isinstance(value, str):
+        value = value.strip()
+        return value or None
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, ensure_ascii=False)
+    return value
+
+
+# --- ĐỌC FILE ---
+def iter_csv_rows(binary_stream):
+    """(số dòng, dict) cho từng dòng CSV. Chấp nhận BOM của Excel."""
+    text = io.TextIOWrapper(binary_stream, encoding="utf-8-sig", newline="")
+    reader = csv.DictReader(text)
+    for row in reader:
+        # reader.line_num là dòng vật lý cuối của record (tính cả header)
+        yield reader.line_num, {k.strip(): v for k, v in row.items() if k}
+
+
+def iter_jsonl_rows(binary_stream):
+    """(số dòng, dict hoặc ImportRowError) cho từng dòng JSONL, bỏ qua dòng trống."""
+    text = io.TextIOWrapper(binary_stream, encoding="utf-8-sig")
+    loads = current_app.json.loads
+    for line_no, line in enumerate(text, start=1):
+        if not line.strip():
+            continue
+        try:
+            row = loads(line)
+        except ValueError as e:
+            yield line_no, ImportRowError(f"Invalid JSON: {e}")
+            continue
+        if not isinstance(row, dict):
+            yield line_no, ImportRowError("Each line must be a JSON object")
+            continue
+        yield line_no, row
+
+
+# --- IMPORT ---
+class MXHImporter:
+    """
+    Upsert group -> card -> account theo từng chunk.
+    Group được cache suốt lần import (số lượng nhỏ); card được tra lại theo từng chunk
+    bằng một truy vấn json_each nên bộ nhớ không tăng theo kích thước file.
+    """
+
+    def __init__(self, conn, chunk_size=IMPORT_CHUNK_SIZE):
+        self.conn = conn
+        self.chunk_size = chunk_size
+        self.account_columns = [
+            col for col in table_columns(conn, "mxh_accounts") if col not in SKIPPED_ACCOUNT_COLUMNS
+        ]
+        self._groups = {}
+        self._pending = {}
+        self.stats = {
+            "rows": 0, "inserted": 0, "updated": 0, "failed": 0,
+            "groups_created": 0, "cards_created": 0,
+        }
+        self.errors = []
+
+    def run(self, rows):
+        """rows: iterable (số dòng, dict | ImportRowError)."""
+        chunk = []
+        for line_no, row in rows:
+            self.stats["rows"] += 1
+            if isinstance(row, Exception):
+                self._error(line_no, row)
+                continue
+            try:
+                chunk.append((line_no, self._normalize(row)))
+            except ImportRowError as e:
+                self._error(line_no, e)
+                continue
+            if len(chunk) >= self.chunk_size:
+                self._flush(chunk)
+                chunk = []
+        if chunk:
+            self._flush(chunk)
+        return self.report()
+
+    def report(self):
+        return dict(self.stats, errors=self.errors)
+
+    def _error(self, line_no, error):
+        self.stats["failed"] += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({"line": line_no, "error": str(error)})
+
+    def _normalize(self, row):
+        card_name = _clean(row.get("card_name"))
+        if card_name is None:
+            raise ImportRowError("card_name is required")
+        account_id = _clean(row.get("id"))
+        if account_id is not None:
+            try:
+                account_id = int(account_id)
+            except (TypeError, ValueError):
+                raise ImportRowError(f"Invalid id: {account_id}")
+        values = {col: _clean(row[col]) for col in self.account_columns if col in row}
+        return {
+            "group_name": _clean(row.get("group_name")),
+            "group_color": _clean(row.get("group_color")),
+            "card_name": str(card_name),
+            "platform": _clean(row.get("platform")),
+            "id": account_id,
+            "values": values,
+        }
+
+    def _flush(self, chunk):
+        """Ghi một chunk trong một transaction; chunk lỗi thì chạy lại từng dòng để khoanh vùng."""
+        try:
+            self._write(chunk)
+            return
+        except (sqlite3.Error, ImportRowError) as e:
+            self.conn.rollback()
+            self._groups.clear()
+            if len(chunk) == 1:
+                self._error(chunk[0][0], e)
+                return
+        for line_no, row in chunk:
+            try:
+                self._write([(line_no, row)])
+            except (sqlite3.Error, ImportRowError) as e:
+                self.conn.rollback()
+                self._groups.clear()
+                self._error(line_no, e)
+
+    def _write(self, chunk):
+        conn = self.conn
+        now = _now_iso()
+        self._pending = {"groups_created": 0, "cards_created": 0}
+        conn.execute("BEGIN IMMEDIATE")
+        group_ids = self._resolve_groups(chunk, now)
+        card_ids = self._resolve_cards(chunk, group_ids, now)
+
+        existing = set()
+        ids = [row["id"] for _, row in chunk if row["id"] is not None]
+        if ids:
+            existing = {
+                r[0] for r in conn.execute(
+                    "SELECT id FROM mxh_accounts WHERE id IN (SELECT value FROM json_each(?))",
+                    (json.dumps(ids),),
+                )
+            }
+
+        inserts = []
+        updates = {}
+        for _, row in chunk:
+            card_id = card_ids[(group_ids.get(row["group_name"]), row["card_name"])]
+            values = row["values"]
+            if row["id"] in existing:
+                cols = tuple(values)
+                updates.setdefault(cols, []).append(
+                    tuple(values[c] for c in cols) + (card_id, now, row["id"])
+                )
+            else:
+                inserts.append(
+                    (card_id,)
+                    + tuple(
+                        values[c] if values.get(c) is not None else ACCOUNT_DEFAULTS.get(c)
+                        for c in self.account_columns
+                    )
+                    + (now, now)
+                )
+
+        if inserts:
+            cols = ["card_id"] + self.account_columns + ["created_at", "updated_at"]
+            conn.executemany(
+                f"INSERT INTO mxh_accounts ({', '.join(cols)}) VALUES ({', '.join('?' * len(cols))})",
+                inserts,
+            )
+        # Mỗi tổ hợp cột (JSONL có thể khác nhau giữa các dòng) là một câu UPDATE riêng
+        for cols, params in updates.items():
+            assignments = ", ".join(f"{c} = ?" for c in cols + ("card_id", "updated_at"))
+            conn.executemany(f"UPDATE mxh_accounts SET {assignments} WHERE id = ?", params)
+        conn.commit()
+
+        # Chỉ cộng thống kê khi chunk đã commit
+        for key, count in self._pending.items():
+            self.stats[key] += count
+        self.stats["inserted"] += len(inserts)
+        self.stats["updated"] += sum(len(p) for p in updates.values())
+
+    def _resolve_groups(self, chunk, now):
+        """group_name -> id, tạo nhóm còn thiếu (INSERT OR IGNORE theo UNIQUE(name))."""
+        missing = {}
+        for _, row in chunk:
+            name = row["group_name"]
+            if name is not None and name not in self._groups:
+                missing.setdefault(name, row["group_color"] or DEFAULT_GROUP_COLOR)
+        if missing:
+            cursor = self.conn.executemany(
+                "INSERT OR IGNORE INTO mxh_groups (name, color, created_at) VALUES (?, ?, ?)",
+                [(name, color, now) for name, color in missing.items()],
+            )
+            self._pending["groups_created"] += max(cursor.rowcount, 0)
+            for r in self.conn.execute(
+                "SELECT id, name FROM mxh_groups WHERE name IN (SELECT value FROM json_each(?))",
+                (json.dumps(list(missing)),),
+            ):
+                self._groups[r["name"]] = r["id"]
+        return self._groups
+
+    def _lookup_cards(self, keys):
+        if not keys:
+            return {}
+        rows = self.conn.execute(
+            """
+            SELECT MIN(c.id) AS id, c.group_id, c.card_name
+            FROM json_each(?) k
+            JOIN mxh_cards c
+              ON c.card_name = json_extract(k.value, '$[1]')
+             AND c.group_id IS json_extract(k.value, '$[0]')
+            GROUP BY c.group_id, c.card_name
+            """,
+            (json.dumps([list(key) for key in keys]),),
+        )
+        return {(r["group_id"], r["card_name"]): r["id"] for r in rows}
+
+    def _resolve_cards(self, chunk, group_ids, now):
+        """(group_id, card_name) -> card id; tạo card mới, cập nhật platform nếu đổi."""
+        platforms = {}
+        for _, row in chunk:
+            key = (group_ids.get(row["group_name"]), row["card_name"])
+            if row["platform"] is not None or key not in platforms:
+                platforms[key] = row["platform"]
+
+        cards = self._lookup_cards(list(platforms))
+        new_cards = [key for key in platforms if key not in cards]
+        if new_cards:
+            without_platform = [key for key in new_cards if platforms[key] is None]
+            if without_platform:
+                raise ImportRowError(f"platform is required for new card '{without_platform[0][1]}'")
+            self.conn.executemany(
+                "INSERT INTO mxh_cards (card_name, group_id, platform, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                [(name, group_id, platforms[(group_id, name)], now, now) for group_id, name in new_cards],
+            )
+            self._pending["cards_created"] += len(new_cards)
+            cards.update(self._lookup_cards(new_cards))
+
+        changed = [
+            (platform, now, cards[key], platform) for key, platform in platforms.items()
+            if platform is not None and key not in new_cards
+        ]
+        if changed:
+            self.conn.executemany(
+                "UPDATE mxh_cards SET platform = ?, updated_at = ? WHERE id = ? AND platform IS NOT ?",
+                changed,
+            )
+        return cards
+
+
+# --- EXPORT ---
+EXPORT_SQL = """
+    SELECT c.group_id, g.name AS group_name, g.color AS group_color,
+           c.card_name, c.platform, {account_columns}
+    FROM mxh_accounts a
+    JOIN mxh_cards c ON a.card_id = c.id
+    LEFT JOIN mxh_groups g ON c.group_id = g.id
+"""
+EXPORT_ORDER = " ORDER BY c.id ASC, a.is_primary DESC, a.id ASC"
+
+
+def export_rows(conn, group_id=None, platform=None):
+    """Cursor (stream) các dòng export đã join, có thể lọc theo group_id / platform."""
+    where, params = [], []
+    if group_id:
+        where.append("c.group_id = ?")
+        params.append(group_id)
+    if platform:
+        where.append("c.platform = ?")
+        params.append(platform)
+    sql = EXPORT_SQL.format(account_columns=", ".join(public_columns(conn, "mxh_accounts", "a")))
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    return conn.execute(sql + EXPORT_ORDER, params)
+
+
+def _chunked(parts):
+    """Gom các mảnh nhỏ thành chunk ~STREAM_CHUNK_SIZE trước khi ghi ra socket."""
+    buffer, size = [], 0
+    for part in parts:
+        buffer.append(part)
+        size += len(part)
+        if size >= STREAM_CHUNK_SIZE:
+            yield "".join(buffer)
+            buffer, size = [], 0
+    if buffer:
+        yield "".join(buffer)
+
+
+def stream_csv(cursor):
+    columns = [d[0] for d in cursor.description]
+    out = io.StringIO()
+    writer = csv.writer(out)
+
+    def lines():
+        writer.writerow(columns)
+        for row in cursor:
+            writer.writerow(row)
+            yield out.getvalue()
+            out.seek(0)
+            out.truncate()
+        yield out.getvalue()
+
+    return _chunked(lines())
+
+
+def stream_jsonl(cursor):
+    dumps = current_app.json.dumps
+    return _chunked(dumps(dict(row), separators=(",", ":")) + "\n" for row in cursor)
@@ -0,0 +1,308 @@
+"""
+Truy vấn & serialize dùng chung cho các API danh sách MXH.
+Các danh sách lớn được stream thẳng từ cursor ra response, không dựng list trong bộ nhớ.
+"""
+import base64
+import json
+from urllib.parse import urlencode
+
+from flask import Response, current_app, request, stream_with_context
+
+# Gom nhiều phần tử JSON thành một chunk khoảng 64KB trước khi ghi ra socket
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# Phân trang keyset: ?after=<cursor>&limit=
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+# --- ORDER BY của từng danh sách: (biểu thức, chiều). Cột cuối luôn là khóa duy nhất. ---
+# card_group_id / card_sort_key / sort_key do trigger duy trì (= group_id, CAST(card_name AS INTEGER))
+FLAT_ACCOUNTS_ORDER = (
+    ("a.is_primary", "DESC"),
+    ("a.card_group_id", "ASC"),
+    ("a.card_sort_key", "ASC"),
+    ("a.id", "ASC"),
+)
+RECENT_ACCOUNTS_ORDER = (
+    ("a.updated_at", "DESC"),
+    ("a.id", "DESC"),
+)
+CARDS_NUMERIC_ORDER = (
+    ("c.sort_key", "ASC"),
+    ("c.id", "ASC"),
+)
+CARDS_NAME_ORDER = (
+    ("c.card_name", "ASC"),
+    ("c.id", "ASC"),
+)
+
+
+# Cột chỉ phục vụ index / sắp xếp, do trigger duy trì: không trả ra API, không nhận qua ?fields= / filter
+INTERNAL_COLUMNS = {
+    "mxh_accounts": ("card_group_id", "card_sort_key"),
+    "mxh_account_view": ("card_group_id", "card_sort_key"),
+    "mxh_cards": ("sort_key",),
+}
+
+
+class QueryError(ValueError):
+    """Tham số truy vấn không hợp lệ (trả về 400)."""
+
+
+def table_columns(conn, table):
+    """Danh sách cột public của bảng (allow-list cho ?fields=), bỏ INTERNAL_COLUMNS."""
+    internal = INTERNAL_COLUMNS.get(table, ())
+    return [row[1] for row in conn.execute(f"PRAGMA table_info({table})") if row[1] not in internal]
+
+
+def public_columns(conn, table, alias):
+    """Thay cho `alias.*`: biểu thức SELECT cho mọi cột public của bảng."""
+    return [f"{alias}.{col}" for col in table_columns(conn, table)]
+
+
+def _parse_fields(conn, extra_fields, alias, table="mxh_accounts"):
+    raw = request.args.get("fields")
+    if not raw:
+        return None, None
+
+    allowed = {col: f"{alias}.{col}" for col in table_columns(conn, table)}
+    allowed.update(extra_fields or {})
+    names = list(dict.fromkeys(f.strip() for f in raw.split(",") if f.strip()))
+    unknown = [name for name in names if name not in allowed]
+    if unknown:
+        raise QueryError(f"Unknown field(s): {', '.join(unknown)}")
+    if "id" not in names:
+        names.insert(0, "id")
+    return names, allowed
+
+
+def parse_fields(conn, extra_fields=None, alias="a", table="mxh_accounts"):
+    """
+    ?fields=id,username,status -> danh sách biểu thức SELECT trên `table` (mặc định mxh_accounts).
+    Trả về None nếu không chỉ định (giữ nguyên cột mặc định của endpoint).
+    extra_fields: {tên: biểu thức SQL} cho các cột join thêm (card_name, platform, ...).
+    """
+    names, allowed = _parse_fields(conn, extra_fields, alias, table)
+    if names is None:
+        return None
+    return [f"{allowed[name]} AS {name}" for name in names]
+
+
+def parse_field_names(conn):
+    """?fields= -> danh sách tên cột mxh_accounts (None nếu không chỉ định)."""
+    return _parse_fields(conn, None, "a")[0]
+
+
+def encode_cursor(values):
+    raw = json.dumps(list(values), separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor, size):
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+    except (ValueError, UnicodeError):
+        raise QueryError("Invalid cursor")
+    if not isinstance(values, list) or len(values) != size:
+        raise QueryError("Invalid cursor")
+    return values
+
+
+def parse_page(order_by):
+    """?limit=&after= -> (limit, giá trị khóa sau cùng) hoặc None nếu không phân trang."""
+    limit = request.args.get("limit")
+    after = request.args.get("after")
+    if limit is None and after is None:
+        return None
+    try:
+        limit = int(limit) if limit is not None else DEFAULT_PAGE_SIZE
+    except ValueError:
+        raise QueryError("limit must be an integer")
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    return limit, (decode_cursor(after, len(order_by)) if after else None)
+
+
+def order_by_sql(order_by):
+    return ", ".join(f"{expr} {direction}" for expr, direction in order_by)
+
+
+def _after_value(expr, direction, value):
+    # SQLite xếp NULL nhỏ nhất
+    if direction == "ASC":
+        if value is None:
+            return f"{expr} IS NOT NULL", []
+        return f"{expr} > ?", [value]
+    if value is None:
+        return None, []
+    return f"({expr} < ? OR {expr} IS NULL)", [value]
+
+
+def keyset_where(order_by, values):
+    """Điều kiện "đứng sau hàng có khóa `values`" theo đúng ORDER BY (hỗ trợ trộn ASC/DESC)."""
+    clauses, params = [], []
+    for i, ((expr, direction), value) in enumerate(zip(order_by, values)):
+        after_sql, after_params = _after_value(expr, direction, value)
+        if after_sql is None:
+            continue
+        parts = [f"{prev_expr} IS ?" for prev_expr, _ in order_by[:i]]
+        clauses.append("(" + " AND ".join(parts + [after_sql]) + ")")
+        params.extend(values[:i])
+        params.extend(after_params)
+    if not clauses:
+        return "0", []
+    return "(" + " OR ".join(clauses) + ")", params
+
+
+def build_select(columns, from_sql, where, params, order_by, page=None):
+    """Dựng câu SELECT danh sách (dùng chung cho select_rows và EXPLAIN QUERY PLAN)."""
+    where = list(where)
+    params = list(params)
+    if page is None:
+        sql = f"SELECT {', '.join(columns)} {from_sql}"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY " + order_by_sql(order_by)
+        return sql, params
+
+    limit, after = page
+    if after is not None:
+        after_sql, after_params = keyset_where(order_by, after)
+        where.append(after_sql)
+        params.extend(after_params)
+    key_columns = [f"{expr} AS _k{i}" for i, (expr, _) in enumerate(order_by)]
+    sql = f"SELECT {', '.join(list(columns) + key_columns)} {from_sql}"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += " ORDER BY " + order_by_sql(order_by) + " LIMIT ?"
+    # Lấy limit+1 hàng để biết còn trang sau hay không
+    return sql, params + [limit + 1]
+
+
+def select_rows(conn, columns, from_sql, where, params, order_by, page=None):
+    """
+    Chạy SELECT danh sách. Trả về (iterable các dict, cursor trang sau hoặc None).
+    - Không phân trang: stream thẳng từ cursor SQLite.
+    - Có phân trang: lấy limit+1 hàng để biết còn trang sau hay không.
+    """
+    sql, params = build_select(columns, from_sql, where, params, order_by, page)
+    if page is None:
+        return (dict(row) for row in conn.execute(sql, params)), None
+
+    limit = page[0]
+    rows = conn.execute(sql, params).fetchall()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_cursor(last[f"_k{i}"] for i in range(len(order_by)))
+
+    items = []
+    for row in rows:
+        item = dict(row)
+        for i in range(len(order_by)):
+            item.pop(f"_k{i}", None)
+        items.append(item)
+    return items, next_cursor
+
+
+def set_next_cursor(response, next_cursor):
+    """Trang sau được báo qua header để body vẫn là mảng JSON như cũ."""
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+        args = request.args.to_dict()
+        args["after"] = next_cursor
+        response.headers["Link"] = f'<{request.path}?{urlencode(args)}>; rel="next"'
+    return response
+
+
+# --- KIỂM TRA QUERY PLAN LÚC KHỞI ĐỘNG ---
+# Danh sách account đọc từ read model mxh_account_view (database._create_mxh_account_view)
+ACCOUNTS_FROM = "FROM mxh_account_view a"
+LIST_QUERY_PLANS = (
+    ("accounts flat", ACCOUNTS_FROM, [], FLAT_ACCOUNTS_ORDER),
+    ("accounts delta", ACCOUNTS_FROM, ["a.updated_at > ?"], RECENT_ACCOUNTS_ORDER),
+    ("accounts recent", ACCOUNTS_FROM, [], RECENT_ACCOUNTS_ORDER),
+    ("accounts with group", ACCOUNTS_FROM, ["a.group_name IS NOT NULL"], RECENT_ACCOUNTS_ORDER),
+    ("cards numeric", "FROM mxh_cards c", [], CARDS_NUMERIC_ORDER),
+    ("cards by name", "FROM mxh_cards c", [], CARDS_NAME_ORDER),
+    ("cards by group", "FROM mxh_cards c", ["c.group_id = ?"], CARDS_NAME_ORDER),
+)
+
+
+def check_list_query_plans(conn):
+    """
+    EXPLAIN QUERY PLAN các danh sách chính; cảnh báo nếu SQLite phải sắp xếp tạm
+    (USE TEMP B-TREE) tức là không đi theo index. Trả về danh sách tên query bị cảnh báo.
+    """
+    warnings = []
+    for name, from_sql, where, order_by in LIST_QUERY_PLANS:
+        params = [None] * sum(clause.count("?") for clause in where)
+        sql, params = build_select(["*"], from_sql, where, params, order_by, (DEFAULT_PAGE_SIZE, None))
+        plan = [row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params)]
+        if any("USE TEMP B-TREE" in detail for detail in plan):
+            warnings.append(name)
+            print(f"WARNING: MXH list query '{name}' is not served by an index: {' | '.join(plan)}")
+    return warnings
+
+
+def stream_json_array(items):
+    """Generator render mảng JSON từng phần tử một (cùng định dạng với jsonify)."""
+    dumps = current_app.json.dumps
+    buffer = ["["]
+    size = 1
+    first = True
+    for item in items:
+        part = dumps(item, separators=(",", ":"))
+        if not first:
+            part = "," + part
+        first = False
+        buffer.append(part)
+        size += len(part)
+        if size >= STREAM_CHUNK_SIZE:
+            yield "".join(buffer)
+            buffer = []
+            size = 0
+    buffer.append("]")
+    yield "".join(buffer)
+
+
+def json_array_response(items):
+    """
+    Response stream cho một iterable (thường là cursor SQLite).
+    Giữ request context (và kết nối DB gắn với request) sống tới khi stream xong.
+    """
+    return Response(
+        stream_with_context(stream_json_array(items)),
+        mimetype=current_app.json.mimetype,
+    )
+
+
+# --- CARD -> SUB_ACCOUNTS ---
+def sub_accounts_column(conn, field_names=None, card_alias="c"):
+    """
+    Biểu thức SELECT gom toàn bộ account của card thành một mảng JSON (cột `sub_accounts`).
+    SQLite tra idx_acc_card cho từng card ngay trong cùng truy vấn, đúng thứ tự
+    is_primary DESC, id ASC -> một lượt duyệt, chi phí tuyến tính, không có IN (?,?,...).
+    """
+    names = field_names or table_columns(conn, "mxh_accounts")
+    pairs = ", ".join(f"'{name}', a.{name}" for name in names)
+    # Subquery có ORDER BY không bị flatten vào aggregate nên thứ tự được giữ nguyên
+    return f"""(
+        SELECT json_group_array(json(sub.account)) FROM (
+            SELECT json_object({pairs}) AS account
+            FROM mxh_accounts a
+            WHERE a.card_id = {card_alias}.id
+            ORDER BY a.is_primary DESC, a.id ASC
+        ) sub
+    ) AS sub_accounts"""
+
+
+def hydrate_cards(cards):
+    """Giải mã cột sub_accounts (JSON) thành list lồng trong từng card."""
+    loads = current_app.json.loads
+    for card in cards:
+        card = dict(card)
+        card["sub_accounts"] = loads(card["sub_accounts"]) if card.get("sub_accounts") else []
+        yield card
@@ -2,9 +2,43 @@ import sqlite3
 import json
 from datetime import datetime, timezone
 from flask import Blueprint, request, jsonify, render_template
-from app.database import get_db_connection
+from app.database import (
+    WriteTimeout,
+    execute_returning,
+    get_db_connection,
+    get_mxh_revision,
+    record_account_events,
+    run_write,
+    run_write_sql,
+)
+from app.http_cache import conditional_get
+from app.mxh_events import publish_after_mutation
+from app.mxh_writes import (
+    ACCOUNT_UPDATE_FIELDS,
+    DuplicateCardName,
+    create_account_job,
+    create_card_job,
+    smart_delete_job,
+    update_account_job,
+)
+from app.mxh_queries import (
+    ACCOUNTS_FROM,
+    CARDS_NUMERIC_ORDER,
+    FLAT_ACCOUNTS_ORDER,
+    QueryError,
+    hydrate_cards,
+    json_array_response,
+    parse_field_names,
+    parse_fields,
+    parse_page,
+    public_columns,
+    select_rows,
+    set_next_cursor,
+    sub_accounts_column,
+)
 
 mxh_bp = Blueprint("mxh", __name__, url_prefix="/mxh")
+mxh_bp.after_request(publish_after_mutation)
 
 
 # --- ALIAS: giữ tương thích FE cũ - tạo/xóa CARD qua /api/accounts ---
@@ -15,7 +49,6 @@ def alias_create_card_from_accounts():
     FE cũ: POST /mxh/api/accounts
     Expect: tạo CARD + tạo luôn 1 ACCOUNT primary thuộc card đó.
     """
-    conn = get_db_connection()
     try:
         data = request.get_json(silent=True) or request.form.to_dict() or {}
         card_name = (data.get("card_name") or data.get("name") or "").strip()
@@ -26,31 +59,22 @@ def alias_create_card_from_accounts():
 
         now = datetime.now(timezone.utc).astimezone().isoformat()
 
-        # 1) Tạo CARD
-        cur = conn.execute("""
-            INSERT INTO mxh_cards (card_name, group_id, platform, created_at, updated_at)
-            VALUES (?,?,?,?,?)
-        """, (card_name, group_id, platform, now, now))
-        card_id = cur.lastrowid
-
-        # 2) Tạo ACCOUNT primary (map đúng cột DB)
+        # ACCOUNT primary (map đúng cột DB); card_id / is_primary / created_at do job điền
         acc_cols = (
-            "card_id","is_primary","account_name","username","phone","url",
-            "login_username","login_password","created_at","updated_at",
+            "account_name","username","phone","url",
+            "login_username","login_password",
             "wechat_created_day","wechat_created_month","wechat_created_year",
             "wechat_status","status","muted_until","die_date",
             "wechat_scan_count","wechat_last_scan_date",
             "rescue_count","rescue_success_count","email_reset_date","notice"
         )
         acc_vals = (
-            card_id, 1,
             data.get("account_name") or "Tài khoản chính",
             data.get("username") or ".",
             data.get("phone") or ".",
             data.get("url") or ".",
             data.get("login_username") or ".",
             data.get("login_password") or ".",
-            now, now,
             data.get("wechat_created_day"),
             data.get("wechat_created_month"),
             data.get("wechat_created_year"),
@@ -63,21 +87,16 @@ def alias_create_card_from_accounts():
             data.get("email_reset_date"),
             json.dumps(data.get("notice")) if isinstance(data.get("notice"), dict) else data.get("notice")
         )
-        q = f"INSERT INTO mxh_accounts ({','.join(acc_cols)}) VALUES ({','.join(['?']*len(acc_cols))})"
-        cur2 = conn.execute(q, acc_vals)
-        account_id = cur2.lastrowid
-
-        conn.commit()
-
-        new_card = conn.execute("SELECT * FROM mxh_cards WHERE id=?", (card_id,)).fetchone()
-        new_acc  = conn.execute("SELECT * FROM mxh_accounts WHERE id=?", (account_id,)).fetchone()
-        return jsonify({"card": dict(new_card), "account": dict(new_acc)}), 201
+        new_card, new_acc = run_write(
+            create_card_job, card_name, group_id, platform, now, dict(zip(acc_cols, acc_vals))
+        )
+        return jsonify({"card": new_card, "account": new_acc}), 201
+    except DuplicateCardName as e:
+        return jsonify({"error": str(e), "field": "card_name"}), 400
+    except WriteTimeout as e:
+        return jsonify({"error": str(e)}), 503
     except Exception as e:
-        try: conn.rollback()
-        except Exception: pass
         return jsonify({"error": str(e)}), 500
-    finally:
-        conn.close()
 
 
 @mxh_bp.route("/api/accounts/<int:any_id>", methods=["DELETE"])
@@ -87,31 +106,18 @@ def smart_delete_account_or_card(any_id: int):
     - Nếu <id> là account.id -> xóa ACCOUNT
     - Nếu <id> là mxh_cards.id -> xóa CARD + toàn bộ accounts con
     """
-    conn = get_db_connection()
     try:
-        conn.execute("BEGIN")
-
-        acc = conn.execute("SELECT id FROM mxh_accounts WHERE id=?", (any_id,)).fetchone()
-        if acc:
-            conn.execute("DELETE FROM mxh_accounts WHERE id=?", (any_id,))
-            conn.commit()
-            return jsonify({"message": "Account deleted", "account_id": any_id})
-
-        card = conn.execute("SELECT id FROM mxh_cards WHERE id=?", (any_id,)).fetchone()
-        if card:
-            conn.execute("DELETE FROM mxh_accounts WHERE card_id=?", (any_id,))
-            conn.execute("DELETE FROM mxh_cards WHERE id=?", (any_id,))
-            conn.commit()
-            return jsonify({"message": "Card and its accounts deleted", "card_id": any_id})
-
-        conn.rollback()
-        return jsonify({"error": "Not found"}), 404
+        deleted = run_write(smart_delete_job, any_id)
+    except WriteTimeout as e:
+        return jsonify({"error": str(e)}), 503
     except Exception as e:
-        try: conn.rollback()
-        except Exception: pass
         return jsonify({"error": str(e)}), 500
-    finally:
-        conn.close()
+
+    if deleted == "account":
+        return jsonify({"message": "Account deleted", "account_id": any_id})
+    if deleted == "card":
+        return jsonify({"message": "Card and its accounts deleted", "card_id": any_id})
+    return jsonify({"error": "Not found"}), 404
 
 
 @mxh_bp.route("")
@@ -120,8 +126,9 @@ def mxh_page():
 
 
 @mxh_bp.route("/api/groups", methods=["GET", "POST"])
+@conditional_get("mxh")
 def mxh_groups():
-    conn = get_db_connection()
+    conn = get_db_connection(readonly=True)
     try:
         if request.method == "GET":
             groups = conn.execute(
@@ -147,15 +154,14 @@ def mxh_groups():
             }
             icon = platform_icons.get(name.lower(), "bi-share-fill")
             try:
-                cursor = conn.execute(
+                group_id, _ = run_write_sql(
                     "INSERT INTO mxh_groups (name, color, icon, created_at) VALUES (?, ?, ?, ?)",
                     (name, color, icon, datetime.now().isoformat()),
                 )
-                conn.commit()
                 return (
                     jsonify(
                         {
-                            "id": cursor.lastrowid,
+                            "id": group_id,
                             "name": name,
                             "color": color,
                             "icon": icon,
@@ -166,6 +172,8 @@ def mxh_groups():
                 )
             except sqlite3.IntegrityError:
                 return jsonify({"error": f'Group "{name}" already exists.'}), 400
+    except WriteTimeout as e:
+        return jsonify({"error": str(e)}), 503
     except Exception as e:
         return jsonify({"error": str(e)}), 500
     finally:
@@ -173,28 +181,33 @@ def mxh_groups():
 
 
 @mxh_bp.route("/api/accounts", methods=["GET"])
+@conditional_get("mxh")
 def list_accounts_flat():
-    """GET /mxh/api/accounts - trả danh sách account phẳng (join từ mxh_accounts + mxh_cards)"""
-    conn = get_db_connection()
+    """GET /mxh/api/accounts - trả danh sách account phẳng (đọc từ read model mxh_account_view)"""
+    conn = get_db_connection(readonly=True)
     try:
         last = request.args.get("last_updated_at")
-        base_sql = """
-            SELECT
-                a.*,
-                c.card_name,
-                c.group_id,
-                c.platform
-            FROM mxh_accounts a
-            JOIN mxh_cards   c ON a.card_id = c.id
-        """
-        args = []
+        # ?fields= chọn cột, ?limit=&after= phân trang keyset theo đúng ORDER BY
+        columns = parse_fields(conn, table="mxh_account_view") or public_columns(conn, "mxh_account_view", "a")
+        page = parse_page(FLAT_ACCOUNTS_ORDER)
+
+        revision = get_mxh_revision(conn)
+        where, args = [], []
         if last:
-            base_sql += " WHERE a.updated_at > ?"
+            where.append("a.updated_at > ?")
             args.append(last)
-        base_sql += " ORDER BY a.is_primary DESC, c.group_id ASC, CAST(c.card_name AS INTEGER) ASC, a.id ASC"
 
-        rows = conn.execute(base_sql, args).fetchall()
-        return jsonify([dict(r) for r in rows])
+        rows, next_cursor = select_rows(
+            conn, columns,
+            ACCOUNTS_FROM,
+            where, args, FLAT_ACCOUNTS_ORDER, page,
+        )
+        response = json_array_response(rows)
+        # Client dùng revision này cho /mxh/api/changes?since=
+        response.headers["X-MXH-Revision"] = str(revision)
+        return set_next_cursor(response, next_cursor)
+    except QueryError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         return jsonify({"error": str(e)}), 500
     finally:
@@ -202,66 +215,53 @@ def list_accounts_flat():
 
 
 @mxh_bp.route("/api/cards", methods=["GET", "POST"])
+@conditional_get("mxh")
 def mxh_cards_and_sub_accounts():
     """GET/POST /mxh/api/cards - quản lý cards và sub_accounts"""
-    conn = get_db_connection()
+    conn = get_db_connection(readonly=True)
     try:
         if request.method == "GET":
-            cards = conn.execute(
-                "SELECT c.*, g.name as group_name, g.color as group_color, g.icon as group_icon FROM mxh_cards c LEFT JOIN mxh_groups g ON c.group_id = g.id ORDER BY CAST(c.card_name AS INTEGER)"
-            ).fetchall()
-            result = [dict(c) for c in cards]
-            card_ids = [c["id"] for c in result]
-
-            if card_ids:
-                placeholders = ",".join("?" for _ in card_ids)
-                sub_accounts = conn.execute(
-                    f"SELECT * FROM mxh_accounts WHERE card_id IN ({placeholders}) ORDER BY is_primary DESC, id ASC",
-                    card_ids,
-                ).fetchall()
-                for card in result:
-                    card["sub_accounts"] = [
-                        dict(sa) for sa in sub_accounts if sa["card_id"] == card["id"]
-                    ]
-            return jsonify(result)
+            # ?fields= áp dụng cho sub_accounts, ?limit=&after= phân trang theo card
+            sub_fields = parse_field_names(conn)
+            page = parse_page(CARDS_NUMERIC_ORDER)
+            cards, next_cursor = select_rows(
+                conn,
+                public_columns(conn, "mxh_cards", "c")
+                + ["g.name as group_name", "g.color as group_color", "g.icon as group_icon",
+                   sub_accounts_column(conn, sub_fields)],
+                "FROM mxh_cards c LEFT JOIN mxh_groups g ON c.group_id = g.id",
+                [], [], CARDS_NUMERIC_ORDER, page,
+            )
+            response = json_array_response(hydrate_cards(cards))
+            return set_next_cursor(response, next_cursor)
 
         elif request.method == "POST":
             data = request.get_json()
             now_iso = datetime.now().isoformat()
 
-            cursor = conn.execute(
-                "INSERT INTO mxh_cards (card_name, group_id, platform, created_at, updated_at) VALUES (?, ?, ?, ?, ?)",
-                (
-                    data.get("card_name"),
-                    data.get("group_id"),
-                    data.get("platform"),
-                    now_iso,
-                    now_iso,
-                ),
-            )
-            card_id = cursor.lastrowid
-
-            conn.execute(
-                """INSERT INTO mxh_accounts (card_id, is_primary, account_name, username, phone, url, login_username, login_password, created_at, updated_at, wechat_created_day, wechat_created_month, wechat_created_year, status) 
-                            VALUES (?, 1, 'Tài khoản chính', ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
-                (
-                    card_id,
-                    data.get("username"),
-                    data.get("phone"),
-                    data.get("url"),
-                    data.get("login_username"),
-                    data.get("login_password"),
-                    now_iso,
-                    now_iso,
-                    data.get("wechat_created_day"),
-                    data.get("wechat_created_month"),
-                    data.get("wechat_created_year"),
-                    "active",
-                ),
+            new_card, _ = run_write(
+                create_card_job,
+                data.get("card_name"), data.get("group_id"), data.get("platform"), now_iso,
+                {
+                    "account_name": "Tài khoản chính",
+                    "username": data.get("username"),
+                    "phone": data.get("phone"),
+                    "url": data.get("url"),
+                    "login_username": data.get("login_username"),
+                    "login_password": data.get("login_password"),
+                    "wechat_created_day": data.get("wechat_created_day"),
+                    "wechat_created_month": data.get("wechat_created_month"),
+                    "wechat_created_year": data.get("wechat_created_year"),
+                    "status": "active",
+                },
             )
-
-            conn.commit()
-            return jsonify({"message": "Card created", "card_id": card_id}), 201
+            return jsonify({"message": "Card created", "card_id": new_card["id"]}), 201
+    except DuplicateCardName as e:
+        return jsonify({"error": str(e), "field": "card_name"}), 400
+    except QueryError as e:
+        return jsonify({"error": str(e)}), 400
+    except WriteTimeout as e:
+        return jsonify({"error": str(e)}), 503
     except Exception as e:
         return jsonify({"error": str(e)}), 500
     finally:
@@ -271,24 +271,21 @@ def mxh_cards_and_sub_accounts():
 @mxh_bp.route("/api/cards/<int:card_id>", methods=["PUT", "DELETE"])
 def mxh_update_or_delete_card(card_id):
     """PUT/DELETE /mxh/api/cards/<card_id> - cập nhật hoặc xóa card"""
-    conn = get_db_connection()
     try:
         if request.method == "PUT":
             data = request.get_json()
-            conn.execute(
+            run_write_sql(
                 "UPDATE mxh_cards SET card_name = ?, updated_at = ? WHERE id = ?",
                 (data.get("card_name"), datetime.now().isoformat(), card_id),
             )
-            conn.commit()
             return jsonify({"message": "Card updated"})
         elif request.method == "DELETE":
-            conn.execute("DELETE FROM mxh_cards WHERE id = ?", (card_id,))
-            conn.commit()
+            run_write_sql("DELETE FROM mxh_cards WHERE id = ?", (card_id,))
             return jsonify({"message": "Card and sub-accounts deleted"})
+    except WriteTimeout as e:
+        return jsonify({"error": str(e)}), 503
     except Exception as e:
         return jsonify({"error": str(e)}), 500
-    finally:
-        conn.close()
 
 
 # === NEW: PUT /api/accounts/<account_id> - Update Account (not card!) ===
@@ -299,87 +296,41 @@ def update_account_direct(account_id):
     Used by frontend to update account status, username, phone, etc.
     Also handles card_name update (updates the card, not the account)
     """
-    conn = get_db_connection()
     try:
         data = request.get_json() or {}
         
         # Handle card_name separately (it's in mxh_cards table)
         card_name = data.pop('card_name', None)
         
-        # Build dynamic UPDATE query for account fields
-        allowed_fields = {
-            "status", "username", "phone", "url", "login_username", "login_password",
-            "account_name", "wechat_created_day", "wechat_created_month", "wechat_created_year",
-            "wechat_status", "die_date", "wechat_scan_count", "wechat_last_scan_date",
-            "rescue_count", "rescue_success_count", "email_reset_date", "notice", "muted_until"
-        }
-        
-        updates = {}
-        for field in allowed_fields:
-            if field in data:
-                updates[field] = data[field]
-        
-        # Update card_name if provided
-        if card_name is not None:
-            # Get card_id for this account
-            account = conn.execute("SELECT card_id FROM mxh_accounts WHERE id = ?", (account_id,)).fetchone()
-            if account:
-                conn.execute(
-                    "UPDATE mxh_cards SET card_name = ?, updated_at = ? WHERE id = ?",
-                    (card_name, datetime.now().isoformat(), account['card_id'])
-                )
-        
-        # Update account fields if any
-        if updates:
-            # Add updated_at
-            updates["updated_at"] = datetime.now().isoformat()
-            
-            # Build SQL
-            set_clause = ", ".join([f"{k} = ?" for k in updates.keys()])
-            values = list(updates.values()) + [account_id]
-            
-            conn.execute(f"UPDATE mxh_accounts SET {set_clause} WHERE id = ?", values)
-        
-        conn.commit()
-        
-        # Return updated account with joined data (card_name, group_id, platform)
-        updated = conn.execute("""
-            SELECT a.*, c.card_name, c.group_id, c.platform 
-            FROM mxh_accounts a 
-            JOIN mxh_cards c ON a.card_id = c.id 
-            WHERE a.id = ?
-        """, (account_id,)).fetchone()
+        # Chỉ các cột trong ACCOUNT_UPDATE_FIELDS được ghi (lọc trong job);
+        # luôn chạy UPDATE (ít nhất updated_at) để RETURNING trả về account kèm card_name, group_id, platform
+        updated = run_write(update_account_job, account_id, data, datetime.now().isoformat(), card_name)
         
         if updated:
-            return jsonify(dict(updated))
+            return jsonify(updated)
         return jsonify({"error": "Account not found after update"}), 404
         
+    except WriteTimeout as e:
+        return jsonify({"error": str(e)}), 503
     except Exception as e:
         return jsonify({"error": str(e)}), 500
-    finally:
-        conn.close()
 
 
 @mxh_bp.route("/api/cards/<int:card_id>/accounts", methods=["POST"])
 def mxh_create_sub_account(card_id):
     """POST /mxh/api/cards/<card_id>/accounts - tạo account con"""
-    conn = get_db_connection()
     try:
-        now_iso = datetime.now().isoformat()
-        cursor = conn.execute(
-            "INSERT INTO mxh_accounts (card_id, is_primary, created_at, updated_at, account_name) VALUES (?, 0, ?, ?, ?)",
-            (card_id, now_iso, now_iso, "Tài khoản phụ"),
+        new_sub = run_write(
+            create_account_job, card_id,
+            {"is_primary": 0, "account_name": "Tài khoản phụ"}, datetime.now().isoformat(),
         )
-        sub_account_id = cursor.lastrowid
-        conn.commit()
-        new_sub = conn.execute(
-            "SELECT * FROM mxh_accounts WHERE id = ?", (sub_account_id,)
-        ).fetchone()
-        return jsonify(dict(new_sub)), 201
+        if new_sub is None:
+            return jsonify({"error": "Card not found"}), 404
+        return jsonify(new_sub), 201
+    except WriteTimeout as e:
+        return jsonify({"error": str(e)}), 503
     except Exception as e:
         return jsonify({"error": str(e)}), 500
-    finally:
-        conn.close()
 
 
 # Alias để tương thích với route cũ
@@ -389,42 +340,40 @@ def add_sub_account(card_id):
     return mxh_create_sub_account(card_id)
 
 
+def _is_primary_account(account_id):
+    conn = get_db_connection(readonly=True)
+    try:
+        row = conn.execute("SELECT is_primary FROM mxh_accounts WHERE id = ?", (account_id,)).fetchone()
+        return bool(row and row["is_primary"])
+    finally:
+        conn.close()
+
+
 @mxh_bp.route("/api/sub_accounts/<int:sub_account_id>", methods=["PUT", "DELETE"])
 def manage_sub_account(sub_account_id):
-    conn = get_db_connection()
     try:
         if request.method == "PUT":
-            data = request.get_json()
-            fields = {k: v for k, v in data.items() if v is not None}
-            if "card_name" in fields:
-                del fields["card_name"]
+            data = request.get_json() or {}
+            # Tên cột lấy từ khóa JSON của client: chỉ nhận cột trong allow-list (không có card_name)
+            fields = {k: v for k, v in data.items() if v is not None and k in ACCOUNT_UPDATE_FIELDS}
             if not fields:
                 return jsonify({"message": "No fields to update."})
-            fields["updated_at"] = datetime.now().isoformat()
-            set_clause = ", ".join([f"{key} = ?" for key in fields.keys()])
-            params = list(fields.values()) + [sub_account_id]
-            conn.execute(
-                f"UPDATE mxh_accounts SET {set_clause} WHERE id = ?", params
-            )
-            conn.commit()
-            updated = conn.execute(
-                "SELECT * FROM mxh_accounts WHERE id = ?", (sub_account_id,)
-            ).fetchone()
-            return jsonify(dict(updated))
+            updated = run_write(update_account_job, sub_account_id, fields, datetime.now().isoformat())
+            if updated is None:
+                return jsonify({"error": "Sub-account not found"}), 404
+            return jsonify(updated)
         elif request.method == "DELETE":
-            sub_account = conn.execute(
-                "SELECT is_primary FROM mxh_accounts WHERE id = ?",
-                (sub_account_id,),
-            ).fetchone()
-            if sub_account and sub_account["is_primary"]:
+            # Điều kiện is_primary nằm trong câu DELETE: không còn khe giữa lúc kiểm tra và lúc xóa
+            _, deleted = run_write_sql(
+                "DELETE FROM mxh_accounts WHERE id = ? AND NOT is_primary", (sub_account_id,)
+            )
+            if not deleted and _is_primary_account(sub_account_id):
                 return jsonify({"error": "Cannot delete primary sub-account"}), 400
-            conn.execute("DELETE FROM mxh_accounts WHERE id = ?", (sub_account_id,))
-            conn.commit()
             return jsonify({"message": "Sub-account deleted"})
+    except WriteTimeout as e:
+        return jsonify({"error": str(e)}), 503
     except Exception as e:
         return jsonify({"error": str(e)}), 500
-    finally:
-        conn.close()
 
 
 # Alias cho các thao tác account mới (theo yêu cầu chuẩn hóa API)
@@ -432,221 +381,304 @@ def _now_iso():
     return datetime.now(timezone.utc).astimezone().isoformat()
 
 
+# --- BATCH ACTIONS ---
+# Tối đa số thao tác trong một request batch
+MAX_BATCH_OPERATIONS = 1000
+
+# Câu UPDATE của từng thao tác (giống hệt các route đơn lẻ bên dưới), luôn kết thúc bằng "WHERE id = ?"
+ACCOUNT_ACTION_SQL = {
+    "toggle-status": """
+        UPDATE mxh_accounts
+        SET status = CASE
+            WHEN status = 'active' THEN 'inactive'
+            ELSE 'active'
+        END,
+        updated_at = ?
+        WHERE id = ?
+    """,
+    "scan": """
+        UPDATE mxh_accounts
+        SET wechat_scan_count = COALESCE(wechat_scan_count, 0) + 1,
+            wechat_last_scan_date = ?,
+            updated_at = ?
+        WHERE id = ?
+    """,
+    "scan-reset": """
+        UPDATE mxh_accounts
+        SET wechat_scan_count = 0,
+            wechat_last_scan_date = NULL,
+            updated_at = ?
+        WHERE id = ?
+    """,
+    "rescue-success": """
+        UPDATE mxh_accounts
+        SET status = 'active',
+            die_date = NULL,
+            rescue_success_count = COALESCE(rescue_success_count,0) + 1,
+            updated_at = ?
+        WHERE id = ?
+    """,
+    "rescue-fail": """
+        UPDATE mxh_accounts
+        SET rescue_count = COALESCE(rescue_count,0) + 1,
+            updated_at = ?
+        WHERE id = ?
+    """,
+    "mark-die": """
+        UPDATE mxh_accounts
+        SET status = 'die',
+            die_date = ?,
+            updated_at = ?
+        WHERE id = ?
+    """,
+    "reset": """
+        UPDATE mxh_accounts
+        SET username = '.',
+            phone = '.',
+            status = 'active',
+            die_date = NULL,
+            wechat_scan_count = 0,
+            wechat_last_scan_date = NULL,
+            rescue_count = 0,
+            rescue_success_count = 0,
+            notice = NULL,
+            muted_until = NULL,
+            updated_at = ?
+        WHERE id = ?
+    """,
+}
+
+
+def _resolve_action(action, params, now_iso):
+    """(action, params) của batch -> (khóa ACCOUNT_ACTION_SQL, tham số trước id)."""
+    if action == "scan":
+        if params.get("reset"):
+            return "scan-reset", (now_iso,)
+        return "scan", (now_iso, now_iso)
+    if action == "rescue":
+        if (params.get("result") or "").lower() == "success":
+            return "rescue-success", (now_iso,)
+        return "rescue-fail", (now_iso,)
+    if action == "mark-die":
+        return "mark-die", (now_iso, now_iso)
+    if action in ("toggle-status", "reset"):
+        return action, (now_iso,)
+    raise ValueError(f"Unknown action: {action}")
+
+
+def _run_batch_group(conn, key, items, results):
+    """
+    Chạy một nhóm thao tác liên tiếp cùng câu SQL bằng executemany.
+    Nếu cả nhóm lỗi thì chạy lại từng thao tác trong SAVEPOINT riêng để chỉ báo lỗi đúng item.
+    """
+    sql = ACCOUNT_ACTION_SQL[key]
+    conn.execute("SAVEPOINT batch_group")
+    try:
+        conn.executemany(sql, [args + (account_id,) for _, account_id, args in items])
+        record_account_events(conn, key, [account_id for _, account_id, _ in items])
+        conn.execute("RELEASE batch_group")
+        for index, account_id, _ in items:
+            results[index] = {"index": index, "id": account_id, "ok": True}
+        return
+    except sqlite3.Error:
+        conn.execute("ROLLBACK TO batch_group")
+        conn.execute("RELEASE batch_group")
+
+    for index, account_id, args in items:
+        conn.execute("SAVEPOINT batch_item")
+        try:
+            conn.execute(sql, args + (account_id,))
+            record_account_events(conn, key, [account_id])
+            conn.execute("RELEASE batch_item")
+            results[index] = {"index": index, "id": account_id, "ok": True}
+        except sqlite3.Error as e:
+            conn.execute("ROLLBACK TO batch_item")
+            conn.execute("RELEASE batch_item")
+            results[index] = {"index": index, "id": account_id, "ok": False, "error": str(e)}
+
+
+def _apply_batch(conn, planned, results):
+    """Job cho writer: chạy các thao tác đã kiểm tra của batch, trả về các account đã đổi."""
+    ids = sorted({account_id for _, account_id, _, _ in planned})
+    existing = {
+        row["id"] for row in conn.execute(
+            "SELECT id FROM mxh_accounts WHERE id IN (SELECT value FROM json_each(?))",
+            (json.dumps(ids),),
+        )
+    }
+
+    group_key, group = None, []
+    for index, account_id, key, args in planned:
+        if account_id not in existing:
+            results[index] = {"index": index, "id": account_id, "ok": False, "error": "Account not found"}
+            continue
+        # Gom các thao tác liên tiếp cùng loại, giữ nguyên thứ tự thực thi
+        if key != group_key and group:
+            _run_batch_group(conn, group_key, group, results)
+            group = []
+        group_key = key
+        group.append((index, account_id, args))
+    if group:
+        _run_batch_group(conn, group_key, group, results)
+
+    applied_ids = sorted({r["id"] for r in results if r["ok"]})
+    return [
+        dict(row) for row in conn.execute("""
+            SELECT * FROM mxh_account_view
+            WHERE id IN (SELECT value FROM json_each(?))
+            ORDER BY id
+        """, (json.dumps(applied_ids),))
+    ]
+
+
+def _account_action_job(conn, key, args, account_id):
+    """Job cho writer: một thao tác account + ghi event; trả về account sau khi ghi (None nếu không có)."""
+    updated = execute_returning(
+        conn, "mxh_accounts", ACCOUNT_ACTION_SQL[key], args + (account_id,), account_id
+    )
+    if updated is not None:
+        record_account_events(conn, key, [account_id])
+    return updated
+
+
+@mxh_bp.route("/api/accounts/batch", methods=["POST"])
+def acc_batch():
+    """
+    POST /mxh/api/accounts/batch - chạy nhiều thao tác account trong một transaction (qua writer).
+    Body: {"operations": [{"id": 1, "action": "scan", "params": {"reset": false}}, ...]}
+    action: toggle-status | scan | rescue | mark-die | reset
+    Lỗi của từng item được trả về trong results, không làm hỏng cả batch.
+    """
+    data = request.get_json(silent=True)
+    operations = data.get("operations") if isinstance(data, dict) else data
+    if not isinstance(operations, list) or not operations:
+        return jsonify({"error": "operations must be a non-empty list"}), 400
+    if len(operations) > MAX_BATCH_OPERATIONS:
+        return jsonify({"error": f"Too many operations (max {MAX_BATCH_OPERATIONS})"}), 400
+
+    now_iso = _now_iso()
+    results = [None] * len(operations)
+    planned = []
+    for index, op in enumerate(operations):
+        account_id = op.get("id") if isinstance(op, dict) else None
+        if not isinstance(account_id, int) or isinstance(account_id, bool):
+            results[index] = {"index": index, "id": account_id, "ok": False, "error": "Invalid account id"}
+            continue
+        try:
+            key, args = _resolve_action(op.get("action"), op.get("params") or {}, now_iso)
+        except (ValueError, AttributeError) as e:
+            results[index] = {"index": index, "id": account_id, "ok": False, "error": str(e)}
+            continue
+        planned.append((index, account_id, key, args))
+
+    try:
+        accounts = run_write(_apply_batch, planned, results)
+    except WriteTimeout as e:
+        return jsonify({"error": str(e)}), 503
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+    applied = sum(1 for r in results if r["ok"])
+    return jsonify({
+        "results": results,
+        "accounts": accounts,
+        "applied": applied,
+        "failed": len(results) - applied,
+    })
+
+
 # Các route cụ thể phải đặt TRƯỚC route chung để tránh conflict
 @mxh_bp.route("/api/accounts/<int:account_id>/toggle-status", methods=["POST"])
 def acc_toggle_status(account_id):
     """POST /mxh/api/accounts/<account_id>/toggle-status - toggle status của account"""
-    conn = get_db_connection()
     try:
-        now_iso = _now_iso()
         # active <-> inactive (tùy Sếp dùng status gì)
-        conn.execute("""
-            UPDATE mxh_accounts
-            SET status = CASE
-                WHEN status = 'active' THEN 'inactive'
-                ELSE 'active'
-            END,
-            updated_at = ?
-            WHERE id = ?
-        """, (now_iso, account_id))
-        conn.commit()
+        run_write(_account_action_job, "toggle-status", (_now_iso(),), account_id)
         return jsonify({"message": "Status toggled"})
+    except WriteTimeout as e:
+        return jsonify({"error": str(e)}), 503
     except Exception as e:
         return jsonify({"error": str(e)}), 500
-    finally:
-        conn.close()
 
 
 @mxh_bp.route("/api/accounts/<int:account_id>/scan", methods=["POST"])
 def acc_scan(account_id):
     """POST /mxh/api/accounts/<account_id>/scan - ghi nhận hoặc reset scan"""
-    conn = get_db_connection()
     try:
         # Đọc dữ liệu JSON từ body của request
         data = request.get_json(silent=True) or {}
-        now_iso = _now_iso()
+        # reset=true -> đặt lại lượt quét, ngược lại tăng lượt quét
+        event, args = _resolve_action("scan", data, _now_iso())
+        message = "Scan count reset" if event == "scan-reset" else "Scan recorded"
 
-        if data.get("reset"):
-            # Reset lượt quét
-            conn.execute(
-                """
-                UPDATE mxh_accounts
-                SET wechat_scan_count = 0,
-                    wechat_last_scan_date = NULL,
-                    updated_at = ?
-                WHERE id = ?
-                """,
-                (now_iso, account_id),
-            )
-            message = "Scan count reset"
-        else:
-            # Tăng lượt quét
-            conn.execute(
-                """
-                UPDATE mxh_accounts
-                SET wechat_scan_count = COALESCE(wechat_scan_count, 0) + 1,
-                    wechat_last_scan_date = ?,
-                    updated_at = ?
-                WHERE id = ?
-                """,
-                (now_iso, now_iso, account_id),
-            )
-            message = "Scan recorded"
-
-        conn.commit()
+        updated = run_write(_account_action_job, event, args, account_id)
         
         # Return updated account data
-        updated = conn.execute("""
-            SELECT a.*, c.card_name, c.group_id, c.platform 
-            FROM mxh_accounts a 
-            JOIN mxh_cards c ON a.card_id = c.id 
-            WHERE a.id = ?
-        """, (account_id,)).fetchone()
-        
         if updated:
-            return jsonify(dict(updated))
+            return jsonify(updated)
         return jsonify({"message": message})
+    except WriteTimeout as e:
+        return jsonify({"error": str(e)}), 503
     except Exception as e:
         return jsonify({"error": str(e)}), 500
-    finally:
-        conn.close()
 
 
 @mxh_bp.route("/api/accounts/<int:account_id>/rescue", methods=["POST"])
 def acc_rescue(account_id):
     """POST /mxh/api/accounts/<account_id>/rescue - rescue account"""
-    conn = get_db_connection()
     try:
         body = request.get_json(silent=True) or {}
-        result = (body.get("result") or "").lower()
-        now_iso = _now_iso()
-        if result == "success":
-            conn.execute("""
-                UPDATE mxh_accounts
-                SET status = 'active',
-                    die_date = NULL,
-                    rescue_success_count = COALESCE(rescue_success_count,0) + 1,
-                    updated_at = ?
-                WHERE id = ?
-            """, (now_iso, account_id))
-            msg = "Rescued successfully"
-        else:
-            conn.execute("""
-                UPDATE mxh_accounts
-                SET rescue_count = COALESCE(rescue_count,0) + 1,
-                    updated_at = ?
-                WHERE id = ?
-            """, (now_iso, account_id))
-            msg = "Rescue attempt recorded"
-        conn.commit()
+        event, args = _resolve_action("rescue", body, _now_iso())
+        msg = "Rescued successfully" if event == "rescue-success" else "Rescue attempt recorded"
+        updated_account = run_write(_account_action_job, event, args, account_id)
         
         # Return updated account data as source of truth
-        updated_account = conn.execute("""
-            SELECT a.*, c.card_name, c.group_id, c.platform 
-            FROM mxh_accounts a 
-            JOIN mxh_cards c ON a.card_id = c.id 
-            WHERE a.id = ?
-        """, (account_id,)).fetchone()
-        
         if updated_account:
-            return jsonify(dict(updated_account))
+            return jsonify(updated_account)
         else:
             return jsonify({"message": msg})
+    except WriteTimeout as e:
+        return jsonify({"error": str(e)}), 503
     except Exception as e:
         return jsonify({"error": str(e)}), 500
-    finally:
-        conn.close()
 
 
 @mxh_bp.route("/api/accounts/<int:account_id>/mark-die", methods=["POST"])
 def acc_mark_die(account_id):
     """POST /mxh/api/accounts/<account_id>/mark-die - đánh dấu account chết"""
-    conn = get_db_connection()
     try:
         now_iso = _now_iso()
-        conn.execute("""
-            UPDATE mxh_accounts
-            SET status = 'die',
-                die_date = ?,
-                updated_at = ?
-            WHERE id = ?
-        """, (now_iso, now_iso, account_id))
-        conn.commit()
+        run_write(_account_action_job, "mark-die", (now_iso, now_iso), account_id)
         return jsonify({"message": "Account marked as die"})
+    except WriteTimeout as e:
+        return jsonify({"error": str(e)}), 503
     except Exception as e:
         return jsonify({"error": str(e)}), 500
-    finally:
-        conn.close()
 
 
 @mxh_bp.route("/api/accounts/<int:account_id>/reset", methods=["POST"])
 def acc_reset(account_id):
     """POST /mxh/api/accounts/<account_id>/reset - reset account về trạng thái mặc định"""
-    conn = get_db_connection()
     try:
-        print(f"🔄 Resetting account {account_id}...")
-        now_iso = _now_iso()
-        
-        # Check if account exists first
-        existing = conn.execute("SELECT id, username, phone FROM mxh_accounts WHERE id = ?", (account_id,)).fetchone()
-        if not existing:
-            print(f"❌ Account {account_id} not found!")
+        # Một câu UPDATE ... RETURNING: không có dòng nào trả về nghĩa là account không tồn tại.
+        # Lịch sử scan / rescue vẫn còn trong mxh_account_events sau khi reset bộ đếm
+        updated = run_write(_account_action_job, "reset", (_now_iso(),), account_id)
+        if updated is None:
             return jsonify({"error": "Account not found"}), 404
-        
-        print(f"📝 Before reset: user={existing['username']}, phone={existing['phone']}")
-        
-        cursor = conn.execute("""
-            UPDATE mxh_accounts
-            SET username = '.',
-                phone = '.',
-                status = 'active',
-                die_date = NULL,
-                wechat_scan_count = 0,
-                wechat_last_scan_date = NULL,
-                rescue_count = 0,
-                rescue_success_count = 0,
-                notice = NULL,
-                muted_until = NULL,
-                updated_at = ?
-            WHERE id = ?
-        """, (now_iso, account_id))
-        
-        rows_affected = cursor.rowcount
-        print(f"📊 UPDATE affected {rows_affected} rows")
-        
-        conn.commit()
-        print(f"✅ Committed transaction")
-        
-        # Return updated account data
-        updated = conn.execute("""
-            SELECT a.*, c.card_name, c.group_id, c.platform 
-            FROM mxh_accounts a 
-            JOIN mxh_cards c ON a.card_id = c.id 
-            WHERE a.id = ?
-        """, (account_id,)).fetchone()
-        
-        if updated:
-            print(f"📤 After reset: user={updated['username']}, phone={updated['phone']}")
-            return jsonify(dict(updated))
-        return jsonify({"message": "Account reset successfully"})
+        return jsonify(updated)
+    except WriteTimeout as e:
+        return jsonify({"error": str(e)}), 503
     except Exception as e:
-        print(f"❌ Error resetting account: {e}")
-        import traceback
-        traceback.print_exc()
         return jsonify({"error": str(e)}), 500
-    finally:
-        conn.close()
 
 
 @mxh_bp.route("/api/accounts/<int:account_id>/notice", methods=["PUT", "DELETE"])
 def acc_notice(account_id):
     """PUT/DELETE /mxh/api/accounts/<account_id>/notice - quản lý notice"""
-    conn = get_db_connection()
     try:
         now_iso = _now_iso()
         if request.method == "DELETE":
-            conn.execute("UPDATE mxh_accounts SET notice = NULL, updated_at = ? WHERE id = ?", (now_iso, account_id))
-            conn.commit()
+            run_write_sql("UPDATE mxh_accounts SET notice = NULL, updated_at = ? WHERE id = ?", (now_iso, account_id))
             return jsonify({"message": "Notice cleared"})
         data = request.get_json() or {}
         
@@ -659,10 +691,9 @@ def acc_notice(account_id):
             data['start_at'] = start_date.isoformat()
             data['enabled'] = True
         
-        conn.execute("UPDATE mxh_accounts SET notice = ?, updated_at = ? WHERE id = ?", (json.dumps(data), now_iso, account_id))
-        conn.commit()
+        run_write_sql("UPDATE mxh_accounts SET notice = ?, updated_at = ? WHERE id = ?", (json.dumps(data), now_iso, account_id))
         return jsonify({"message": "Notice saved", "notice": data})
+    except WriteTimeout as e:
+        return jsonify({"error": str(e)}), 503
     except Exception as e:
-        return jsonify({"error": str(e)}), 500
-    finally:
-        conn.close()
\ No newline at end of file
+        return jsonify({"error": str(e)}), 500
\ No newline at end of file
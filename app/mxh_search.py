@@ -0,0 +1,116 @@
+"""
+Tìm kiếm account MXH qua bảng FTS5 mxh_accounts_fts (xem database._create_mxh_search_index).
+Nếu SQLite không có FTS5 thì quay về LIKE trên cùng các cột (không có rank / highlight).
+"""
+from app.database import MXH_SEARCH_COLUMNS
+from app.fts import (
+    DEFAULT_SEARCH_LIMIT, MARK_CLOSE, MARK_OPEN, build_match_query, clamp_limit,
+    fts_available, like_pattern, marked_html, search_tokens,
+)
+
+FTS_TABLE = "mxh_accounts_fts"
+
+# Trọng số bm25 theo thứ tự MXH_SEARCH_COLUMNS: khớp username / số điện thoại quan trọng hơn ghi chú
+SEARCH_WEIGHTS = {
+    "username": 10.0,
+    "phone": 8.0,
+    "phone_digits": 8.0,
+    "account_name": 4.0,
+    "login_username": 4.0,
+    "card_name": 6.0,
+    "notice_text": 1.0,
+}
+# Cột account trả về trong kết quả: liệt kê rõ, không bao giờ kèm login_password
+# (endpoint được gọi theo từng phím gõ)
+RESULT_COLUMNS = (
+    "id", "card_id", "is_primary", "account_name", "username", "phone", "url", "login_username",
+    "wechat_status", "status", "die_date", "notice", "muted_until", "created_at", "updated_at",
+)
+_RESULT_SELECT = ", ".join(f"a.{col}" for col in RESULT_COLUMNS) + ", c.card_name, c.group_id, c.platform"
+
+# Cột trả về highlight; notice dùng snippet vì có thể dài
+HIGHLIGHT_COLUMNS = ("username", "phone", "account_name", "card_name")
+
+
+def _filters(group_id, platform):
+    where, params = [], []
+    if group_id:
+        where.append("c.group_id = ?")
+        params.append(group_id)
+    if platform:
+        where.append("c.platform = ?")
+        params.append(platform)
+    return where, params
+
+
+def _search_fts(conn, tokens, limit, group_id, platform):
+    weights = ", ".join(str(SEARCH_WEIGHTS[col]) for col in MXH_SEARCH_COLUMNS)
+    highlights = ", ".join(
+        f"highlight(mxh_accounts_fts, {MXH_SEARCH_COLUMNS.index(col)}, '{MARK_OPEN}', '{MARK_CLOSE}') AS _hl_{col}"
+        for col in HIGHLIGHT_COLUMNS
+    )
+    notice_col = MXH_SEARCH_COLUMNS.index("notice_text")
+    where, params = _filters(group_id, platform)
+    sql = f"""
+        SELECT {_RESULT_SELECT},
+               bm25(mxh_accounts_fts, {weights}) AS _rank,
+               {highlights},
+               snippet(mxh_accounts_fts, {notice_col}, '{MARK_OPEN}', '{MARK_CLOSE}', '…', 12) AS _hl_notice
+        FROM mxh_accounts_fts
+        JOIN mxh_accounts a ON a.id = mxh_accounts_fts.rowid
+        JOIN mxh_cards c ON c.id = a.card_id
+        WHERE mxh_accounts_fts MATCH ?
+    """
+    if where:
+        sql += " AND " + " AND ".join(where)
+    sql += " ORDER BY _rank LIMIT ?"
+
+    results = []
+    for row in conn.execute(sql, [build_match_query(tokens)] + params + [limit]):
+        item = dict(row)
+        match = {}
+        for col in HIGHLIGHT_COLUMNS + ("notice",):
+            value = item.pop(f"_hl_{col}")
+            if value and MARK_OPEN in value:
+                match[col] = marked_html(value)
+        item["match"] = match
+        item["rank"] = item.pop("_rank")
+        results.append(item)
+    return results
+
+
+def _search_like(conn, tokens, limit, group_id, platform):
+    """Fallback không FTS5: mỗi từ khóa phải xuất hiện (substring) ở ít nhất một cột."""
+    columns = ["a.username", "a.phone", "a.account_name", "a.login_username", "c.card_name", "a.notice"]
+    where, params = _filters(group_id, platform)
+    for token in tokens:
+        pattern = like_pattern(token)
+        where.append("(" + " OR ".join(f"{col} LIKE ? ESCAPE '\\'" for col in columns) + ")")
+        params.extend([pattern] * len(columns))
+    sql = f"""
+        SELECT {_RESULT_SELECT}
+        FROM mxh_accounts a
+        JOIN mxh_cards c ON c.id = a.card_id
+        WHERE {" AND ".join(where)}
+        ORDER BY a.updated_at DESC, a.id DESC
+        LIMIT ?
+    """
+    return [
+        dict(row, match={}, rank=None)
+        for row in conn.execute(sql, params + [limit])
+    ]
+
+
+def search_accounts(conn, q, limit=DEFAULT_SEARCH_LIMIT, group_id=None, platform=None):
+    """
+    Tìm account theo username / phone / tên card / notice. Trả về (engine, danh sách kết quả).
+    Mỗi kết quả gồm RESULT_COLUMNS của account + card_name/group_id/platform, kèm `match` (HTML đã escape,
+    phần khớp bọc <mark>) và `rank` (bm25, càng nhỏ càng khớp).
+    """
+    tokens = search_tokens(q)
+    if not tokens:
+        return ("fts5" if fts_available(conn, FTS_TABLE) else "like"), []
+    limit = clamp_limit(limit)
+    if fts_available(conn, FTS_TABLE):
+        return "fts5", _search_fts(conn, tokens, limit, group_id, platform)
+    return "like", _search_like(conn, tokens, limit, group_id, platform)
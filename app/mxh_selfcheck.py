@@ -0,0 +1,239 @@
+"""
+Tự kiểm tra các cấu trúc MXH do trigger duy trì và thread writer: `flask mxh-stats selfcheck`.
+
+Chạy trên một database tạm với pool + WriteQueue riêng (không đụng dữ liệu thật, không dùng chung
+writer của app): init_database() rồi lần lượt các thao tác ghi như API (job dùng chung trong
+mxh_writes), sau mỗi bước so lại mxh_stats, mxh_account_view, mxh_notices, mxh_changes (revision
+phải tăng), mxh_accounts_fts và khóa sắp xếp. Cuối cùng bắn một loạt job đồng thời (có một job lỗi)
+để kiểm tra group commit.
+"""
+import json
+import os
+import tempfile
+from concurrent.futures import wait
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+
+import click
+
+from app.database import (
+    ConnectionPool,
+    WriteQueue,
+    get_mxh_revision,
+    init_database,
+    verify_mxh_account_view,
+    verify_mxh_changes,
+    verify_mxh_notices,
+    verify_mxh_search_index,
+    verify_mxh_sort_keys,
+    verify_mxh_stats,
+)
+from app.mxh_writes import create_account_job, create_card_job, smart_delete_job, update_account_job
+
+# Tên kiểm tra -> hàm trả về số dòng lệch (0 = khớp)
+MXH_DERIVED_CHECKS = {
+    "mxh_stats": lambda conn: len(verify_mxh_stats(conn)),
+    "mxh_account_view": verify_mxh_account_view,
+    "mxh_notices": verify_mxh_notices,
+    "mxh_changes": verify_mxh_changes,
+    "mxh_accounts_fts": verify_mxh_search_index,
+    "sort_keys": verify_mxh_sort_keys,
+}
+
+# Số job đồng thời mỗi phía của job lỗi ở bước kiểm tra writer
+WRITER_BURST_JOBS = 50
+
+
+class SelfCheckFailed(Exception):
+    """Một bước tự kiểm tra cho kết quả sai."""
+
+
+def check_mxh_derived(conn):
+    """{tên kiểm tra: số dòng lệch} của các kiểm tra bị lệch (rỗng = mọi cấu trúc khớp)."""
+    results = {name: check(conn) for name, check in MXH_DERIVED_CHECKS.items()}
+    return {name: count for name, count in results.items() if count}
+
+
+class _ScratchDatabase:
+    """File database tạm đã init_database(), kèm pool đọc và writer riêng."""
+
+    def __init__(self, path):
+        self.pool = ConnectionPool(path)
+        self.read_pool = ConnectionPool(path, readonly=True)
+        init_database(self.pool)
+        self.writer = WriteQueue(self.pool)
+
+    def write(self, fn, *args):
+        return self.writer.run(fn, *args)
+
+    def read(self, sql, params=()):
+        conn = self.read_pool.acquire()
+        try:
+            return conn.execute(sql, params).fetchone()
+        finally:
+            conn.close()
+
+    def close(self):
+        self.writer.stop()
+        self.pool.close_all()
+        self.read_pool.close_all()
+
+
+@contextmanager
+def _scratch_database():
+    with tempfile.TemporaryDirectory(prefix="mxh-selfcheck-") as tmp:
+        db = _ScratchDatabase(os.path.join(tmp, "Data.db"))
+        try:
+            yield db
+        finally:
+            # Đóng hết kết nối trước khi xóa thư mục tạm
+            db.close()
+
+
+def _sql_job(conn, sql, params):
+    return conn.execute(sql, params).rowcount
+
+
+def _insert_group_job(conn, name, now):
+    return conn.execute(
+        "INSERT INTO mxh_groups (name, color, created_at) VALUES (?, ?, ?)", (name, "#888888", now)
+    ).lastrowid
+
+
+def _failing_job(conn, account_id):
+    # Ghi rồi mới lỗi: SAVEPOINT của writer phải bỏ phần đã ghi, không ảnh hưởng job khác cùng batch
+    conn.execute("UPDATE mxh_accounts SET rescue_count = rescue_count + 1000 WHERE id = ?", (account_id,))
+    raise SelfCheckFailed("expected failure")
+
+
+def _expect(condition, message):
+    if not condition:
+        raise SelfCheckFailed(message)
+
+
+def _mutation_steps(db):
+    """Các bước (tên, hàm) chạy lần lượt; state dùng chung giữa các bước."""
+    now = datetime.now().isoformat()
+    state = {"cards": [], "accounts": []}
+
+    def create():
+        state["group_a"] = db.write(_insert_group_job, "Selfcheck A", now)
+        state["group_b"] = db.write(_insert_group_job, "Selfcheck B", now)
+        for name in ("1", "2", "10", "x"):
+            card, account = db.write(
+                create_card_job, name, state["group_a"], "wechat", now,
+                {"status": "active", "username": f"user{name}", "phone": "+84 90-000"},
+            )
+            sub = db.write(create_account_job, card["id"], {"status": "die", "wechat_scan_count": 2}, now)
+            state["cards"].append(card["id"])
+            state["accounts"] += [account["id"], sub["id"]]
+
+    def rename_card():
+        db.write(update_account_job, state["accounts"][0], {}, now, "25")
+
+    def update_account():
+        db.write(update_account_job, state["accounts"][1], {
+            "status": "active", "phone": "0123 456", "wechat_scan_count": 7, "rescue_count": 1,
+        }, now)
+
+    def move_card():
+        db.write(
+            _sql_job, "UPDATE mxh_cards SET group_id = ?, updated_at = ? WHERE id = ?",
+            (state["group_b"], now, state["cards"][1]),
+        )
+
+    def set_notice():
+        start = datetime.now(timezone.utc) - timedelta(days=3)
+        notice = {"enabled": True, "title": "Kiểm tra", "note": "ghi chú", "start_at": start.isoformat(), "days": 1}
+        db.write(update_account_job, state["accounts"][2], {"notice": json.dumps(notice)}, now)
+
+    def clear_notice():
+        db.write(update_account_job, state["accounts"][2], {"notice": None}, now)
+
+    def delete_card():
+        db.write(_sql_job, "DELETE FROM mxh_cards WHERE id = ?", (state["cards"][2],))
+
+    def smart_delete():
+        # Id vừa là account vừa là card: lần đầu xóa account, lần sau xóa card + accounts con
+        card_id = next(
+            card_id for card_id in state["cards"]
+            if db.read("SELECT 1 FROM mxh_cards WHERE id = ?", (card_id,))
+            and db.read("SELECT 1 FROM mxh_accounts WHERE id = ?", (card_id,))
+        )
+        _expect(db.write(smart_delete_job, card_id) == "account", "smart-delete did not delete the account")
+        _expect(db.write(smart_delete_job, card_id) == "card", "smart-delete did not delete the card")
+
+    def delete_group():
+        db.write(_sql_job, "DELETE FROM mxh_groups WHERE id = ?", (state["group_b"],))
+
+    return [
+        ("create groups/cards/accounts", create),
+        ("rename card", rename_card),
+        ("update account", update_account),
+        ("move card to another group", move_card),
+        ("set notice", set_notice),
+        ("clear notice", clear_notice),
+        ("delete card", delete_card),
+        ("smart-delete", smart_delete),
+        ("delete group", delete_group),
+    ]
+
+
+def _writer_burst(db):
+    """Nhiều job cùng lúc (gom batch) + một job lỗi ở giữa: job lỗi không ghi gì, các job khác đều commit."""
+    account_id = db.read("SELECT id FROM mxh_accounts ORDER BY id LIMIT 1")[0]
+    before = db.read("SELECT rescue_count FROM mxh_accounts WHERE id = ?", (account_id,))[0] or 0
+    increment = ("UPDATE mxh_accounts SET rescue_count = COALESCE(rescue_count, 0) + 1 WHERE id = ?", (account_id,))
+    futures = [db.writer.submit(_sql_job, *increment) for _ in range(WRITER_BURST_JOBS)]
+    failing = db.writer.submit(_failing_job, account_id)
+    futures += [db.writer.submit(_sql_job, *increment) for _ in range(WRITER_BURST_JOBS)]
+    wait(futures + [failing])
+
+    _expect(isinstance(failing.exception(), SelfCheckFailed), "failing job did not report its error")
+    errors = [f.exception() for f in futures if f.exception() is not None]
+    _expect(not errors, f"writer jobs failed: {errors[:3]}")
+    expected = before + 2 * WRITER_BURST_JOBS
+    after = db.read("SELECT rescue_count FROM mxh_accounts WHERE id = ?", (account_id,))[0]
+    _expect(after == expected, f"rescue_count = {after}, expected {expected}")
+
+
+def _check_step(db, revision):
+    conn = db.read_pool.acquire()
+    try:
+        mismatched = check_mxh_derived(conn)
+        if get_mxh_revision(conn) <= revision:
+            mismatched["revision"] = "not advanced"
+        return mismatched
+    finally:
+        conn.close()
+
+
+def run_selfcheck(echo=print):
+    """Chạy toàn bộ các bước trên database tạm; trả về danh sách lỗi (rỗng = đạt)."""
+    failures = []
+    with _scratch_database() as db:
+        steps = _mutation_steps(db) + [("writer burst", lambda: _writer_burst(db))]
+        for name, step in steps:
+            revision = db.read("SELECT COALESCE(MAX(rev), 0) FROM mxh_changes")[0]
+            try:
+                step()
+            except Exception as e:
+                # Các bước sau dựa vào state của bước này -> dừng
+                failures.append(f"{name}: {e!r}")
+                echo(f"FAIL {name}: {e!r}")
+                break
+            mismatched = _check_step(db, revision)
+            if mismatched:
+                failures.append(f"{name}: {mismatched}")
+                echo(f"FAIL {name}: {mismatched}")
+            else:
+                echo(f"OK   {name}")
+    return failures
+
+
+@click.command("selfcheck")
+def mxh_selfcheck_command():
+    """Chạy chuỗi thao tác ghi trên database tạm, kiểm tra các bảng do trigger duy trì; thoát mã 1 nếu lệch."""
+    if run_selfcheck(echo=click.echo):
+        raise SystemExit(1)
+    click.echo("selfcheck OK")
@@ -0,0 +1,90 @@
+"""
+Job ghi MXH dùng chung cho mxh_routes và mxh_api (chạy qua database.run_write).
+Hai blueprint có các route trùng URL (vd. POST /mxh/api/cards); cùng gọi một job
+để validation và shape kết quả không lệch nhau. Job không tự commit.
+"""
+from app.database import execute_returning
+
+# Cột account client được phép sửa (PUT account / sub-account / quick-update).
+# Cột nội bộ do trigger duy trì, id, card_id, created_at, updated_at không nằm trong danh sách.
+ACCOUNT_UPDATE_FIELDS = frozenset({
+    "status", "username", "phone", "url", "login_username", "login_password",
+    "account_name", "wechat_created_day", "wechat_created_month", "wechat_created_year",
+    "wechat_status", "die_date", "wechat_scan_count", "wechat_last_scan_date",
+    "rescue_count", "rescue_success_count", "email_reset_date", "notice", "muted_until",
+})
+
+
+class DuplicateCardName(ValueError):
+    """Đã có card cùng tên trong group (trả về 400)."""
+
+
+def _insert_account(conn, account):
+    columns = ", ".join(account)
+    placeholders = ", ".join("?" * len(account))
+    return execute_returning(
+        conn, "mxh_accounts",
+        f"INSERT INTO mxh_accounts ({columns}) VALUES ({placeholders})", tuple(account.values()),
+    )
+
+
+def create_card_job(conn, card_name, group_id, platform, now, primary_account):
+    """
+    Tạo card + account primary của nó. Tên card phải duy nhất trong group
+    (kiểm tra ngay trong transaction ghi). Trả về (card, account).
+    """
+    existing = conn.execute(
+        "SELECT id FROM mxh_cards WHERE card_name = ? AND group_id = ?", (card_name, group_id)
+    ).fetchone()
+    if existing:
+        raise DuplicateCardName(f"Card name '{card_name}' already exists in group {group_id}")
+
+    card = execute_returning(
+        conn, "mxh_cards",
+        "INSERT INTO mxh_cards (card_name, group_id, platform, created_at, updated_at) VALUES (?, ?, ?, ?, ?)",
+        (card_name, group_id, platform, now, now),
+    )
+    account = _insert_account(conn, {
+        **primary_account, "card_id": card["id"], "is_primary": 1, "created_at": now, "updated_at": now,
+    })
+    return card, account
+
+
+def create_account_job(conn, card_id, account, now):
+    """Tạo account thuộc card; trả về account mới, hoặc None nếu card không tồn tại."""
+    if not conn.execute("SELECT 1 FROM mxh_cards WHERE id = ?", (card_id,)).fetchone():
+        return None
+    return _insert_account(conn, {**account, "card_id": card_id, "created_at": now, "updated_at": now})
+
+
+def update_account_job(conn, account_id, fields, now, card_name=None):
+    """
+    Cập nhật các cột trong ACCOUNT_UPDATE_FIELDS (khóa khác bị bỏ qua) và updated_at;
+    card_name (nếu có) đổi tên card chứa account. Trả về account, hoặc None nếu không tồn tại.
+    """
+    # Chạy trước để RETURNING của câu UPDATE account bên dưới thấy card_name mới
+    if card_name is not None:
+        conn.execute(
+            "UPDATE mxh_cards SET card_name = ?, updated_at = ? "
+            "WHERE id = (SELECT card_id FROM mxh_accounts WHERE id = ?)",
+            (card_name, now, account_id),
+        )
+    updates = {key: value for key, value in fields.items() if key in ACCOUNT_UPDATE_FIELDS}
+    # Luôn cập nhật updated_at: không có dòng nào trả về nghĩa là account không tồn tại
+    updates["updated_at"] = now
+    set_clause = ", ".join(f"{key} = ?" for key in updates)
+    return execute_returning(
+        conn, "mxh_accounts",
+        f"UPDATE mxh_accounts SET {set_clause} WHERE id = ?", list(updates.values()) + [account_id], account_id,
+    )
+
+
+def smart_delete_job(conn, any_id):
+    """Xóa account, hoặc card + accounts con (id không phải account); trả về "account" / "card" / None."""
+    if conn.execute("DELETE FROM mxh_accounts WHERE id=?", (any_id,)).rowcount:
+        return "account"
+    if conn.execute("SELECT 1 FROM mxh_cards WHERE id=?", (any_id,)).fetchone():
+        conn.execute("DELETE FROM mxh_accounts WHERE card_id=?", (any_id,))
+        conn.execute("DELETE FROM mxh_cards WHERE id=?", (any_id,))
+        return "card"
+    return None
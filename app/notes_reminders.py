@@ -0,0 +1,315 @@
+"""
+Bộ lập lịch nhắc hẹn cho Notes.
+Giữ thời điểm đến hạn của các note `active` trong một heap; thread nền chỉ thức dậy khi
+nhắc hẹn sớm nhất đến hạn (hoặc khi lịch thay đổi), đánh dấu note là `notified` và đẩy
+thông báo vào NotificationBroker. Đọc danh sách note không còn phải kiểm tra nhắc hẹn.
+"""
+import heapq
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime, timedelta, timezone
+
+from app.database import get_db_connection, run_write
+
+logger = logging.getLogger(__name__)
+
+SOUND_EXTENSIONS = (".wav", ".mp3", ".ogg")
+DEFAULT_SOUND_URL = "/notes/sounds/notification.wav"
+# Thức dậy ít nhất mỗi bấy nhiêu giây (phòng đồng hồ hệ thống bị chỉnh / máy ngủ)
+MAX_SLEEP_SECONDS = 60
+# fire() lỗi (writer quá tải, database bị khóa...) thì thử lại các note đó sau bấy nhiêu giây
+FIRE_RETRY_SECONDS = 15
+
+# Thông báo được giữ lại bấy nhiêu giây / tối đa bấy nhiêu cái cho các tab chưa đọc
+NOTIFICATION_TTL_SECONDS = 600
+NOTIFICATION_HISTORY = 200
+# Con trỏ của tab không poll quá bấy nhiêu giây thì bị bỏ
+CLIENT_IDLE_SECONDS = 300
+MAX_NOTIFICATION_CLIENTS = 100
+
+
+def parse_due_time(value):
+    """due_time (ISO 8601, thường là toISOString() của trình duyệt) -> datetime UTC, None nếu sai."""
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except (TypeError, ValueError):
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.astimezone(timezone.utc)
+
+
+class SoundIndex:
+    """Danh sách file âm thanh trong thư mục, chỉ đọc lại khi mtime của thư mục thay đổi."""
+
+    def __init__(self, folder):
+        self.folder = folder
+        self._mtime = None
+        self._sounds = []
+
+    def _refresh(self):
+        try:
+            mtime = os.stat(self.folder).st_mtime_ns
+        except OSError:
+            self._mtime, self._sounds = None, []
+            return
+        if mtime != self._mtime:
+            self._sounds = [
+                (os.path.splitext(name)[0].lower(), name)
+                for name in sorted(os.listdir(self.folder))
+                if name.endswith(SOUND_EXTENSIONS)
+            ]
+            self._mtime = mtime
+
+    def sound_url(self, title_html):
+        """File âm thanh đầu tiên có tên xuất hiện trong tiêu đề, không có thì dùng mặc định."""
+        self._refresh()
+        title_lower = (title_html or "").lower()
+        for stem, name in self._sounds:
+            if stem in title_lower:
+                return f"/notes/sounds/{name}"
+        return DEFAULT_SOUND_URL
+
+
+class NotificationBroker:
+    """
+    Hàng đợi thông báo dùng chung, an toàn giữa các thread:
+    deque (seq, khóa, thời điểm, payload) + set khóa để chống trùng O(1).
+    Mỗi client (tab) có con trỏ seq riêng (bắt đầu từ lần poll đầu tiên) nên mọi tab đang mở
+    đều nhận mỗi thông báo mới đúng một lần;
+    next_for(wait=...) chờ trên Condition cho long-poll.
+    """
+
+    def __init__(self, history=NOTIFICATION_HISTORY, ttl=NOTIFICATION_TTL_SECONDS):
+        self.history = history
+        self.ttl = ttl
+        self._cond = threading.Condition()
+        self._items = deque()
+        self._keys = set()
+        self._seq = 0
+        self._cursors = {}
+
+    def _drop_left(self):
+        _, key, _, _ = self._items.popleft()
+        self._keys.discard(key)
+
+    def _expire(self, now):
+        while self._items and self._items[0][2] < now - self.ttl:
+            self._drop_left()
+
+    def publish(self, payload, key=None):
+        """Thêm thông báo; trả về False nếu khóa (mặc định id note) đã có trong hàng đợi."""
+        key = payload["id"] if key is None else key
+        with self._cond:
+            now = time.monotonic()
+            self._expire(now)
+            if key in self._keys:
+                return False
+            if len(self._items) >= self.history:
+                self._drop_left()
+            self._seq += 1
+            self._items.append((self._seq, key, now, payload))
+            self._keys.add(key)
+            self._cond.notify_all()
+            return True
+
+    def discard(self, note_id):
+        """Bỏ các thông báo của note (đã được xác nhận ở một tab) khỏi hàng đợi."""
+        with self._cond:
+            kept = [item for item in self._items if item[3]["id"] != note_id]
+            self._items = deque(kept)
+            self._keys = {item[1] for item in kept}
+
+    def _first_after(self, cursor):
+        for item in self._items:
+            if item[0] > cursor:
+                return item
+        return None
+
+    def _touch(self, client, cursor, now):
+        self._cursors.pop(client, None)
+        for other, (_, seen) in list(self._cursors.items()):
+            if seen < now - CLIENT_IDLE_SECONDS:
+                del self._cursors[other]
+        while len(self._cursors) >= MAX_NOTIFICATION_CLIENTS:
+            # dict giữ thứ tự chèn -> phần tử đầu là client lâu nhất chưa poll
+            del self._cursors[next(iter(self._cursors))]
+        self._cursors[client] = (cursor, now)
+
+    def next_for(self, client, wait=0):
+        """Thông báo kế tiếp cho client (None nếu không có sau `wait` giây)."""
+        deadline = time.monotonic() + wait
+        with self._cond:
+            # Client mới (tab mới / tải lại trang) bắt đầu từ thông báo hiện tại,
+            # không phát lại các thông báo trong TTL đã hiện ở tab khác
+            cursor = self._cursors.get(client, (self._seq, None))[0]
+            while True:
+                now = time.monotonic()
+                self._expire(now)
+                item = self._first_after(cursor)
+                if item is not None or now >= deadline:
+                    break
+                self._cond.wait(deadline - now)
+            if item is not None:
+                cursor = item[0]
+            self._touch(client, cursor, now)
+            return item[3] if item is not None else None
+
+
+def _mark_notified_job(conn, now, note_ids):
+    """
+    Job cho writer: đọc và đánh dấu `notified` trong cùng transaction ghi,
+    để một request dời hạn note chen vào giữa không bị ghi đè. Trả về các note vừa đánh dấu.
+    """
+    rows = conn.execute("""
+        SELECT id, title_html, title_text, content_html, due_time FROM notes
+        WHERE status = 'active' AND due_time IS NOT NULL
+          AND (due_time <= ? OR id IN (SELECT value FROM json_each(?)))
+    """, (now.isoformat(), json.dumps(note_ids))).fetchall()
+    # Note vừa được dời hạn (chưa kịp cập nhật heap) thì bỏ qua
+    due_rows = [
+        dict(row) for row in rows
+        if (parse_due_time(row["due_time"]) or now) <= now
+    ]
+    if due_rows:
+        conn.execute(
+            "UPDATE notes SET status = 'notified', due_time = NULL "
+            "WHERE id IN (SELECT value FROM json_each(?))",
+            (json.dumps([row["id"] for row in due_rows]),),
+        )
+    return due_rows
+
+
+class ReminderScheduler:
+    """
+    Heap (thời điểm đến hạn, note_id) + map note_id -> thời điểm hiện hành
+    (mục cũ trong heap bị bỏ qua khi lấy ra thay vì xóa tại chỗ).
+    Thread nền được create_app() khởi động (ensure_started) và nạp lịch từ DB
+    qua index idx_notes_status_due.
+    """
+
+    def __init__(self, sounds_folder, on_due):
+        self.sounds = SoundIndex(sounds_folder)
+        self.on_due = on_due
+        self._cond = threading.Condition()
+        self._heap = []
+        self._due = {}
+        self._thread = None
+        self._stopping = False
+
+    def ensure_started(self):
+        with self._cond:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stopping = False
+            self._load()
+            self._thread = threading.Thread(target=self._run, name="notes-reminders", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        with self._cond:
+            thread = self._thread
+            self._thread = None
+            self._stopping = True
+            self._cond.notify()
+        if thread is not None:
+            thread.join()
+
+    def _load(self):
+        conn = get_db_connection(readonly=True)
+        try:
+            rows = conn.execute(
+                "SELECT id, due_time FROM notes WHERE status = 'active' AND due_time IS NOT NULL"
+            ).fetchall()
+        finally:
+            conn.close()
+        self._heap, self._due = [], {}
+        for row in rows:
+            self._set(row["id"], parse_due_time(row["due_time"]))
+        heapq.heapify(self._heap)
+
+    def _set(self, note_id, due):
+        if due is None:
+            self._due.pop(note_id, None)
+            return
+        self._due[note_id] = due
+        self._heap.append((due, note_id))
+
+    def schedule(self, note_id, due_time):
+        """Note được tạo / sửa: đặt lại nhắc hẹn (due_time None = không còn nhắc)."""
+        due = parse_due_time(due_time)
+        with self._cond:
+            if due is None:
+                self._due.pop(note_id, None)
+                return
+            self._push(note_id, due)
+
+    def _push(self, note_id, due):
+        self._due[note_id] = due
+        heapq.heappush(self._heap, (due, note_id))
+        self._cond.notify()
+
+    def _retry(self, note_ids, due):
+        """Đưa lại các note vừa lấy khỏi heap nhưng fire() lỗi (note đã được đặt lịch mới thì giữ lịch mới)."""
+        with self._cond:
+            for note_id in note_ids:
+                if note_id not in self._due:
+                    self._push(note_id, due)
+
+    def cancel(self, note_id):
+        """Note bị xóa / đã thông báo."""
+        with self._cond:
+            self._due.pop(note_id, None)
+
+    def _pop_due(self, now):
+        """Lấy các note đã đến hạn khỏi heap; trả về (danh sách id, số giây tới hạn kế tiếp)."""
+        ids = []
+        while self._heap:
+            due, note_id = self._heap[0]
+            if self._due.get(note_id) != due:
+                heapq.heappop(self._heap)
+                continue
+            if due > now:
+                return ids, (due - now).total_seconds()
+            heapq.heappop(self._heap)
+            del self._due[note_id]
+            ids.append(note_id)
+        return ids, None
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while True:
+                    if self._stopping:
+                        return
+                    ids, wait = self._pop_due(datetime.now(timezone.utc))
+                    if ids:
+                        break
+                    self._cond.wait(MAX_SLEEP_SECONDS if wait is None else min(wait, MAX_SLEEP_SECONDS))
+            try:
+                self.fire(ids)
+            except Exception:
+                # Note vẫn `active` trong DB nhưng đã rời heap: đặt lại để không mất nhắc hẹn
+                logger.exception("Notes reminder failed, retrying in %ss", FIRE_RETRY_SECONDS)
+                self._retry(ids, datetime.now(timezone.utc) + timedelta(seconds=FIRE_RETRY_SECONDS))
+
+    def fire(self, note_ids=()):
+        """
+        Đánh dấu `notified` các note đến hạn (id lấy từ heap + mọi note active đã quá hạn trong DB)
+        và gửi thông báo cho từng note.
+        """
+        due_rows = run_write(_mark_notified_job, datetime.now(timezone.utc), list(note_ids))
+        for row in due_rows:
+            self.on_due({
+                "id": row["id"],
+                "title": row["title_text"] or "",
+                "notes": row["content_html"] or "",
+                "sound_url": self.sounds.sound_url(row["title_html"]),
+                "due_time": row["due_time"],
+            })
@@ -2,8 +2,14 @@ import uuid
 import os
 from datetime import datetime, timezone
 from flask import Blueprint, request, jsonify, send_from_directory
-from app.database import get_db_connection, DATA_DIR
-from bs4 import BeautifulSoup
+from app.database import (
+    get_db_connection, notes_derived_fields, run_write, run_write_sql, WriteTimeout, NOTES_DERIVED_COLUMNS, DATA_DIR,
+)
+from app.fts import DEFAULT_SEARCH_LIMIT, like_pattern
+from app.http_cache import conditional_get
+from app.mxh_queries import QueryError, json_array_response, parse_page, select_rows, set_next_cursor
+from app.notes_reminders import NotificationBroker, ReminderScheduler
+from app.notes_search import search_notes
 from PIL import Image
 import io
 import base64
@@ -14,64 +20,138 @@ NOTES_IMAGES_FOLDER = os.path.join(DATA_DIR, "notes_images")
 # --- BLUEPRINT DEFINITION ---
 notes_bp = Blueprint("notes_feature", __name__, url_prefix="/notes")
 
+@notes_bp.errorhandler(WriteTimeout)
+def handle_write_timeout(e):
+    return jsonify({"error": str(e)}), 503
+
 # --- GLOBAL VARS FOR NOTES (Copied from temp_Main.pyw) ---
-NOTIFICATIONS_QUEUE = []
-
-# --- CORE FUNCTIONS (Copied from temp_Main.pyw, lines 1459-1507) ---
-def check_and_queue_reminders():
-    """Checks for due reminders from SQLite and queues them for notification."""
-    conn = get_db_connection()
-    now_utc_iso = datetime.now(timezone.utc).isoformat()
-    due_notes = conn.execute(
-        "SELECT * FROM notes WHERE status = 'active' AND due_time IS NOT NULL AND due_time <= ?",
-        (now_utc_iso,)
-    ).fetchall()
-
-    if not due_notes:
-        conn.close()
-        return
+# Long-poll /api/check-notifications?wait= chờ tối đa bấy nhiêu giây
+MAX_NOTIFICATION_WAIT = 30
 
-    sound_files = []
-    if os.path.exists(SOUNDS_FOLDER):
-        sound_files = [f for f in os.listdir(SOUNDS_FOLDER) if f.endswith((".wav", ".mp3", ".ogg"))]
-    
-    ids_to_update = []
-    for note in due_notes:
-        note_dict = dict(note)
-        title_lower = (note_dict.get("title_html") or "").lower() # Use title_html
-        sound_url = "/notes/sounds/notification.wav" # Default
-        for sf in sound_files:
-            if os.path.splitext(sf)[0].lower() in title_lower:
-                sound_url = f"/notes/sounds/{sf}"
-                break
-        
-        notification_payload = {
-            "id": note_dict["id"],
-            "title": BeautifulSoup(note_dict["title_html"], "html.parser").get_text(),
-            "notes": note_dict.get("content_html", ""),
-            "sound_url": sound_url
-        }
-        if not any(q['id'] == note_dict['id'] for q in NOTIFICATIONS_QUEUE):
-            NOTIFICATIONS_QUEUE.append(notification_payload)
-        
-        ids_to_update.append(note_dict["id"])
+def queue_notification(payload):
+    """Đưa thông báo vào broker; mỗi lần đến hạn (id + due_time) chỉ được đưa vào một lần."""
+    notifications.publish(payload, key=f"{payload['id']}@{payload.get('due_time')}")
 
-    if ids_to_update:
-        # Update status in bulk
-        placeholders = ','.join('?' for _ in ids_to_update)
-        conn.execute(f"UPDATE notes SET status = 'notified', due_time = NULL WHERE id IN ({placeholders})", ids_to_update)
-        conn.commit()
-    
-    conn.close()
+notifications = NotificationBroker()
+# Nhắc hẹn chạy ở thread nền (app/notes_reminders.py), không còn kiểm tra mỗi lần đọc
+reminders = ReminderScheduler(SOUNDS_FOLDER, on_due=queue_notification)
+
+# --- DANH SÁCH NOTE GỌN ---
+# Danh sách chỉ trả metadata + preview (cột lưu sẵn); nội dung đầy đủ lấy qua GET /notes/api/<id>
+NOTES_ORDER = (("modified_at", "DESC"), ("id", "DESC"))
+NOTE_LIST_COLUMNS = [
+    "id", "title_html", "preview", "status", "due_time", "is_marked", "modified_at",
+    "content_length", "content_hash",
+]
+
+def _note_search_where(term):
+    """
+    ?q= -> LIKE "chứa chuỗi" trên plain text đã lưu (title_text / content_text) để lọc danh sách
+    khớp cả giữa từ ("port" khớp "report"); tìm theo từ khóa + xếp hạng dùng /notes/api/search (FTS5).
+    Riêng profile id nằm trong thuộc tính data-profile-id nên so khớp nguyên thuộc tính trong HTML.
+    """
+    if not term:
+        return [], []
+    pattern = like_pattern(term)
+    profile_pattern = like_pattern(f'data-profile-id="{term}"')
+    return [
+        "(title_text LIKE ? ESCAPE '\\' OR content_text LIKE ? ESCAPE '\\' OR content_html LIKE ? ESCAPE '\\')"
+    ], [pattern, pattern, profile_pattern]
 
 # --- API ROUTES (Copied from temp_Main.pyw, starting from line 1509) ---
 @notes_bp.route("/api/get")
+@conditional_get("notes")
 def api_get_notes():
-    check_and_queue_reminders()
-    conn = get_db_connection()
-    notes_rows = conn.execute("SELECT * FROM notes ORDER BY modified_at DESC").fetchall()
+    """
+    Danh sách note (mới sửa trước): metadata + preview text, không có content_html.
+    ?limit=&after=<cursor>: phân trang keyset theo modified_at (trang sau báo qua X-Next-Cursor).
+    ?q=: chỉ lấy note có tiêu đề / nội dung chứa chuỗi (tìm trên server vì danh sách không còn content_html).
+    """
+    conn = get_db_connection(readonly=True)
+    try:
+        page = parse_page(NOTES_ORDER)
+        where, params = _note_search_where(request.args.get("q", "").strip())
+        rows, next_cursor = select_rows(conn, NOTE_LIST_COLUMNS, "FROM notes", where, params, NOTES_ORDER, page)
+        response = json_array_response(rows)
+        return set_next_cursor(response, next_cursor)
+    except QueryError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+    finally:
+        conn.close()
+
+@notes_bp.route("/api/search")
+def api_search_notes():
+    """
+    GET /notes/api/search?q=&limit=
+    Tìm note theo tiêu đề / nội dung (khớp tiền tố), xếp theo bm25.
+    Chỉ trả id + tiêu đề / snippet đã highlight; nội dung đầy đủ lấy qua GET /notes/api/<id>.
+    """
+    conn = get_db_connection(readonly=True)
+    try:
+        try:
+            limit = int(request.args.get("limit", DEFAULT_SEARCH_LIMIT))
+        except ValueError:
+            return jsonify({"error": "limit must be an integer"}), 400
+        engine, results = search_notes(conn, request.args.get("q", ""), limit=limit)
+        return jsonify({"engine": engine, "results": results})
+    finally:
+        conn.close()
+
+@notes_bp.route("/api/<note_id>")
+@conditional_get("notes")
+def api_get_note(note_id):
+    """Một note đầy đủ (kể cả content_html), dùng khi mở note để sửa."""
+    conn = get_db_connection(readonly=True)
+    note = _note_row(conn, note_id)
     conn.close()
-    return jsonify([dict(row) for row in notes_rows])
+    if not note:
+        return jsonify({"error": "Không tìm thấy ghi chú"}), 404
+    return jsonify(note)
+
+def _note_row(conn, note_id):
+    row = conn.execute("SELECT * FROM notes WHERE id = ?", (note_id,)).fetchone()
+    if row is None:
+        return None
+    note = dict(row)
+    note.pop("text_version", None) # chỉ dùng để biết lúc nào cần tính lại cột text
+    return note
+
+def _insert_note_job(conn, values):
+    """Job cho writer: thêm note, trả về note đầy đủ vừa lưu."""
+    conn.execute(
+        f"INSERT INTO notes (id, title_html, content_html, due_time, status, modified_at, is_marked, {', '.join(NOTES_DERIVED_COLUMNS)}) VALUES ({', '.join('?' * len(values))})",
+        values
+    )
+    return _note_row(conn, values[0])
+
+def _update_note_job(conn, note_id, title_html, content_html, reminder_time, modified_at, derived):
+    """Job cho writer: sửa note; trả về note sau khi sửa, hoặc None nếu không tồn tại."""
+    # Get current status to avoid overwriting 'notified'
+    current_note = conn.execute("SELECT status FROM notes WHERE id = ?", (note_id,)).fetchone()
+    if not current_note:
+        return None
+
+    # Determine the new status
+    if reminder_time:
+        status = "active"
+    elif current_note['status'] == 'active':
+        status = 'none'
+    else: # Keep 'notified' or other statuses if they exist
+        status = current_note['status']
+
+    derived_assignments = ", ".join(f"{col} = ?" for col in NOTES_DERIVED_COLUMNS)
+    conn.execute(
+        f"UPDATE notes SET title_html = ?, content_html = ?, due_time = ?, status = ?, modified_at = ?, {derived_assignments} WHERE id = ?",
+        (title_html, content_html, reminder_time, status, modified_at) + derived + (note_id,)
+    )
+    return _note_row(conn, note_id)
+
+def _toggle_mark_job(conn, note_id):
+    """Job cho writer: đảo is_marked ngay trong câu UPDATE; trả về note hoặc None."""
+    cursor = conn.execute("UPDATE notes SET is_marked = NOT is_marked WHERE id = ?", (note_id,))
+    return _note_row(conn, note_id) if cursor.rowcount else None
 
 @notes_bp.route("/api/add", methods=["POST"])
 def api_add_note():
@@ -91,17 +171,15 @@ def api_add_note():
         "is_marked": data.get("is_marked", False) # Ensure is_marked is handled
     }
 
-    conn = get_db_connection()
-    conn.execute(
-        "INSERT INTO notes (id, title_html, content_html, due_time, status, modified_at, is_marked) VALUES (?, ?, ?, ?, ?, ?, ?)",
-        (new_note['id'], new_note['title_html'], new_note['content_html'], new_note['due_time'], new_note['status'], new_note['modified_at'], new_note['is_marked'])
+    derived = notes_derived_fields(title_html, content_html)
+
+    saved_note = run_write(
+        _insert_note_job,
+        (new_note['id'], new_note['title_html'], new_note['content_html'], new_note['due_time'], new_note['status'], new_note['modified_at'], new_note['is_marked']) + derived
     )
-    conn.commit()
     
-    # Fetch the newly created note to return complete data
-    saved_note_row = conn.execute("SELECT * FROM notes WHERE id = ?", (new_note['id'],)).fetchone()
-    conn.close()
-    return jsonify(dict(saved_note_row)), 201
+    reminders.schedule(new_note['id'], new_note['due_time'])
+    return jsonify(saved_note), 201
 
 @notes_bp.route("/api/update/<note_id>", methods=["POST"])
 def api_update_note(note_id):
@@ -113,78 +191,48 @@ def api_update_note(note_id):
         return jsonify({"error": "Tiêu đề hoặc nội dung không được để trống"}), 400
     
     modified_at = datetime.now(timezone.utc).isoformat()
+    derived = notes_derived_fields(title_html, content_html)
 
-    conn = get_db_connection()
-    
-    # Get current status to avoid overwriting 'notified'
-    current_note = conn.execute("SELECT status FROM notes WHERE id = ?", (note_id,)).fetchone()
-    if not current_note:
-        conn.close()
+    updated_note = run_write(_update_note_job, note_id, title_html, content_html, reminder_time, modified_at, derived)
+    if updated_note is None:
         return jsonify({"error": "Không tìm thấy ghi chú"}), 404
-
-    # Determine the new status
-    if reminder_time:
-        status = "active"
-    elif current_note['status'] == 'active':
-        status = 'none'
-    else: # Keep 'notified' or other statuses if they exist
-        status = current_note['status']
-
-    cursor = conn.execute(
-        "UPDATE notes SET title_html = ?, content_html = ?, due_time = ?, status = ?, modified_at = ? WHERE id = ?",
-        (title_html, content_html, reminder_time, status, modified_at, note_id)
-    )
-    conn.commit()
-    
-    if cursor.rowcount == 0:
-        conn.close()
-        return jsonify({"error": "Không tìm thấy ghi chú"}), 404
-    
-    updated_note = conn.execute("SELECT * FROM notes WHERE id = ?", (note_id,)).fetchone()
-    conn.close()
-    return jsonify(dict(updated_note))
+    reminders.schedule(note_id, reminder_time if updated_note["status"] == "active" else None)
+    return jsonify(updated_note)
 
 @notes_bp.route("/api/delete/<note_id>", methods=["POST"])
 def api_delete_note(note_id):
-    conn = get_db_connection()
-    cursor = conn.execute("DELETE FROM notes WHERE id = ?", (note_id,))
-    conn.commit()
-    conn.close()
-    return jsonify({"success": True}) if cursor.rowcount > 0 else (jsonify({"error": "Không tìm thấy ghi chú"}), 404)
+    _, deleted = run_write_sql("DELETE FROM notes WHERE id = ?", (note_id,))
+    reminders.cancel(note_id)
+    return jsonify({"success": True}) if deleted > 0 else (jsonify({"error": "Không tìm thấy ghi chú"}), 404)
 
 @notes_bp.route("/api/mark/<note_id>", methods=["POST"])
 def api_toggle_mark(note_id):
-    conn = get_db_connection()
-    note = conn.execute("SELECT is_marked FROM notes WHERE id = ?", (note_id,)).fetchone()
-    if not note:
-        conn.close()
+    updated_note = run_write(_toggle_mark_job, note_id)
+    if updated_note is None:
         return jsonify({"error": "Không tìm thấy ghi chú"}), 404
-    
-    new_marked_state = not note["is_marked"]
-    conn.execute("UPDATE notes SET is_marked = ? WHERE id = ?", (new_marked_state, note_id))
-    conn.commit()
-    
-    updated_note = conn.execute("SELECT * FROM notes WHERE id = ?", (note_id,)).fetchone()
-    conn.close()
-    return jsonify(dict(updated_note))
+    return jsonify(updated_note)
 
 @notes_bp.route("/api/acknowledge-notification/<note_id>", methods=["POST"])
 def acknowledge_notification(note_id):
-    conn = get_db_connection()
-    conn.execute("UPDATE notes SET status = 'notified', due_time = NULL WHERE id = ?", (note_id,))
-    conn.commit()
-    conn.close()
+    run_write_sql("UPDATE notes SET status = 'notified', due_time = NULL WHERE id = ?", (note_id,))
+    reminders.cancel(note_id)
+    notifications.discard(note_id)
     return jsonify({"success": True})
 
 @notes_bp.route("/api/check-notifications")
 def api_check_notifications():
-    """Endpoint để frontend kiểm tra xem có thông báo mới không."""
-    check_and_queue_reminders()
-    if NOTIFICATIONS_QUEUE:
-        # Lấy thông báo đầu tiên và xóa khỏi hàng đợi
-        notification_to_send = NOTIFICATIONS_QUEUE.pop(0)
-        return jsonify(notification_to_send)
-    return jsonify(None) # Trả về null nếu không có gì
+    """
+    Endpoint để frontend kiểm tra xem có thông báo mới không (trả về một thông báo hoặc null).
+    ?client=<id tab>: mỗi tab có con trỏ riêng nên tab nào cũng nhận mỗi thông báo một lần.
+    ?wait=<giây>: long-poll, giữ request tới khi có thông báo (tối đa MAX_NOTIFICATION_WAIT).
+    """
+    try:
+        wait = float(request.args.get("wait", 0))
+    except ValueError:
+        return jsonify({"error": "wait phải là số giây"}), 400
+    wait = max(0.0, min(wait, MAX_NOTIFICATION_WAIT))
+    client = (request.args.get("client") or "default")[:64]
+    return jsonify(notifications.next_for(client, wait)) # null nếu không có gì
 
 @notes_bp.route("/sounds/<path:filename>")
 def serve_sound(filename):
@@ -0,0 +1,73 @@
+"""
+Tìm kiếm note qua bảng FTS5 notes_fts (xem database._create_notes_search_index).
+Nếu SQLite không có FTS5 thì quay về LIKE trên title_text / content_text (không có rank / highlight).
+"""
+import html
+
+from app.fts import (
+    DEFAULT_SEARCH_LIMIT, MARK_CLOSE, MARK_OPEN, build_match_query, clamp_limit,
+    fts_available, like_pattern, marked_html, search_tokens,
+)
+
+FTS_TABLE = "notes_fts"
+
+# Trọng số bm25 theo thứ tự NOTES_SEARCH_COLUMNS (note_id không được index)
+SEARCH_WEIGHTS = (0.0, 5.0, 1.0)
+SNIPPET_TOKENS = 16
+
+
+def _search_fts(conn, tokens, limit):
+    weights = ", ".join(str(weight) for weight in SEARCH_WEIGHTS)
+    sql = f"""
+        SELECT note_id,
+               highlight(notes_fts, 1, '{MARK_OPEN}', '{MARK_CLOSE}') AS title,
+               snippet(notes_fts, 2, '{MARK_OPEN}', '{MARK_CLOSE}', '…', {SNIPPET_TOKENS}) AS snippet,
+               bm25(notes_fts, {weights}) AS rank
+        FROM notes_fts
+        WHERE notes_fts MATCH ?
+        ORDER BY rank
+        LIMIT ?
+    """
+    return [
+        {
+            "id": row["note_id"],
+            "title": marked_html(row["title"]),
+            "snippet": marked_html(row["snippet"]),
+            "rank": row["rank"],
+        }
+        for row in conn.execute(sql, (build_match_query(tokens), limit))
+    ]
+
+
+def _search_like(conn, tokens, limit):
+    """Fallback không FTS5: mỗi từ khóa phải xuất hiện (substring) trong tiêu đề hoặc nội dung."""
+    where, params = [], []
+    for token in tokens:
+        pattern = like_pattern(token)
+        where.append("(title_text LIKE ? ESCAPE '\\' OR content_text LIKE ? ESCAPE '\\')")
+        params.extend([pattern, pattern])
+    sql = f"""
+        SELECT id, title_text, preview FROM notes
+        WHERE {" AND ".join(where)}
+        ORDER BY modified_at DESC, id DESC
+        LIMIT ?
+    """
+    return [
+        {"id": row["id"], "title": html.escape(row["title_text"] or ""), "snippet": html.escape(row["preview"] or ""), "rank": None}
+        for row in conn.execute(sql, params + [limit])
+    ]
+
+
+def search_notes(conn, q, limit=DEFAULT_SEARCH_LIMIT):
+    """
+    Tìm note theo tiêu đề / nội dung (khớp tiền tố). Trả về (engine, danh sách kết quả).
+    Mỗi kết quả chỉ gồm id, title và snippet (HTML đã escape, phần khớp bọc <mark>)
+    và rank (bm25, càng nhỏ càng khớp).
+    """
+    tokens = search_tokens(q)
+    if not tokens:
+        return ("fts5" if fts_available(conn, FTS_TABLE) else "like"), []
+    limit = clamp_limit(limit)
+    if fts_available(conn, FTS_TABLE):
+        return "fts5", _search_fts(conn, tokens, limit)
+    return "like", _search_like(conn, tokens, limit)
@@ -1649,16 +1649,44 @@ document.addEventListener('DOMContentLoaded', function () {
         const colorPalette = document.querySelector('#notes-context-menu .color-palette');
 
         // --- Core Functions ---
+        // Danh sách chỉ có preview; tải từng trang NOTES_PAGE_SIZE note, nội dung đầy đủ lấy khi mở note
+        const NOTES_PAGE_SIZE = 60;
+
+        async function fetchNotesPage(after) {
+            const params = new URLSearchParams({ limit: NOTES_PAGE_SIZE });
+            if (after) params.set('after', after);
+            const response = await fetch(`/notes/api/get?${params}`);
+            if (!response.ok) throw new Error(`HTTP ${response.status}`);
+            return { notes: await response.json(), next: response.headers.get('X-Next-Cursor') };
+        }
+
+        function renderLoadMoreButton(next) {
+            const col = document.createElement('div');
+            col.className = 'col-12 text-center notes-load-more';
+            col.innerHTML = `<button class="btn btn-sm btn-outline-secondary">Xem thêm ghi chú</button>`;
+            col.querySelector('button').addEventListener('click', async () => {
+                col.remove();
+                try {
+                    const page = await fetchNotesPage(next);
+                    page.notes.forEach(note => container.appendChild(createNoteCard(note)));
+                    if (page.next) renderLoadMoreButton(page.next);
+                } catch (error) {
+                    showAlert(`Lỗi tải ghi chú: ${error.message}`);
+                }
+            });
+            container.appendChild(col);
+        }
+
         async function fetchAndRenderNotes() {
             try {
-                const response = await fetch('/notes/api/get');
-                const notes = await response.json();
+                const page = await fetchNotesPage(null);
                 container.innerHTML = '';
-                if (notes.length === 0) {
+                if (page.notes.length === 0) {
                     container.innerHTML = `<div class="col-12 text-center text-muted p-5"><h6>Chưa có ghi chú nào.</h6><p>Hãy nhấn "Thêm Mới" để bắt đầu.</p></div>`;
                     return;
                 }
-                notes.forEach(note => container.appendChild(createNoteCard(note)));
+                page.notes.forEach(note => container.appendChild(createNoteCard(note)));
+                if (page.next) renderLoadMoreButton(page.next);
             } catch (error) {
                 container.innerHTML = `<div class="col-12 text-center text-danger p-5"><h6>Lỗi tải ghi chú.</h6><p>${error.message}</p></div>`;
             }
@@ -1679,8 +1707,8 @@ document.addEventListener('DOMContentLoaded', function () {
                 statusHTML = `<small class="text-warning fw-bold"><i class="bi bi-alarm-fill"></i> <span id="countdown-${note.id}" data-due-time="${note.due_time}">Đang tính...</span></small>`;
             }
 
-            const noteTitleText = note.title_html.trim() || "Ghi chú không có tiêu đề";
-            const noteBodyHtml = note.content_html.trim() || '';
+            const noteTitleText = (note.title_html || '').trim() || "Ghi chú không có tiêu đề";
+            const notePreview = (note.preview || '').trim();
 
             col.innerHTML = `
                 <div class="card h-100 w-100" style="border-left: 4px solid ${borderColor};">
@@ -1702,7 +1730,8 @@ document.addEventListener('DOMContentLoaded', function () {
 
             const noteBodyElement = col.querySelector('.card-note-body');
             if (noteBodyElement) {
-                noteBodyElement.innerHTML = noteBodyHtml || '...';
+                // preview là text thuần -> textContent
+                noteBodyElement.textContent = notePreview || '...';
             }
             const modifiedAtElement = col.querySelector(`#note-modified-at-${note.id}`);
             if (modifiedAtElement && note.modified_at) {
@@ -1777,9 +1806,8 @@ document.addEventListener('DOMContentLoaded', function () {
         };
 
         window.prepareEditNoteModal = async (id) => {
-            const response = await fetch('/notes/api/get');
-            const notesList = await response.json();
-            const note = notesList.find(n => n.id === id);
+            const response = await fetch(`/notes/api/${encodeURIComponent(id)}`);
+            const note = response.ok ? await response.json() : null;
 
             if (!note) {
                 showAlert("Không thể tìm thấy ghi chú để sửa.");
@@ -1898,26 +1926,36 @@ document.addEventListener('DOMContentLoaded', function () {
             }
         });
         
-        // --- Notification Polling ---
-        setInterval(async () => {
-            try {
-                const response = await fetch('/notes/api/check-notifications');
-                const notification = await response.json();
-                if (notification) {
-                    notificationTitle.textContent = notification.title;
-                    notificationContent.innerHTML = notification.notes || 'Không có nội dung chi tiết.';
-                    // Use dynamic sound URL from backend
-                    notificationSound.src = notification.sound_url;
-                    notificationSound.play().catch(e => console.log("User interaction needed to play sound."));
-                    notificationModal.show();
-                    if (document.getElementById('notes-tool-pane').classList.contains('active')) {
-                        fetchAndRenderNotes();
+        // --- Notification Long-Polling ---
+        // Mỗi tab có client id riêng để tab nào cũng nhận được thông báo;
+        // server giữ request tới 30s và trả về ngay khi có nhắc hẹn đến hạn.
+        const notificationClientId = (window.crypto && crypto.randomUUID)
+            ? crypto.randomUUID()
+            : `${Date.now()}-${Math.random().toString(36).slice(2)}`;
+        async function pollNotifications() {
+            while (true) {
+                try {
+                    const response = await fetch(`/notes/api/check-notifications?wait=30&client=${notificationClientId}`);
+                    const notification = await response.json();
+                    if (notification) {
+                        notificationTitle.textContent = notification.title;
+                        notificationContent.innerHTML = notification.notes || 'Không có nội dung chi tiết.';
+                        // Use dynamic sound URL from backend
+                        notificationSound.src = notification.sound_url;
+                        notificationSound.play().catch(e => console.log("User interaction needed to play sound."));
+                        notificationModal.show();
+                        if (document.getElementById('notes-tool-pane').classList.contains('active')) {
+                            fetchAndRenderNotes();
+                        }
                     }
+                } catch (error) {
+                    console.error("Error polling for notifications:", error);
+                    // Server tắt / lỗi mạng: chờ rồi thử lại
+                    await new Promise(resolve => setTimeout(resolve, 10000));
                 }
-            } catch (error) {
-                console.error("Error polling for notifications:", error);
             }
-        }, 10000); // Check every 10 seconds
+        }
+        pollNotifications();
 
         // Thay thế listener cũ bằng listener này
             titleInput.addEventListener('contextmenu', e => {
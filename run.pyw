@@ -8,7 +8,6 @@ import json
 
 # Internal module imports
 from app import create_app
-from app.database import init_database
 # Import the settings loader directly
 from app.settings_routes import load_dashboard_settings, DASHBOARD_SETTINGS_FILE 
 
@@ -85,10 +84,8 @@ def create_tray_icon(is_first_run):
 def run_server():
     """Runs the Flask server in the current thread."""
     try:
-        # Only initialize DB if it's the main process (not a reloader instance)
+        # Database is initialized (and background reminders started) by create_app()
         if os.environ.get("WERKZEUG_RUN_MAIN") != "true":
-            print(f"[{APP_NAME}] Initializing database...")
-            init_database()
             print(f"[{APP_NAME}] Starting Flask server on {BASE_URL} (Thread: {threading.current_thread().name})")
         
         # use_reloader=False is CRITICAL for multi-threading stability
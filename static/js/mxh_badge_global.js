@@ -1,8 +1,11 @@
 // Global MXH Badge - robust selectors + CSS fallback, zero UI render
 (function () {
     // ===== Config =====
-    const FETCH_URL = '/mxh/api/accounts';
+    const FETCH_URL = '/mxh/api/attention-summary'; // server tính sẵn, chỉ vài byte
     const INTERVAL_MS = 15000; // 15s
+    const STREAM_URL = '/mxh/api/stream';
+    const STREAM_FALLBACK_INTERVAL_MS = 120000; // SSE đang kết nối: chỉ poll thưa để tự sửa lệch
+    const STREAM_DEBOUNCE_MS = 300;
     const SELECTOR_CANDIDATES = [
         // khuyến nghị: add data-tab="mxh" vào nav link để bắt chắc 100%
         '[data-tab="mxh"]',
@@ -40,6 +43,9 @@
     let observer = null;
     let currentText = null;
     let currentCritical = false;
+    let eventSource = null;
+    let streamTimer = null;
+    let intervalMs = INTERVAL_MS;
 
     // ===== Utils =====
     const norm = s => (s || '').toLowerCase()
@@ -105,62 +111,15 @@
         return n > 9 ? '9+' : String(n);
     }
 
-    function computeBadgeState(accounts) {
-        const now = Date.now();
-        let expiredNoticeCount = 0;
-        let oneYearNoHKChangeCount = 0;
-
-        for (const acc of accounts) {
-            // 1) notice hết hạn
-            const notice = acc?.notice ?? acc?.notice_info ?? acc?.noticeStatus;
-            if (notice) {
-                const expired =
-                    notice.expired === true ||
-                    notice.status === 'expired' ||
-                    notice.state === 'expired' ||
-                    (notice.expires_at && new Date(notice.expires_at).getTime() <= now) ||
-                    (notice.expiresAt && new Date(notice.expiresAt).getTime() <= now);
-                if (expired) expiredNoticeCount++;
-            }
-            // 2) WeChat >= 1 năm chưa đổi số HK
-            const platform = (acc?.platform || acc?.type || '').toLowerCase();
-            const isWeChat = platform.includes('wechat') || platform === 'wx' || platform === 'weixin';
-            if (isWeChat) {
-                const createdAt = acc?.created_at ?? acc?.createdAt ?? acc?.created ?? acc?.joined_at;
-                let ageDays = acc?.age_days ?? acc?.ageDays;
-                if (!ageDays && createdAt) {
-                    const t = new Date(createdAt).getTime();
-                    if (Number.isFinite(t)) ageDays = Math.floor((now - t) / 86400000);
-                }
-                const lastChange =
-                    acc?.hk_changed_at ??
-                    acc?.last_number_change_at ??
-                    acc?.hkChangedAt ??
-                    acc?.lastNumberChangeAt;
-
-                let changedDaysAgo = null;
-                if (lastChange) {
-                    const lt = new Date(lastChange).getTime();
-                    if (Number.isFinite(lt)) changedDaysAgo = Math.floor((now - lt) / 86400000);
-                }
-
-                const isAgeGte1y =
-                    (typeof ageDays === 'number' && ageDays >= 365) ||
-                    (!!createdAt && Number.isFinite(new Date(createdAt).getTime()) &&
-                        (now - new Date(createdAt).getTime()) >= 365 * 86400000);
-
-                if (isAgeGte1y && (changedDaysAgo === null || changedDaysAgo >= 365)) {
-                    oneYearNoHKChangeCount++;
-                }
-            }
-        }
-
-        const totalAttention = expiredNoticeCount + oneYearNoHKChangeCount;
+    function computeBadgeState(summary) {
+        const expiredNoticeCount = Number(summary?.expiredNoticeCount) || 0;
+        const oneYearNoHKChangeCount = Number(summary?.oneYearNoHKChangeCount) || 0;
+        const totalAttention = Number(summary?.totalAttention) || (expiredNoticeCount + oneYearNoHKChangeCount);
         const showExclamation = expiredNoticeCount > 0;
         return { totalAttention, showExclamation, expiredNoticeCount, oneYearNoHKChangeCount };
     }
 
-    async function fetchAccountsMinimal(signal) {
+    async function fetchAttentionSummary(signal) {
         const res = await fetch(FETCH_URL, {
             method: 'GET',
             credentials: 'same-origin',
@@ -168,13 +127,7 @@
             signal
         }).catch(() => null);
         if (!res || !res.ok) return null;
-        const json = await res.json().catch(() => null);
-        if (!json) return null;
-        const accounts = Array.isArray(json?.accounts) ? json.accounts
-                        : Array.isArray(json?.data)    ? json.data
-                        : Array.isArray(json)          ? json
-                        : null;
-        return accounts || null;
+        return await res.json().catch(() => null);
     }
 
     async function updateGlobalMXHBadge() {
@@ -185,10 +138,10 @@
             controller?.abort();
             controller = new AbortController();
 
-            const accounts = await fetchAccountsMinimal(controller.signal);
-            if (!accounts) { setBadgeText(null, false); return; }
+            const summary = await fetchAttentionSummary(controller.signal);
+            if (!summary) { setBadgeText(null, false); return; }
 
-            const state = computeBadgeState(accounts);
+            const state = computeBadgeState(summary);
             const nextText = formatBadgeText(state);
             const nextCritical = !!state.showExclamation;
 
@@ -204,12 +157,47 @@
         }
     }
 
+    // ===== SSE: server đẩy sự kiện khi dữ liệu MXH thay đổi =====
+    function setPollInterval(ms) {
+        if (intervalMs === ms) return;
+        intervalMs = ms;
+        if (intervalId !== null) {
+            clearInterval(intervalId);
+            intervalId = window.setInterval(updateGlobalMXHBadge, intervalMs);
+        }
+    }
+
+    function openStream() {
+        if (eventSource || typeof EventSource === 'undefined') return;
+        eventSource = new EventSource(STREAM_URL);
+        eventSource.addEventListener('open', () => setPollInterval(STREAM_FALLBACK_INTERVAL_MS));
+        eventSource.addEventListener('change', () => {
+            // gộp nhiều thay đổi liên tiếp thành 1 lần cập nhật
+            clearTimeout(streamTimer);
+            streamTimer = setTimeout(updateGlobalMXHBadge, STREAM_DEBOUNCE_MS);
+        });
+        eventSource.addEventListener('error', () => {
+            setPollInterval(INTERVAL_MS);
+            if (eventSource && eventSource.readyState === EventSource.CLOSED) eventSource = null;
+        });
+    }
+
+    function closeStream() {
+        clearTimeout(streamTimer); streamTimer = null;
+        eventSource?.close(); eventSource = null;
+        intervalMs = INTERVAL_MS;
+    }
+
     function start() {
         if (intervalId !== null) return;
         updateGlobalMXHBadge();
-        intervalId = window.setInterval(updateGlobalMXHBadge, INTERVAL_MS);
+        intervalId = window.setInterval(updateGlobalMXHBadge, intervalMs);
+        openStream();
+    }
+    function stop() {
+        if (intervalId !== null) { clearInterval(intervalId); intervalId = null; }
+        closeStream(); // tab ẩn thì trả lại worker thread cho server
     }
-    function stop() { if (intervalId !== null) { clearInterval(intervalId); intervalId = null; } }
     function onVisibilityChange() { if (document.hidden) stop(); else start(); }
 
     function ensureAnchorsThenStart() {